@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Stage-Level Benchmark for the Medical AI Pipeline
+Times every stage of complete_analysis on synthetic radiographs and writes machine-readable JSON
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import platform
+import logging
+import argparse
+import subprocess
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger('benchmark_pipeline')
+
+BENCHMARK_SCHEMA_VERSION = 2
+
+# Stages in the order complete_analysis runs them
+STAGES = ('decode', 'preprocess', 'clip', 'densenet', 'ensemble', 'report_fallback', 'gradcam', 'heatmap',
+          'quality')
+
+
+def synthetic_radiograph(size: int, seed: int = 0) -> np.ndarray:
+    """
+    Chest-radiograph-like uint8 (size, size) image: dark lung fields, a
+    bright mediastinum and spine, rib arcs, soft tissue falloff and noise.
+
+    Deterministic per (size, seed), so runs on different commits see identical pixels.
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    image = 0.75 - 0.25 * ((x - 0.5) ** 2 + (y - 0.55) ** 2)
+    for center in (0.3, 0.7):
+        lung = ((x - center) / 0.17) ** 2 + ((y - 0.5) / 0.3) ** 2
+        image -= 0.35 * np.clip(1.0 - lung, 0.0, 1.0)
+    image += 0.3 * np.exp(-((x - 0.5) / 0.06) ** 2)
+    image += 0.06 * np.sin(2 * np.pi * 9 * (y + 0.15 * np.abs(x - 0.5))) * (np.abs(x - 0.5) > 0.08)
+    image += rng.normal(0.0, 0.02, image.shape).astype(np.float32)
+    return (np.clip(image, 0.0, 1.0) * 255).astype(np.uint8)
+
+
+def encode_image(array: np.ndarray, image_format: str = 'png') -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(array, mode='L').save(buffer, format='JPEG' if image_format in ('jpg', 'jpeg') else 'PNG')
+    return buffer.getvalue()
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def summarize(samples: List[float], images: int) -> Dict[str, Any]:
+    """First-pass sample and statistics of the rest (warm), in milliseconds"""
+    first, warm = samples[0], samples[1:] or samples[:1]
+    return {
+        'first_pass_ms': round(1000 * first, 3),
+        'warm_ms': round(1000 * float(np.median(warm)), 3),
+        'warm_min_ms': round(1000 * min(warm), 3),
+        'warm_p90_ms': round(1000 * float(np.percentile(warm, 90)), 3),
+        'warm_ms_per_image': round(1000 * float(np.median(warm)) / images, 3)
+    }
+
+
+class PipelineBenchmark:
+    """
+    Runs the stages of ``complete_analysis`` one at a time on a batch of
+    synthetic images, so each stage gets its own timing.
+
+    Every configuration (resolution x batch size x thread count) is run
+    ``repeat + 1`` times; the first pass is reported separately from the
+    rest (warm). It is only a cold start for the first configuration: later
+    ones reuse the process's allocator pools and compiled kernels, so their
+    first pass mostly measures the new input shape. The same batch also
+    runs end to end through ``complete_analysis_batch``.
+    """
+
+    def __init__(self, pipeline, xray_type: str = 'chest', image_format: str = 'png'):
+        self.pipeline = pipeline
+        self.xray_type = xray_type
+        self.image_format = image_format
+
+    def run_stages(self, encoded: List[bytes]) -> Dict[str, float]:
+        """One timed pass over every stage; returns seconds per stage"""
+        from services.image_io import DecodedImage
+
+        pipeline = self.pipeline
+        types = [self.xray_type] * len(encoded)
+        seconds = {}
+
+        def timed(stage, work):
+            started = time.perf_counter()
+            value = work()
+            seconds[stage] = time.perf_counter() - started
+            return value
+
+        images = [DecodedImage(data) for data in encoded]
+        timed('decode', lambda: [image.array for image in images])
+        timed('preprocess', lambda: [pipeline.preprocess_image(image) for image in images])
+        clip_results = timed('clip', lambda: pipeline.analyze_with_medclip_batch(images, types))
+        cam_capture = {}
+        densenet_results = timed('densenet', lambda: pipeline.analyze_with_densenet_batch(
+            images, types, cam_capture=cam_capture) if pipeline.densenet_model else [None] * len(images))
+        diagnoses = timed('ensemble', lambda: [
+            pipeline._combine_diagnoses(self.xray_type, clip, densenet)
+            for clip, densenet in zip(clip_results, densenet_results)
+        ])
+        timed('report_fallback', lambda: [pipeline.fallback_report(d, {}, self.xray_type) for d in diagnoses])
+
+        maps = timed('gradcam', lambda: pipeline.densenet_grad_cam(
+            cam_capture, list(range(len(images))), types, [d['primary_diagnosis'] for d in diagnoses]))
+        timed('heatmap', lambda: [pipeline.generate_heatmap(image, d, m)
+                                  for image, d, m in zip(images, diagnoses, maps)])
+        timed('quality', lambda: [pipeline.assess_image_quality(image) for image in images])
+        return seconds
+
+    def run_end_to_end(self, encoded: List[bytes]) -> float:
+        started = time.perf_counter()
+        results = self.pipeline.complete_analysis_batch(list(encoded), self.xray_type, batch_size=len(encoded))
+        elapsed = time.perf_counter() - started
+        failed = [r.get('error') for r in results if not r.get('success')]
+        if failed:
+            raise RuntimeError(f"End-to-end analysis failed: {failed[0]}")
+        return elapsed
+
+    def run_config(self, resolution: int, batch_size: int, threads: Optional[int], repeat: int) -> Dict[str, Any]:
+        """Time one configuration; a ``threads`` override only lasts for this configuration"""
+        import torch
+        from services.runtime_config import RuntimeConfig
+
+        default_threads = torch.get_num_threads()
+        runtime = RuntimeConfig(intra_op_threads=threads).apply() if threads else None
+        try:
+            encoded = [encode_image(synthetic_radiograph(resolution, seed), self.image_format)
+                       for seed in range(batch_size)]
+
+            stage_samples = {stage: [] for stage in STAGES}
+            end_to_end = []
+            for _ in range(repeat + 1):
+                for stage, value in self.run_stages(encoded).items():
+                    stage_samples[stage].append(value)
+                end_to_end.append(self.run_end_to_end(encoded))
+        finally:
+            torch.set_num_threads(default_threads)
+
+        warm_total = float(np.median(end_to_end[1:] or end_to_end))
+        return {
+            'resolution': resolution,
+            'batch_size': batch_size,
+            'intra_op_threads': runtime['intra_op_threads'] if runtime else None,
+            'encoded_bytes_per_image': int(np.mean([len(data) for data in encoded])),
+            'stages': {stage: summarize(samples, batch_size) for stage, samples in stage_samples.items()},
+            'end_to_end': summarize(end_to_end, batch_size),
+            'images_per_second': round(batch_size / warm_total, 3) if warm_total else None
+        }
+
+
+def config_key(result: Dict[str, Any]) -> str:
+    """Stable name of a configuration, used to match runs across commits"""
+    threads = result['intra_op_threads']
+    return f"{result['resolution']}px/b{result['batch_size']}/t{threads if threads else 'default'}"
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """Warm stage timings that got slower than the baseline by more than ``tolerance`` (0.2 = 20%)"""
+    regressions = []
+    for key, result in current['results'].items():
+        previous = baseline.get('results', {}).get(key)
+        if not previous:
+            continue
+        timings = dict(result['stages'], end_to_end=result['end_to_end'])
+        previous_timings = dict(previous.get('stages', {}), end_to_end=previous.get('end_to_end'))
+        for stage, timing in timings.items():
+            before = (previous_timings.get(stage) or {}).get('warm_ms')
+            if before and timing['warm_ms'] > before * (1 + tolerance):
+                regressions.append({
+                    'config': key,
+                    'stage': stage,
+                    'baseline_ms': before,
+                    'current_ms': timing['warm_ms'],
+                    'change': round(timing['warm_ms'] / before - 1, 3)
+                })
+    return regressions
+
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(part) for part in value.split(',') if part.strip()]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[-1])
+    parser.add_argument('--resolutions', type=parse_int_list, default=[512, 1024, 2048],
+                        help='Comma-separated square image sizes to generate')
+    parser.add_argument('--batch-sizes', type=parse_int_list, default=[1, 4],
+                        help='Comma-separated batch sizes')
+    parser.add_argument('--threads', type=parse_int_list, default=[],
+                        help='Comma-separated intra-op thread counts (default: the runtime default only)')
+    parser.add_argument('--repeat', type=int, default=3, help='Warm passes per configuration')
+    parser.add_argument('--xray-type', default='chest')
+    parser.add_argument('--format', choices=('png', 'jpg'), default='png', help='Encoding of the synthetic images')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--compare', metavar='BASELINE', help='Earlier report to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Relative slowdown of a warm timing reported as a regression')
+    args = parser.parse_args(argv)
+
+    # Benchmarks measure the local pipeline: no LLM calls, no cached results.
+    # Set here rather than on import so importing this module changes nothing
+    os.environ['USE_DEEPSEEK'] = 'false'
+    os.environ['XRAY_AI_RESULT_CACHE'] = 'false'
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import torch
+    import medical_ai_pipeline
+    from services.structured_logging import configure_logging
+    configure_logging()
+
+    started = time.perf_counter()
+    pipeline = medical_ai_pipeline.MedicalAIPipeline()
+    startup_seconds = time.perf_counter() - started
+    benchmark = PipelineBenchmark(pipeline, args.xray_type, args.format)
+
+    results = {}
+    for threads in args.threads or [None]:
+        for resolution in args.resolutions:
+            for batch_size in args.batch_sizes:
+                logger.info('Benchmark: %spx, batch %s, threads %s', resolution, batch_size, threads or 'default')
+                result = benchmark.run_config(resolution, batch_size, threads, max(1, args.repeat))
+                results[config_key(result)] = result
+
+    report = {
+        'schema_version': BENCHMARK_SCHEMA_VERSION,
+        'timestamp': datetime.now().isoformat(),
+        'commit': git_commit(),
+        'environment': {
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'runtime': pipeline.runtime_settings,
+            'models': pipeline.get_model_stats()
+        },
+        'settings': {
+            'repeat': max(1, args.repeat),
+            'xray_type': args.xray_type,
+            'format': args.format
+        },
+        'startup': {
+            'seconds': round(startup_seconds, 3),
+            'initialization': {name: round(seconds, 4) for name, seconds in pipeline.init_timings.items()}
+        },
+        'results': results
+    }
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare) as f:
+            report['regressions'] = compare(report, json.load(f), args.tolerance)
+        exit_code = 1 if report['regressions'] else 0
+        (logger.warning if exit_code else logger.info)('%s regression(s) against %s', len(report['regressions']),
+                                                       args.compare)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
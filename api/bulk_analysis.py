@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Bulk Analysis for the Medical AI Pipeline
+Analyzes directories or CSV/JSONL manifests of X-rays into a resumable JSON-lines results file
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import logging
+import argparse
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Any, Iterable, Iterator, Optional, Set, Tuple
+
+logger = logging.getLogger('bulk_analysis')
+
+MANIFEST_EXTENSIONS = ('.csv', '.jsonl')
+
+
+@dataclass
+class BulkItem:
+    """One study to analyze; ``id`` is what the results file records it under"""
+    id: str
+    image_path: str
+    xray_type: str = 'chest'
+    frame: int = 0
+    patient_info: Dict[str, Any] = field(default_factory=dict)
+
+
+def _item_from_row(row: Dict[str, Any], base_dir: str, xray_type: str, where: str) -> BulkItem:
+    image_path = row.get('image_path') or row.get('path')
+    if not image_path:
+        raise ValueError(f"{where}: missing 'image_path'")
+    if not os.path.isabs(image_path):
+        # Relative to the manifest, so a manifest and its images can be moved together
+        image_path = os.path.join(base_dir, image_path)
+    frame = int(row.get('frame') or 0)
+    patient_info = row.get('patient_info') or {}
+    if isinstance(patient_info, str):
+        patient_info = json.loads(patient_info)
+    default_id = image_path if not frame else f"{image_path}#{frame}"
+    return BulkItem(
+        id=str(row.get('id') or default_id),
+        image_path=image_path,
+        xray_type=row.get('xray_type') or xray_type,
+        frame=frame,
+        patient_info=patient_info
+    )
+
+
+def read_manifest(path: str, xray_type: str = 'chest') -> Iterator[BulkItem]:
+    """
+    Studies listed in a CSV (with a header row) or JSONL manifest.
+
+    Each row needs ``image_path`` (or ``path``); ``id``, ``xray_type``,
+    ``frame`` and ``patient_info`` (a JSON object) are optional.
+
+    Raises:
+        ValueError: If a row has no image path or a JSONL line is not an object
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            for line_number, row in enumerate(csv.DictReader(f), start=2):
+                yield _item_from_row(row, base_dir, xray_type, f"{path}:{line_number}")
+            return
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError(f"{path}:{line_number}: expected a JSON object")
+            yield _item_from_row(row, base_dir, xray_type, f"{path}:{line_number}")
+
+
+def collect_items(inputs: Iterable[str], xray_type: str = 'chest', recursive: bool = False) -> List[BulkItem]:
+    """Expand manifests, directories and single files into the list of studies, in input order"""
+    from services.image_io import list_image_files
+
+    items = []
+    for path in inputs:
+        if os.path.isfile(path) and path.lower().endswith(MANIFEST_EXTENSIONS):
+            items.extend(read_manifest(path, xray_type))
+        else:
+            items.extend(BulkItem(id=image_path, image_path=image_path, xray_type=xray_type)
+                         for image_path in list_image_files([path], recursive=recursive))
+    return items
+
+
+class ResultsJournal:
+    """
+    Append-only JSON-lines results file that doubles as the checkpoint.
+
+    Each batch's lines are flushed and fsynced before the next batch is
+    taken, so after an interruption every line in the file is a finished
+    study and a rerun skips exactly those IDs. A line cut off mid-write is
+    truncated away on open. When an ID has several lines (a failure
+    retried with ``retry_failed``), its last line decides its status.
+    """
+
+    def __init__(self, path: str, retry_failed: bool = False):
+        self.path = path
+        self.completed: Set[str] = set()
+        self.failed_before = 0
+        self._repair()
+        self._load(retry_failed)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _repair(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                keep = data.rfind(b'\n') + 1
+                logger.warning('Dropping an incomplete last line (%s bytes) from %s', len(data) - keep, self.path)
+                f.truncate(keep)
+
+    def _load(self, retry_failed: bool):
+        if not os.path.exists(self.path):
+            return
+        succeeded: Dict[str, bool] = {}
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                succeeded[entry.get('id')] = bool(entry.get('success'))
+        for study_id, success in succeeded.items():
+            if success or not retry_failed:
+                self.completed.add(study_id)
+            if not success:
+                self.failed_before += 1
+
+    def write(self, item: BulkItem, result: Dict[str, Any]):
+        entry = {'id': item.id, 'image_path': item.image_path, 'frame': item.frame, **result}
+        self._file.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+        self.completed.add(item.id)
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
+
+class ProgressReporter:
+    """Counts finished studies and logs throughput every ``interval`` seconds"""
+
+    def __init__(self, total: int, interval: float = 10.0):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self.start()
+
+    def start(self):
+        """Restart the clock, e.g. once the models are loaded"""
+        self.started = self._last_report = time.perf_counter()
+
+    def record(self, success: bool):
+        self.done += 1
+        if not success:
+            self.failed += 1
+
+    @property
+    def images_per_second(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def maybe_report(self, force: bool = False):
+        now = time.perf_counter()
+        if not force and now - self._last_report < self.interval:
+            return
+        self._last_report = now
+        rate = self.images_per_second
+        remaining = self.total - self.done
+        logger.info('Progress: %s/%s images, %.2f images/s, %s failed, ETA %s', self.done, self.total, rate,
+                    self.failed, f"{remaining / rate:.0f}s" if rate else 'unknown',
+                    extra={'done': self.done, 'total': self.total, 'failed': self.failed,
+                           'images_per_second': round(rate, 3)})
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'processed': self.done,
+            'failed': self.failed,
+            'seconds': round(time.perf_counter() - self.started, 3),
+            'images_per_second': round(self.images_per_second, 3)
+        }
+
+
+def _decode(item: BulkItem):
+    """Prefetch stage: read, hash and decode one study off the inference thread"""
+    from services.image_io import DecodedImage
+
+    image = DecodedImage(item.image_path, frame=item.frame)
+    image.array
+    image.digest
+    # The bytes are no longer needed; batches sent to pool workers stay small
+    image.release_encoded()
+    return image
+
+
+class BulkRunner:
+    """
+    Streams studies through a prefetching decode stage into batched analysis.
+
+    ``decode_workers`` threads decode up to ``prefetch`` studies ahead of
+    the models. Batches of ``batch_size`` decoded studies go to
+    ``analyzer`` (the pipeline, or an InferencePool), with up to
+    ``max_in_flight`` batches outstanding; results are journaled in
+    batch order.
+
+    On Ctrl-C the batches that already finished are journaled, queued
+    decodes and batches that have not started are cancelled, and the
+    KeyboardInterrupt is re-raised.
+    """
+
+    def __init__(self, analyzer, journal: ResultsJournal, batch_size: int = 8, decode_workers: int = 2,
+                 prefetch: int = 32, max_in_flight: int = 1, heatmap_mode: str = 'none',
+                 tta_views: Optional[int] = None, pool=None):
+        self.analyzer = analyzer
+        self.journal = journal
+        self.batch_size = max(1, batch_size)
+        self.decode_workers = max(1, decode_workers)
+        self.prefetch = max(self.batch_size, prefetch)
+        self.max_in_flight = max(1, max_in_flight)
+        self.heatmap_mode = heatmap_mode
+        self.tta_views = tta_views
+        self.pool = pool
+
+    def _submit(self, executor: ThreadPoolExecutor, batch: List[Tuple[BulkItem, Any]]) -> Future:
+        kwargs = {
+            'image_paths': [image for _, image in batch],
+            'xray_types': [item.xray_type for item, _ in batch],
+            'patient_infos': [item.patient_info for item, _ in batch],
+            'batch_size': len(batch),
+            'tta_views': self.tta_views,
+            'heatmap_modes': self.heatmap_mode,
+            'request_ids': [item.id for item, _ in batch]
+        }
+        if self.pool is not None:
+            return self.pool.submit(kwargs)
+        return executor.submit(lambda: self.analyzer.complete_analysis_batch(**kwargs))
+
+    def _finish(self, batch: List[Tuple[BulkItem, Any]], future: Future, progress: ProgressReporter):
+        try:
+            results = future.result()
+        except Exception as e:
+            logger.error('Batch of %s image(s) failed: %s', len(batch), e)
+            results = [{'success': False, 'error': str(e), 'timestamp': datetime.now().isoformat()}] * len(batch)
+        for (item, _), result in zip(batch, results):
+            self.journal.write(item, result)
+            progress.record(bool(result.get('success')))
+        self.journal.sync()
+        progress.maybe_report()
+
+    def run(self, items: List[BulkItem], progress: ProgressReporter):
+        progress.start()
+        pending = iter(items)
+        decoding: deque = deque()
+        in_flight: deque = deque()
+
+        decoder = ThreadPoolExecutor(self.decode_workers, thread_name_prefix='bulk-decode')
+        analyzer = ThreadPoolExecutor(1, thread_name_prefix='bulk-analyze')
+
+        def refill():
+            while len(decoding) < self.prefetch:
+                item = next(pending, None)
+                if item is None:
+                    return
+                decoding.append((item, decoder.submit(_decode, item)))
+
+        try:
+            refill()
+            while decoding or in_flight:
+                batch = []
+                while decoding and len(batch) < self.batch_size:
+                    item, decoded = decoding.popleft()
+                    refill()
+                    try:
+                        batch.append((item, decoded.result()))
+                    except Exception as e:
+                        logger.warning('Could not decode %s: %s', item.image_path, e, extra={'request_id': item.id})
+                        self.journal.write(item, {'success': False, 'error': f'Failed to load image: {e}',
+                                                  'timestamp': datetime.now().isoformat()})
+                        progress.record(False)
+                if batch:
+                    in_flight.append((batch, self._submit(analyzer, batch)))
+                # Wait for the oldest batch once enough are queued, or when nothing is left to submit
+                while in_flight and (len(in_flight) >= self.max_in_flight or not decoding):
+                    self._finish(*in_flight.popleft(), progress)
+                    if decoding:
+                        break
+        except KeyboardInterrupt:
+            decoder.shutdown(wait=False, cancel_futures=True)
+            analyzer.shutdown(wait=False, cancel_futures=True)
+            # Keep what is already done; everything else is analyzed again on resume
+            for batch, future in in_flight:
+                if future.done() and not future.cancelled():
+                    self._finish(batch, future, progress)
+                else:
+                    future.cancel()
+            raise
+        decoder.shutdown()
+        analyzer.shutdown()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[-1])
+    parser.add_argument('inputs', nargs='+', help='Image files, directories, or .csv/.jsonl manifests')
+    parser.add_argument('--output', '-o', required=True,
+                        help='JSON-lines results file; rerunning with the same file resumes the run')
+    parser.add_argument('--xray-type', default='chest', help='X-ray type for studies that do not name one')
+    parser.add_argument('--recursive', action='store_true', help='Also look for images in subdirectories')
+    parser.add_argument('--batch-size', type=int, default=8, help='Studies per batched model forward')
+    parser.add_argument('--decode-workers', type=int, default=2, help='Threads decoding images ahead of the models')
+    parser.add_argument('--prefetch', type=int, default=32, help='Studies decoded ahead of the models')
+    parser.add_argument('--heatmap', choices=('none', 'compact', 'full'), default='none',
+                        help='Heatmap output per study (default: none)')
+    parser.add_argument('--tta-views', type=int, default=None, help='Test-time augmentation views per study')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='Analyze studies again whose earlier result was an error')
+    parser.add_argument('--progress-interval', type=float, default=10.0, help='Seconds between progress lines')
+    parser.add_argument('--limit', type=int, default=None, help='Stop after this many studies (for trial runs)')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from services.runtime_config import RuntimeConfig
+    from services.structured_logging import configure_logging
+    from services.worker_pool import InferencePool, PoolSettings
+
+    # Thread/affinity and --processes flags are shared with the pipeline's other entry points
+    runtime_config, remaining = RuntimeConfig.from_args(sys.argv[1:] if argv is None else argv)
+    pool_settings = PoolSettings.from_args(remaining)
+    parser.add_argument('--processes', type=int, default=pool_settings.processes,
+                        help='Worker processes forked from the loaded pipeline (XRAY_AI_WORKER_PROCESSES)')
+    parser.add_argument('--job-timeout-s', type=float, default=pool_settings.job_timeout_seconds)
+    args = parser.parse_args(remaining)
+    configure_logging()
+
+    items = collect_items(args.inputs, args.xray_type, args.recursive)
+    journal = ResultsJournal(args.output, retry_failed=args.retry_failed)
+    todo = [item for item in items if item.id not in journal.completed]
+    already_done = len(items) - len(todo)
+    if args.limit is not None:
+        todo = todo[:max(0, args.limit)]
+    logger.info('%s studies found, %s already in %s, %s to analyze', len(items), already_done,
+                args.output, len(todo))
+
+    summary = {
+        'output': args.output,
+        'total': len(items),
+        'skipped': already_done,
+        'failed_before': journal.failed_before
+    }
+    exit_code = 0
+    progress = ProgressReporter(len(todo), args.progress_interval)
+    pool = None
+    try:
+        if todo:
+            import medical_ai_pipeline
+            pipeline = medical_ai_pipeline.get_pipeline(pool_settings.parent_runtime(runtime_config))
+            if pool_settings.processes > 1:
+                # Forked before the decode and analysis threads exist
+                pool = InferencePool(pipeline, pool_settings, runtime_config)
+                pool.start()
+            runner = BulkRunner(
+                pipeline, journal, batch_size=args.batch_size, decode_workers=args.decode_workers,
+                prefetch=args.prefetch, max_in_flight=max(1, pool_settings.processes) + 1,
+                heatmap_mode=args.heatmap, tta_views=args.tta_views, pool=pool
+            )
+            runner.run(todo, progress)
+    except KeyboardInterrupt:
+        logger.warning('Interrupted; rerun with the same --output to resume')
+        exit_code = 130
+    finally:
+        if pool is not None:
+            pool.stop()
+        journal.close()
+        if todo:
+            progress.maybe_report(force=True)
+
+    summary.update(progress.summary())
+    summary['remaining'] = len(items) - summary['skipped'] - summary['processed']
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
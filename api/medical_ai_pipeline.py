@@ -7,13 +7,25 @@ Professional medical diagnosis with full clinical reports
 import os
 import json
 import sys
+import time
+import hashlib
+
+_base_import_started = time.perf_counter()
 import numpy as np
-import requests
 from PIL import Image
+# image_io goes ahead of cv2: OpenCV takes its decode pixel cap from the environment only
+# when first imported, and image_io sets it from XRAY_AI_MAX_PIXELS
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import services.image_io  # noqa: F401
 import cv2
 from datetime import datetime
 import base64
 import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('medical_ai_pipeline')
 
 # Force UTF-8 stdout/stderr to avoid Windows cp1252 issues
 try:
@@ -24,79 +36,188 @@ try:
 except Exception:
     pass
 
-# MONAI imports
-try:
-    import monai
-    from monai.data import Dataset, DataLoader
-    from monai.transforms import (
-        Compose, LoadImage, Resize, NormalizeIntensity, ToTensor, EnsureChannelFirst,
-        Spacing, Orientation, ScaleIntensityRange, RandRotate, RandZoom,
-        RandGaussianNoise, RandAdjustContrast, RandGaussianSmooth
-    )
-    from monai.networks.nets import DenseNet121
-    from monai.visualize import GradCAM
-    MONAI_AVAILABLE = True
-except ImportError:
-    MONAI_AVAILABLE = False
-    print("MONAI not available, using fallback", file=sys.stderr)
-
-# MedCLIP imports (version 0.0.3 compatible) - try multiple symbols
-try:
-    import medclip
-    try:
-        from medclip import MedCLIP  # some builds export this
-    except Exception:
+# Seconds spent importing each dependency, reported by --startup-profile
+IMPORT_TIMINGS = {'numpy/PIL/cv2': time.perf_counter() - _base_import_started}
+
+# Heavy ML dependencies (torch, MONAI, MedCLIP, OpenCLIP) are imported on first use by
+# load_ml_dependencies(), so argument validation and error paths stay fast
+TORCH_AVAILABLE = False
+MONAI_AVAILABLE = False
+MEDCLIP_AVAILABLE = False
+OPENCLIP_AVAILABLE = False
+_ml_dependencies_loaded = False
+_ml_import_lock = threading.Lock()
+
+
+def load_ml_dependencies():
+    """Import torch, MONAI, MedCLIP and OpenCLIP once, timing each import"""
+    global _ml_dependencies_loaded, TORCH_AVAILABLE, MONAI_AVAILABLE, MEDCLIP_AVAILABLE, OPENCLIP_AVAILABLE
+    global torch, F, transforms, monai, Compose, LoadImage, Resize, NormalizeIntensity, ToTensor
+    global EnsureChannelFirst, ScaleIntensityRange, RandRotate, RandZoom, RandGaussianNoise
+    global RandAdjustContrast, DenseNet121, medclip, MedCLIP, open_clip
+
+    with _ml_import_lock:
+        if _ml_dependencies_loaded:
+            return IMPORT_TIMINGS
+
+        # PyTorch and Computer Vision (first, so its cost is not attributed to MONAI/OpenCLIP)
+        started = time.perf_counter()
+        try:
+            import torch
+            import torch.nn.functional as F
+            from torchvision import transforms
+            TORCH_AVAILABLE = True
+        except ImportError:
+            TORCH_AVAILABLE = False
+        IMPORT_TIMINGS['torch'] = time.perf_counter() - started
+
+        # MONAI imports
+        started = time.perf_counter()
+        try:
+            import monai
+            from monai.transforms import (
+                Compose, LoadImage, Resize, NormalizeIntensity, ToTensor, EnsureChannelFirst,
+                ScaleIntensityRange, RandRotate, RandZoom, RandGaussianNoise, RandAdjustContrast
+            )
+            from monai.networks.nets import DenseNet121
+            MONAI_AVAILABLE = True
+        except ImportError:
+            MONAI_AVAILABLE = False
+            logger.warning('MONAI not available, using fallback')
+        IMPORT_TIMINGS['monai'] = time.perf_counter() - started
+
+        # MedCLIP imports (version 0.0.3 compatible) - try multiple symbols
+        started = time.perf_counter()
+        try:
+            import medclip
+            try:
+                from medclip import MedCLIP  # some builds export this
+            except Exception:
+                try:
+                    from medclip import MedCLIPModel as MedCLIP  # alternative symbol
+                except Exception:
+                    MedCLIP = None
+            MEDCLIP_AVAILABLE = MedCLIP is not None
+            if not MEDCLIP_AVAILABLE:
+                logger.info('MedCLIP package present but class symbol not found; will use fallback')
+        except ImportError:
+            MEDCLIP_AVAILABLE = False
+            logger.info('MedCLIP not available, using fallback')
+        IMPORT_TIMINGS['medclip'] = time.perf_counter() - started
+
+        # OpenCLIP for BiomedCLIP (correct loading method)
+        started = time.perf_counter()
         try:
-            from medclip import MedCLIPModel as MedCLIP  # alternative symbol
+            import open_clip
+            OPENCLIP_AVAILABLE = True
         except Exception:
-            MedCLIP = None
-    MEDCLIP_AVAILABLE = MedCLIP is not None
-    if not MEDCLIP_AVAILABLE:
-        print("MedCLIP package present but class symbol not found; will use fallback", file=sys.stderr)
-except ImportError:
-    MEDCLIP_AVAILABLE = False
-    print("MedCLIP not available, using fallback", file=sys.stderr)
-
-# OpenCLIP for BiomedCLIP (correct loading method)
-try:
-    import open_clip
-    OPENCLIP_AVAILABLE = True
-except Exception:
-    OPENCLIP_AVAILABLE = False
-    print("OpenCLIP not available", file=sys.stderr)
-
-# PyTorch and Computer Vision
-try:
-    import torch
-    import torch.nn.functional as F
-    from torchvision import transforms
-    TORCH_AVAILABLE = True
-except ImportError:
-    TORCH_AVAILABLE = False
+            OPENCLIP_AVAILABLE = False
+            logger.warning('OpenCLIP not available')
+        IMPORT_TIMINGS['open_clip'] = time.perf_counter() - started
+
+        _ml_dependencies_loaded = True
+        return IMPORT_TIMINGS
+
+# Local service modules (api/services)
+from services.model_registry import ClipModelRegistry
+from services.text_embedding_cache import TextEmbeddingCache, default_cache_dir
+from services.report_cache import ReportCache
+from services.result_cache import ResultCache
+from services.image_io import (
+    DecodedImage, ImageTooLargeError, list_image_files, open_pil_image, read_grayscale, to_monai_layout
+)
+from services.llm_client import OpenRouterClient, LLMRequestError
+from services.quantization import (
+    QUANTIZABLE_MODELS, parse_quantize_setting, quantize_densenet, quantize_dynamic_int8,
+    serialized_size_bytes, synthetic_calibration_images
+)
+from services.onnx_backend import INFERENCE_BACKENDS, ORT_AVAILABLE, OnnxModel, clip_image_tower
+from services.runtime_config import RuntimeConfig
+from services.metrics import BATCH_SIZE, StudyTimings, observe_stage, record_analysis, record_fallback
+from services.structured_logging import configure_logging, log_context
+
+# Maximum number of studies stacked into one model forward by complete_analysis_batch
+DEFAULT_BATCH_SIZE = 16
+
+# Test-time augmentation views are drawn from a fixed seed so TTA results stay reproducible
+TTA_SEED = 20240601
+
+# Bump whenever preprocessing, scoring or heatmap code changes what a cached result would contain
+PIPELINE_VERSION = 4
 
 class MedicalAIPipeline:
-    def __init__(self):
+    # Per-request heatmap output: rendered PNG, low-resolution grid rendered on demand, or nothing
+    HEATMAP_MODES = ('full', 'compact', 'none')
+
+    def __init__(self, quantize=None, runtime_config=None):
+        """``quantize`` names the models to run in int8 (default: XRAY_AI_QUANTIZE);
+        ``runtime_config`` sets threads and CPU affinity (default: from the environment)
+        """
+        load_ml_dependencies()
+        # Applied before any model runs: torch fixes its inter-op pool on first use
+        self.runtime_config = runtime_config or RuntimeConfig.from_env()
+        self.runtime_settings = self.runtime_config.apply()
+        logger.info('CPU runtime: %s intra-op / %s inter-op torch threads, %s OpenCV threads, CPUs %s of %s',
+                    self.runtime_settings['intra_op_threads'], self.runtime_settings['inter_op_threads'],
+                    self.runtime_settings['opencv_threads'], self.runtime_settings['cpu_affinity'],
+                    self.runtime_settings['cpu_count'], extra={'worker': self.runtime_config.worker_index})
+        # Seconds spent initializing each model/component, reported by --startup-profile
+        self.init_timings = {}
         self.medclip_model = None
         self.monai_transforms = None
+        self.monai_loader = None  # LoadImage + EnsureChannelFirst, for formats only MONAI reads
+        self.monai_array_transforms = None  # Same chain for images decoded in memory
+        self.tta_transforms = None
+        self._tta_lock = threading.Lock()
+        # Number of views averaged per image; 1 means deterministic single-view inference
+        self.tta_views = max(1, int(os.environ.get('XRAY_AI_TTA_VIEWS', '1')))
+        self.heatmap_mode = self.validate_heatmap_mode(os.environ.get('XRAY_AI_HEATMAP_MODE', 'full'))
+        # Longer side of compact intensity grids (Grad-CAM grids keep the 7x7 feature-map size)
+        self.heatmap_grid_size = max(1, int(os.environ.get('XRAY_AI_HEATMAP_GRID', '32')))
         self.densenet_model = None  # MONAI DenseNet121 for medical imaging
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        # Models converted to int8 for CPU inference, e.g. XRAY_AI_QUANTIZE=clip,densenet
+        self.quantize = (parse_quantize_setting(os.environ.get('XRAY_AI_QUANTIZE', ''))
+                         if quantize is None else set(quantize))
+        if self.quantize and self.device.type != 'cpu':
+            logger.warning('Int8 quantization is CPU-only; running fp32 on %s', self.device)
+            self.quantize = set()
+        # OpenCLIP variants are loaded once and shared by every request
+        self.clip_registry = (ClipModelRegistry(open_clip, self.device, quantize='clip' in self.quantize)
+                              if OPENCLIP_AVAILABLE else None)
+        # 'onnx' runs the DenseNet121 backbone and CLIP image tower on ONNX Runtime (CPU)
+        self.inference_backend = os.environ.get('XRAY_AI_INFERENCE_BACKEND', 'torch').lower()
+        if self.inference_backend not in INFERENCE_BACKENDS:
+            raise ValueError(f"Unknown inference backend '{self.inference_backend}', "
+                             f"expected one of {', '.join(INFERENCE_BACKENDS)}")
+        self.onnx_models = {}  # 'densenet' / 'clip' -> OnnxModel
+        self.text_embeddings = TextEmbeddingCache()
+        self._llm_client = None
+        # Generated LLM reports, keyed on the rounded diagnosis signature and patient context
+        self.report_cache = ReportCache.from_env(default_cache_dir())
+        self._llm_client_lock = threading.Lock()
         self.initialize_models()
+        # Model outputs per image content; rows of other model versions stay for processes running them.
+        # DenseNet121 weights are randomly initialised in every process, so its model_version never
+        # recurs after a restart: until they come from a checkpoint the cache is kept in memory
+        self.model_version = self.compute_model_version()
+        self.persist_results = self.densenet_model is None
+        self.result_cache = ResultCache.from_env(default_cache_dir(), self.model_version, self.persist_results)
     
     def initialize_models(self):
         """Initialize MONAI and MedCLIP models"""
-        print("=" * 80, file=sys.stderr)
-        print("🚀 STARTING MODEL INITIALIZATION", file=sys.stderr)
-        print("=" * 80, file=sys.stderr)
+        logger.info('Initializing models')
 
         try:
             # Initialize MedCLIP (version 0.0.3 compatible)
-            print(f"📊 MEDCLIP_AVAILABLE: {MEDCLIP_AVAILABLE}", file=sys.stderr)
-            print(f"📊 OPENCLIP_AVAILABLE: {OPENCLIP_AVAILABLE}", file=sys.stderr)
-            print(f"📊 MONAI_AVAILABLE: {MONAI_AVAILABLE}", file=sys.stderr)
-            print(f"📊 TORCH_AVAILABLE: {TORCH_AVAILABLE}", file=sys.stderr)
+            logger.debug('MEDCLIP_AVAILABLE: %s', MEDCLIP_AVAILABLE)
+            logger.debug('OPENCLIP_AVAILABLE: %s', OPENCLIP_AVAILABLE)
+            logger.debug('MONAI_AVAILABLE: %s', MONAI_AVAILABLE)
+            logger.debug('TORCH_AVAILABLE: %s', TORCH_AVAILABLE)
 
             if MEDCLIP_AVAILABLE:
-                print("🔄 Attempting to load MedCLIP model...", file=sys.stderr)
+                logger.debug('Attempting to load MedCLIP model...')
+                section_started = time.perf_counter()
                 try:
                     # Try different model paths for MedCLIP 0.0.3
                     model_paths = [
@@ -106,58 +227,84 @@ class MedicalAIPipeline:
                     ]
 
                     for i, path in enumerate(model_paths):
-                        print(f"   Trying path {i+1}/{len(model_paths)}: {path}", file=sys.stderr)
+                        logger.debug('Trying path %s/%s: %s', i+1, len(model_paths), path)
                         try:
                             self.medclip_model = MedCLIP.from_pretrained(path)
-                            print(f"✅ SUCCESS: MedCLIP model loaded from {path}", file=sys.stderr)
+                            logger.info('MedCLIP model loaded from %s', path)
                             break
                         except Exception as path_error:
-                            print(f"   ❌ Failed: {str(path_error)[:100]}", file=sys.stderr)
+                            logger.debug('Failed: %s', str(path_error)[:100])
                             continue
 
                     if self.medclip_model is None:
-                        print("⚠️ WARNING: MedCLIP model not loaded, will try OpenCLIP or use fallback", file=sys.stderr)
+                        logger.warning('MedCLIP model not loaded, will try OpenCLIP or use fallback')
                     else:
-                        print(f"✅ MedCLIP model type: {type(self.medclip_model)}", file=sys.stderr)
+                        logger.debug('MedCLIP model type: %s', type(self.medclip_model))
+                        if 'clip' in self.quantize:
+                            self.medclip_model = quantize_dynamic_int8(self.medclip_model)
+                            logger.info('MedCLIP quantized to dynamic int8')
 
                 except Exception as e:
-                    print(f"❌ MedCLIP initialization error: {e}", file=sys.stderr)
-                    import traceback
-                    print(f"   Traceback: {traceback.format_exc()}", file=sys.stderr)
+                    logger.error('MedCLIP initialization error: %s', e, exc_info=True)
                     self.medclip_model = None
+                self.init_timings['medclip'] = time.perf_counter() - section_started
             else:
-                print("⚠️ MedCLIP package not available", file=sys.stderr)
+                logger.debug('MedCLIP package not available')
+
+            # Load the OpenCLIP variant up front so requests never pay for it
+            if self.medclip_model is None and self.clip_registry:
+                logger.debug('Loading OpenCLIP model (BiomedCLIP preferred)...')
+                section_started = time.perf_counter()
+                clip_entry = self.clip_registry.resolve()
+                self.init_timings['open_clip'] = time.perf_counter() - section_started
+                if clip_entry:
+                    logger.info('%s loaded in %.1fs', clip_entry.spec.display_name, clip_entry.load_seconds)
+                    # Condition prompts are fixed, so encode them once per model
+                    section_started = time.perf_counter()
+                    for prompt_type in ('chest', 'bone', 'dental', 'spine'):
+                        self.get_text_features(clip_entry, prompt_type)
+                    self.init_timings['text_embeddings'] = time.perf_counter() - section_started
+                    logger.info('Condition text embeddings ready: %s', self.text_embeddings.stats())
+                else:
+                    logger.warning('No OpenCLIP variant could be loaded: %s', self.clip_registry.stats()['failed'])
 
             # Initialize MONAI transforms with advanced medical image preprocessing
             if MONAI_AVAILABLE:
-                print("🔄 Initializing advanced MONAI transforms...", file=sys.stderr)
-                self.monai_transforms = Compose([
-                    LoadImage(image_only=True),
-                    EnsureChannelFirst(),
-                    # Advanced medical-specific transforms
-                    ScaleIntensityRange(  # Medical-specific intensity scaling
-                        a_min=0, a_max=255,
-                        b_min=0.0, b_max=1.0,
-                        clip=True
-                    ),
-                    # Data augmentation for robustness (with low probability for inference)
-                    RandRotate(range_x=0.05, prob=0.3),  # Handle slight rotations
-                    RandZoom(min_zoom=0.95, max_zoom=1.05, prob=0.3),  # Handle zoom variations
-                    RandGaussianNoise(prob=0.2, std=0.01),  # Robustness to noise
-                    RandAdjustContrast(prob=0.2, gamma=(0.9, 1.1)),  # Handle contrast variations
+                logger.debug('Initializing advanced MONAI transforms...')
+                section_started = time.perf_counter()
+                # Deterministic inference chain: the same image always yields the same scores
+                # Advanced medical-specific transforms
+                scale_intensity = ScaleIntensityRange(  # Medical-specific intensity scaling
+                    a_min=0, a_max=255,
+                    b_min=0.0, b_max=1.0,
+                    clip=True
+                )
+                resize_chain = [
                     Resize(spatial_size=(224, 224)),  # Standard size for models
                     NormalizeIntensity(),  # Normalize to standard range
                     ToTensor()
-                ])
-                print("✅ Advanced MONAI transforms initialized successfully", file=sys.stderr)
-                print("   - Medical intensity scaling: ✅", file=sys.stderr)
-                print("   - Rotation augmentation: ✅", file=sys.stderr)
-                print("   - Zoom augmentation: ✅", file=sys.stderr)
-                print("   - Noise robustness: ✅", file=sys.stderr)
-                print("   - Contrast adjustment: ✅", file=sys.stderr)
+                ]
+                self.monai_loader = Compose([LoadImage(image_only=True), EnsureChannelFirst()])
+                self.monai_transforms = Compose([self.monai_loader, scale_intensity] + resize_chain)
+                # Uploaded bytes are decoded in memory and enter the chain already channel-first
+                self.monai_array_transforms = Compose([scale_intensity] + resize_chain)
+                # Augmentations are only used for explicit test-time augmentation (tta_views > 1).
+                # They act on the [0, 1]-scaled image ahead of Resize and NormalizeIntensity,
+                # where the noise std and contrast gamma below were tuned
+                self.tta_transforms = Compose([
+                    scale_intensity,
+                    RandRotate(range_x=0.05, prob=1.0),  # Handle slight rotations
+                    RandZoom(min_zoom=0.95, max_zoom=1.05, prob=1.0),  # Handle zoom variations
+                    RandGaussianNoise(prob=0.5, std=0.01),  # Robustness to noise
+                    RandAdjustContrast(prob=0.5, gamma=(0.9, 1.1)),  # Handle contrast variations
+                ] + resize_chain)
+                logger.info('Advanced MONAI transforms initialized successfully')
+                logger.debug('Test-time augmentation views: %s', self.tta_views)
+                self.init_timings['monai_transforms'] = time.perf_counter() - section_started
 
                 # Initialize DenseNet121 for medical chest X-ray classification
-                print("🔄 Initializing MONAI DenseNet121 (pre-trained on medical data)...", file=sys.stderr)
+                logger.debug('Initializing MONAI DenseNet121 (pre-trained on medical data)...')
+                section_started = time.perf_counter()
                 try:
                     self.densenet_model = DenseNet121(
                         spatial_dims=2,
@@ -166,99 +313,488 @@ class MedicalAIPipeline:
                     )
                     self.densenet_model = self.densenet_model.to(self.device)
                     self.densenet_model.eval()
-                    print("✅ MONAI DenseNet121 initialized successfully", file=sys.stderr)
+                    logger.info('MONAI DenseNet121 initialized successfully')
                 except Exception as densenet_err:
-                    print(f"⚠️ DenseNet121 initialization failed: {densenet_err}", file=sys.stderr)
+                    logger.warning('DenseNet121 initialization failed: %s', densenet_err)
                     self.densenet_model = None
+                self.init_timings['densenet'] = time.perf_counter() - section_started
+
+                if self.densenet_model is not None and 'densenet' in self.quantize:
+                    section_started = time.perf_counter()
+                    self.quantize_densenet_model()
+                    self.init_timings['densenet_quantization'] = time.perf_counter() - section_started
             else:
-                print("⚠️ MONAI not available, will use PIL fallback", file=sys.stderr)
+                logger.warning('MONAI not available, will use PIL fallback')
+
+            if self.inference_backend == 'onnx':
+                section_started = time.perf_counter()
+                self.initialize_onnx_backend()
+                self.init_timings['onnx'] = time.perf_counter() - section_started
+
+        except Exception as e:
+            logger.error('Model initialization failed: %s', e, exc_info=True)
+
+        logger.info('Model initialization complete', extra={
+            'medclip_loaded': self.medclip_model is not None,
+            'clip_variants': [entry.spec.display_name for entry in self.clip_registry.loaded_entries()]
+            if self.clip_registry else [],
+            'monai_transforms_loaded': self.monai_transforms is not None,
+            'densenet_loaded': self.densenet_model is not None,
+            'quantized': sorted(self.quantize),
+            'onnx': sorted(self.onnx_models),
+            'init_seconds': {name: round(seconds, 3) for name, seconds in self.init_timings.items()}
+        })
+
+    def initialize_onnx_backend(self, cache_dir=None):
+        """Export DenseNet121's backbone and the CLIP image tower to ONNX and open ORT sessions
+
+        The CLIP tower's graph is cached per weight fingerprint in ``cache_dir``
+        (default XRAY_AI_ONNX_DIR or <cache root>/onnx), so only the first start
+        exports it; graphs of other weights are pruned after
+        XRAY_AI_ONNX_MAX_AGE_DAYS unopened. DenseNet121 loads no checkpoint and
+        gets new random weights in every process, so its graph is exported on
+        every start and kept in memory only. Int8-quantized models stay on
+        torch, and any model that fails to export keeps running on torch.
+
+        Returns:
+            Stats of the ONNX sessions now in use
+        """
+        if not ORT_AVAILABLE or self.device.type != 'cpu':
+            reason = 'onnxruntime is not installed' if not ORT_AVAILABLE else f'device is {self.device}'
+            logger.warning('ONNX Runtime backend unavailable (%s), using torch', reason)
+            return {}
+
+        cache_dir = cache_dir or os.environ.get('XRAY_AI_ONNX_DIR') or os.path.join(default_cache_dir(), 'onnx')
+        exports = []
+        if self.densenet_model is not None and 'densenet' not in self.quantize:
+            # Random weights: a cached graph could never be reused by another process
+            exports.append(('densenet', 'densenet121-features', self.densenet_model.features,
+                            torch.zeros(1, 1, 224, 224), False))
+        clip_entry = self.clip_registry.resolve() if self.medclip_model is None and self.clip_registry else None
+        if clip_entry is not None and 'clip' not in self.quantize:
+            # Run the variant's own preprocessing once to get its input shape
+            example = clip_entry.preprocess(Image.new('RGB', (224, 224))).unsqueeze(0)
+            name = 'clip-' + ''.join(c if c.isalnum() else '_' for c in clip_entry.spec.model_id)
+            exports.append(('clip', name, clip_image_tower(clip_entry.model), example, True))
+
+        for key, name, module, example, persist in exports:
+            logger.debug('Preparing ONNX Runtime session for %s...', name)
+            try:
+                self.onnx_models[key] = OnnxModel.from_module(
+                    module, example, cache_dir, name,
+                    intra_op_threads=self.runtime_settings['intra_op_threads'], persist=persist
+                )
+                logger.info('%s running on ONNX Runtime (%s)', name, self.onnx_models[key].path)
+            except Exception as e:
+                logger.warning('ONNX export of %s failed, keeping torch: %s', name, e)
+        return {key: model.stats() for key, model in self.onnx_models.items()}
 
+    def prepare_for_fork(self, share_memory=False):
+        """Ready a fully loaded pipeline to be forked into worker processes
+
+        Model weights reach the workers copy-on-write, or through shared
+        memory with ``share_memory`` (needs /dev/shm as large as the models).
+        Per-process resources that must not cross fork() are closed here and
+        reopened by ``after_fork`` in each worker.
+        """
+        if share_memory:
+            modules = [self.densenet_model, self.medclip_model]
+            if self.clip_registry:
+                modules.extend(entry.model for entry in self.clip_registry.loaded_entries())
+            for module in modules:
+                if hasattr(module, 'share_memory'):
+                    module.share_memory()
+        if self.result_cache is not None:
+            self.result_cache.close()
+            self.result_cache = None
+        self._llm_client = None
+
+    def after_fork(self, runtime_config):
+        """Set up a freshly forked worker: its own threads/affinity, cache connection and ORT sessions"""
+        self.runtime_config = runtime_config
+        self.runtime_settings = runtime_config.apply()
+        self.result_cache = ResultCache.from_env(default_cache_dir(), self.model_version, self.persist_results)
+        # ORT thread pools do not survive fork(), so each worker opens its own sessions
+        for key, model in list(self.onnx_models.items()):
+            self.onnx_models[key] = model.reopen(intra_op_threads=self.runtime_settings['intra_op_threads'])
+
+    def _densenet_features(self, input_tensor):
+        """DenseNet121 backbone feature maps, from ONNX Runtime when it is the active backend"""
+        onnx_model = self.onnx_models.get('densenet')
+        if onnx_model is not None:
+            return onnx_model(input_tensor).to(self.device)
+        return self.densenet_model.features(input_tensor)
+
+    def _encode_image(self, clip_entry, image_input):
+        """CLIP image embeddings, from ONNX Runtime when it is the active backend"""
+        onnx_model = self.onnx_models.get('clip')
+        if onnx_model is not None:
+            return onnx_model(image_input).to(self.device)
+        return clip_entry.model.encode_image(image_input)
+
+    def quantization_calibration_inputs(self, batch_size=8):
+        """DenseNet input batches for static-quantization calibration
+
+        Uses the images in XRAY_AI_QUANTIZE_CALIBRATION_DIR (up to 64) when set,
+        otherwise synthetic radiograph-like images.
+        """
+        images = []
+        calibration_dir = os.environ.get('XRAY_AI_QUANTIZE_CALIBRATION_DIR')
+        if calibration_dir:
+            for path in list_image_files([calibration_dir])[:64]:
+                processed = self.preprocess_image(path)
+                if processed is not None and self._to_grayscale(processed).shape[0] == 1:
+                    images.append(self._to_grayscale(processed))
+            logger.info('Calibrating int8 DenseNet121 on %s image(s) from %s', len(images), calibration_dir)
+        if not images:
+            logger.warning('No calibration images, calibrating int8 DenseNet121 on synthetic images')
+            images = synthetic_calibration_images()
+        return [torch.stack(images[i:i + batch_size]) for i in range(0, len(images), batch_size)]
+
+    def quantize_densenet_model(self):
+        """Swap the DenseNet121 backbone for a calibrated static int8 copy; keeps fp32 on failure"""
+        logger.info('Quantizing MONAI DenseNet121 backbone to int8...')
+        try:
+            self.densenet_model = quantize_densenet(self.densenet_model, self.quantization_calibration_inputs())
+            logger.info('DenseNet121 backbone quantized (static int8, fp32 classifier head)')
         except Exception as e:
-            print(f"❌ CRITICAL: Model initialization failed: {e}", file=sys.stderr)
-            import traceback
-            print(f"   Full traceback: {traceback.format_exc()}", file=sys.stderr)
-
-        print("=" * 80, file=sys.stderr)
-        print("✅ MODEL INITIALIZATION COMPLETE", file=sys.stderr)
-        print(f"   MedCLIP Model: {'Loaded' if self.medclip_model else 'Not Loaded'}", file=sys.stderr)
-        print(f"   MONAI Transforms: {'Loaded' if self.monai_transforms else 'Not Loaded'}", file=sys.stderr)
-        print(f"   MONAI DenseNet121: {'Loaded' if self.densenet_model else 'Not Loaded'}", file=sys.stderr)
-        print("=" * 80, file=sys.stderr)
+            logger.warning('DenseNet121 quantization failed, keeping fp32: %s', e)
+            self.quantize.discard('densenet')
+
+    def apply_quantization(self, models):
+        """Convert already-loaded fp32 models to int8 in place
+
+        Used to compare both precisions on identical weights; at startup the
+        models named in ``quantize`` are converted as they load. The model
+        version is refreshed, and with it the result cache's keys, so cached
+        fp32 outputs are not served for int8 models.
+        """
+        if self.device.type != 'cpu':
+            raise RuntimeError(f"Int8 quantization is CPU-only, not {self.device}")
+        models = set(models) - self.quantize
+        for name in models:
+            # Quantized models run on torch
+            self.onnx_models.pop(name, None)
+        if 'clip' in models:
+            if self.medclip_model is not None:
+                self.medclip_model = quantize_dynamic_int8(self.medclip_model)
+            elif self.clip_registry:
+                self.clip_registry.quantize_loaded()
+            self.quantize.add('clip')
+        if 'densenet' in models and self.densenet_model is not None:
+            self.quantize.add('densenet')
+            self.quantize_densenet_model()
+        self.model_version = self.compute_model_version()
+        if self.result_cache is not None:
+            self.result_cache.version = self.model_version
+
+    def validate_heatmap_mode(self, mode):
+        """Normalize a heatmap mode, rejecting unknown values"""
+        mode = (mode or 'full').lower()
+        if mode not in self.HEATMAP_MODES:
+            raise ValueError(f"Unknown heatmap mode '{mode}', expected one of {', '.join(self.HEATMAP_MODES)}")
+        return mode
+
+    def get_model_stats(self):
+        """Which models are loaded, with load time and memory per CLIP variant"""
+        return {
+            'medclip': self.medclip_model is not None,
+            'densenet': self.densenet_model is not None,
+            'quantized': sorted(self.quantize),
+            'backend': self.inference_backend,
+            'runtime': self.runtime_settings,
+            'onnx': {key: model.stats() for key, model in self.onnx_models.items()},
+            'clip': self.clip_registry.stats() if self.clip_registry else None,
+            'text_embeddings': self.text_embeddings.stats()
+        }
+
+    def get_cache_stats(self):
+        """Hit/miss counters for the pipeline caches"""
+        return {
+            'text_embeddings': self.text_embeddings.stats(),
+            'reports': self.report_cache.stats(),
+            'results': self.result_cache.stats() if self.result_cache else None
+        }
+
+    def compute_model_version(self):
+        """Fingerprint of everything that determines model outputs, used to key the result cache"""
+        def weights_fingerprint(model):
+            if model is None:
+                return None
+            digest = hashlib.sha256()
+            # First and last parameters are enough to tell weight sets apart
+            parameters = list(model.parameters())
+            for tensor in (parameters[0], parameters[-1]):
+                digest.update(tensor.detach().cpu().numpy().tobytes())
+            return digest.hexdigest()[:16]
+
+        signature = {
+            'pipeline': PIPELINE_VERSION,
+            'medclip': type(self.medclip_model).__name__ if self.medclip_model is not None else None,
+            'clip': self.clip_registry.version if self.clip_registry else None,
+            'densenet': weights_fingerprint(self.densenet_model),
+            'monai': self.monai_transforms is not None,
+            'quantized': sorted(self.quantize),
+            'onnx': sorted(self.onnx_models)
+        }
+        encoded = json.dumps(signature, sort_keys=True)
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:16]
+
+    def build_condition_prompts(self, xray_type):
+        """Medical-specific zero-shot prompts, one per condition, with professional terminology"""
+        prompts = []
+        for c in self.get_medical_conditions(xray_type):
+            if xray_type == 'chest':
+                prompts.append(f"frontal chest radiograph demonstrating {c.lower()} with characteristic radiological findings")
+            elif xray_type == 'bone':
+                prompts.append(f"bone radiograph showing {c.lower()} with typical imaging features")
+            elif xray_type == 'dental':
+                prompts.append(f"dental radiograph revealing {c.lower()} with diagnostic findings")
+            elif xray_type == 'spine':
+                prompts.append(f"spinal radiograph indicating {c.lower()} with pathological changes")
+            else:
+                prompts.append(f"radiograph demonstrating {c.lower()} with typical medical imaging features")
+        return prompts
+
+    def get_text_features(self, clip_entry, xray_type):
+        """Normalized text-feature matrix for the condition prompts (cached in memory and on disk)"""
+        def encode(prompts):
+            text_tokens = clip_entry.tokenizer(prompts).to(self.device)
+            return clip_entry.model.encode_text(text_tokens)
+
+        return self.text_embeddings.get_or_compute(
+            clip_entry.model_key,
+            self.build_condition_prompts(xray_type),
+            encode,
+            self.device
+        )
     
     def preprocess_image(self, image_path):
-        """MONAI preprocessing pipeline"""
+        """MONAI preprocessing pipeline
+
+        ``image_path`` may be a file path, encoded image bytes (e.g. an upload
+        read from stdin) or a ``DecodedImage``. The image is decoded once and
+        the resulting tensor is stored on the ``DecodedImage``, so passing the
+        same object again returns it without any work.
+        """
+        image = DecodedImage.wrap(image_path)
+        if image.tensor is not None:
+            return image.tensor
         try:
             if MONAI_AVAILABLE and self.monai_transforms:
-                # Use MONAI transforms
-                processed_image = self.monai_transforms(image_path)
-                return processed_image
+                # Use MONAI transforms on the shared decoded array
+                try:
+                    image.tensor = self.monai_array_transforms(to_monai_layout(image.array))
+                except ValueError as e:
+                    if image.path is None or image.is_dicom or isinstance(e, ImageTooLargeError):
+                        raise
+                    # Formats only MONAI's own readers understand
+                    image.tensor = self.monai_transforms(image.path)
+                return image.tensor
             else:
                 # Fallback preprocessing
-                image = Image.open(image_path).convert('RGB')
+                record_fallback('pil_preprocessing')
+                pil_image = (Image.fromarray(image.array) if image.is_dicom
+                             else open_pil_image(image.encoded, image.decode_size, image.max_pixels)).convert('RGB')
                 transform = transforms.Compose([
                     transforms.Resize((224, 224)),
                     transforms.ToTensor(),
                     transforms.Normalize(mean=[0.485, 0.456, 0.406],
                                        std=[0.229, 0.224, 0.225])
                 ])
-                return transform(image)
+                image.tensor = transform(pil_image)
+                return image.tensor
         except Exception as e:
-            print(f"Image preprocessing error: {e}", file=sys.stderr)
+            logger.warning('Image preprocessing error: %s', e)
+            return None
+
+    def build_tta_views(self, processed_image, views):
+        """Original image plus ``views - 1`` seeded augmentations (rotation, zoom, noise, contrast)
+
+        ``processed_image`` is a preprocessed ``DecodedImage``; each view runs
+        the inference chain again from its decoded pixels with the
+        augmentations inserted before resizing and normalization.
+        """
+        if views <= 1 or self.tta_transforms is None:
+            return [processed_image]
+        try:
+            pixels = to_monai_layout(processed_image.array)
+        except ValueError:
+            # Formats only MONAI's own readers understand
+            pixels = self.monai_loader(processed_image.path)
+        with self._tta_lock:
+            self.tta_transforms.set_random_state(seed=TTA_SEED)
+            augmented = [self.tta_transforms(pixels) for _ in range(views - 1)]
+        return [processed_image] + augmented
+
+    def average_diagnoses(self, view_results):
+        """Average per-condition scores over the TTA views of one image"""
+        if any(result is None for result in view_results):
             return None
+        if len(view_results) == 1:
+            return view_results[0]
+
+        conditions = []
+        for result in view_results:
+            for condition in result['confidence_scores']:
+                if condition not in conditions:
+                    conditions.append(condition)
+        scores = {
+            condition: sum(r['confidence_scores'].get(condition, 0.0) for r in view_results) / len(view_results)
+            for condition in conditions
+        }
+        primary = max(scores, key=scores.get)
+
+        averaged = dict(view_results[0])
+        averaged.update({
+            'primary_diagnosis': primary,
+            'confidence_scores': scores,
+            'overall_confidence': scores[primary],
+            'tta_views': len(view_results)
+        })
+        return averaged
+
+    def _to_grayscale(self, processed_image):
+        """Single-channel (1, H, W) view of a preprocessed image for DenseNet"""
+        if processed_image.dim() == 3 and processed_image.shape[0] == 3:  # RGB
+            return torch.mean(processed_image, dim=0, keepdim=True)
+        return processed_image if processed_image.dim() == 3 else processed_image.unsqueeze(0)
+
+    def _image_tensor(self, processed_image):
+        """Preprocessed tensor of a ``DecodedImage`` or of a plain (augmented) tensor"""
+        return processed_image.tensor if isinstance(processed_image, DecodedImage) else processed_image
+
+    def _gray_input(self, processed_image):
+        """DenseNet input, derived once per ``DecodedImage``"""
+        if isinstance(processed_image, DecodedImage):
+            return processed_image.derive('gray', lambda: self._to_grayscale(processed_image.tensor))
+        return self._to_grayscale(processed_image)
+
+    def _image_numpy(self, processed_image):
+        """NumPy view for the heatmap, quality and fallback stages, derived once per ``DecodedImage``"""
+        if isinstance(processed_image, DecodedImage):
+            return processed_image.derive('numpy', lambda: processed_image.tensor.numpy())
+        return processed_image.numpy() if hasattr(processed_image, 'numpy') else processed_image
 
     def analyze_with_densenet(self, processed_image, xray_type="chest"):
         """Analyze X-ray using MONAI DenseNet121 model"""
+        return self.analyze_with_densenet_batch([processed_image], [xray_type])[0]
+
+    def analyze_with_densenet_batch(self, processed_images, xray_types, cam_capture=None):
+        """Analyze a batch of X-rays with a single MONAI DenseNet121 forward pass
+
+        Passing a dict as ``cam_capture`` keeps the final feature maps and the
+        classifier-head graph of this pass, so ``densenet_grad_cam`` can build
+        class-activation maps without running the backbone a second time.
+        """
         if not self.densenet_model or not MONAI_AVAILABLE:
-            return None
+            return [None] * len(processed_images)
 
         try:
-            print("🔬 Running MONAI DenseNet121 analysis...", file=sys.stderr)
+            logger.debug('Running MONAI DenseNet121 analysis (%s image(s))...', len(processed_images))
 
-            # Prepare image for DenseNet (expects grayscale, shape: [B, 1, H, W])
+            # Prepare images for DenseNet (expects grayscale, shape: [B, 1, H, W])
             with torch.no_grad():
-                # Convert to grayscale if needed
-                if processed_image.shape[0] == 3:  # RGB
-                    gray_image = torch.mean(processed_image, dim=0, keepdim=True)
-                else:
-                    gray_image = processed_image if processed_image.dim() == 3 else processed_image.unsqueeze(0)
+                input_tensor = torch.stack([self._gray_input(img) for img in processed_images]).to(self.device)
+                features = self._densenet_features(input_tensor)
+
+            if cam_capture is not None:
+                # Only the classifier head (ReLU, pooling, linear) is recorded for autograd,
+                # so Grad-CAM costs one tiny backward instead of a second backbone pass
+                with torch.enable_grad():
+                    # Rectified maps, the same activations the head's ReLU feeds into pooling
+                    activations = F.relu(torch.as_tensor(features)).detach().requires_grad_()
+                    # class_layers starts with an in-place ReLU, which a leaf tensor cannot take
+                    outputs = self.densenet_model.class_layers(activations.clone())
+                cam_capture.update(activations=activations, logits=outputs)
+            else:
+                with torch.no_grad():
+                    outputs = self.densenet_model.class_layers(features)
+
+            # Get predictions
+            batch_probs = F.softmax(outputs.detach(), dim=1)
+
+            results = []
+            for probs, xray_type in zip(batch_probs, xray_types):
+                # Map predictions to conditions
+                conditions = self.get_medical_conditions(xray_type)
+                scores = {}
+                for i, condition in enumerate(conditions):
+                    if i < len(probs):
+                        scores[condition] = float(probs[i])
+                    else:
+                        scores[condition] = 0.0
 
-                # Add batch dimension
-                input_tensor = gray_image.unsqueeze(0).to(self.device)
+                primary = max(scores, key=scores.get)
+                confidence = float(probs.max())
 
-                # Get predictions
-                outputs = self.densenet_model(input_tensor)
-                probs = F.softmax(outputs, dim=1).squeeze(0)
+                logger.debug('DenseNet121 analysis complete. Primary: %s, Confidence: %.2f', primary, confidence)
 
-            # Map predictions to conditions
-            conditions = self.get_medical_conditions(xray_type)
-            results = {}
-            for i, condition in enumerate(conditions):
-                if i < len(probs):
-                    results[condition] = float(probs[i])
-                else:
-                    results[condition] = 0.0
+                results.append({
+                    'primary_diagnosis': primary,
+                    'confidence_scores': scores,
+                    'overall_confidence': confidence,
+                    'model': 'MONAI DenseNet121'
+                })
+            return results
 
-            primary = max(results, key=results.get)
-            confidence = float(probs.max())
+        except Exception as e:
+            logger.error('DenseNet121 analysis error: %s', e, exc_info=True)
+            return [None] * len(processed_images)
+    
+    def densenet_grad_cam(self, cam_capture, rows, xray_types, target_diagnoses):
+        """Grad-CAM maps from a captured DenseNet121 pass, with one backward for the whole batch
 
-            print(f"✅ DenseNet121 analysis complete. Primary: {primary}, Confidence: {confidence:.2f}", file=sys.stderr)
+        Args:
+            cam_capture: Dict filled by analyze_with_densenet_batch
+            rows: Batch row of each study in the captured pass
+            xray_types: X-ray type of each study, mapping diagnoses to output classes
+            target_diagnoses: Condition to explain for each study (normally the final primary diagnosis)
 
-            return {
-                'primary_diagnosis': primary,
-                'confidence_scores': results,
-                'overall_confidence': confidence,
-                'model': 'MONAI DenseNet121'
-            }
+        Returns:
+            One float32 map in [0, 1] at feature-map resolution per study, or None where unavailable
+        """
+        if not cam_capture or not rows:
+            return [None] * len(rows)
+
+        try:
+            activations = cam_capture['activations']
+            logits = cam_capture['logits']
+
+            targets = []
+            for row, xray_type, diagnosis in zip(rows, xray_types, target_diagnoses):
+                conditions = self.get_medical_conditions(xray_type)
+                index = conditions.index(diagnosis) if diagnosis in conditions else -1
+                if not 0 <= index < logits.shape[1]:
+                    index = int(logits[row].argmax())
+                targets.append(index)
+
+            row_index = torch.tensor(rows, device=logits.device)
+            target_index = torch.tensor(targets, device=logits.device)
+            # Each study's logit depends only on its own activations, so the gradient of
+            # the summed target logits holds every study's gradient in its own row
+            score = logits[row_index, target_index].sum()
+            gradients, = torch.autograd.grad(score, activations)
+
+            weights = gradients[row_index].mean(dim=(2, 3), keepdim=True)
+            cams = F.relu((weights * activations.detach()[row_index]).sum(dim=1))
+
+            maps = []
+            for cam in cams:
+                peak = float(cam.max())
+                maps.append((cam / peak).cpu().numpy().astype(np.float32) if peak > 0 else None)
+            return maps
 
         except Exception as e:
-            print(f"❌ DenseNet121 analysis error: {e}", file=sys.stderr)
-            import traceback
-            print(f"   Traceback: {traceback.format_exc()}", file=sys.stderr)
-            return None
-    
+            logger.error('Grad-CAM error: %s', e)
+            return [None] * len(rows)
+        finally:
+            # Drop the captured graph as soon as the maps are built
+            cam_capture.clear()
+
     def ensemble_predictions(self, clip_result, densenet_result, xray_type="chest"):
         """Combine predictions from OpenCLIP and DenseNet121 using weighted ensemble"""
-        print("🤝 Creating ensemble prediction from multiple models...", file=sys.stderr)
+        logger.debug('Creating ensemble prediction from multiple models...')
 
         if not clip_result or not densenet_result:
             # If one model failed, return the working one
@@ -280,9 +816,9 @@ class MedicalAIPipeline:
         primary = max(ensemble_scores, key=ensemble_scores.get)
         confidence = ensemble_scores[primary]
 
-        print(f"✅ Ensemble complete. Primary: {primary}, Confidence: {confidence:.2f}", file=sys.stderr)
-        print(f"   CLIP contributed: {clip_result['primary_diagnosis']} ({clip_result['overall_confidence']:.2f})", file=sys.stderr)
-        print(f"   DenseNet contributed: {densenet_result['primary_diagnosis']} ({densenet_result['overall_confidence']:.2f})", file=sys.stderr)
+        logger.debug('Ensemble complete. Primary: %s, Confidence: %.2f', primary, confidence)
+        logger.debug('CLIP contributed: %s (%.2f)', clip_result['primary_diagnosis'], clip_result['overall_confidence'])
+        logger.debug('DenseNet contributed: %s (%.2f)', densenet_result['primary_diagnosis'], densenet_result['overall_confidence'])
 
         return {
             'primary_diagnosis': primary,
@@ -296,150 +832,142 @@ class MedicalAIPipeline:
         }
 
     def analyze_with_medclip(self, processed_image, xray_type="chest"):
-        """Primary analysis using MedCLIP if available; fallback to BiomedCLIP via Transformers; else CV fallback."""
-        print("=" * 80, file=sys.stderr)
-        print("🔬 STARTING MEDCLIP ANALYSIS", file=sys.stderr)
-        print("=" * 80, file=sys.stderr)
+        """Primary analysis using MedCLIP if available; fallback to BiomedCLIP via OpenCLIP; else CV fallback."""
+        return self.analyze_with_medclip_batch([processed_image], [xray_type])[0]
+
+    def _predict_with_medclip_package(self, processed_image, xray_type):
+        """Single-image MedCLIP package prediction; returns None when the model errors"""
+        with torch.no_grad():
+            try:
+                if hasattr(self.medclip_model, 'forward'):
+                    logger.debug('Using MedCLIP forward method')
+                    outputs = self.medclip_model(self._image_tensor(processed_image).unsqueeze(0))
+                    predictions = F.softmax(outputs, dim=1)
+                else:
+                    logger.warning('MedCLIP model has no forward method, using random predictions')
+                    record_fallback('medclip_random_predictions')
+                    predictions = torch.rand(1, 10)
+                    predictions = F.softmax(predictions, dim=1)
+                conditions = self.get_medical_conditions(xray_type)
+                results = {}
+                for i, condition in enumerate(conditions):
+                    if i < predictions.shape[1]:
+                        results[condition] = float(predictions[0][i])
+
+                primary_diagnosis = max(results, key=results.get)
+                logger.debug('MedCLIP SUCCESS: Primary diagnosis = %s', primary_diagnosis)
+                logger.debug('MedCLIP confidence: %.2f', float(torch.max(predictions)))
+
+                return {
+                    'primary_diagnosis': primary_diagnosis,
+                    'confidence_scores': results,
+                    'overall_confidence': float(torch.max(predictions)),
+                    'model': 'MedCLIP 0.0.3'
+                }
+            except Exception as model_error:
+                logger.error('MedCLIP prediction error: %s', model_error, exc_info=True)
+                return None
 
+    def _clip_image_input(self, processed_image, preprocess_fn):
+        """Convert a preprocessed tensor into the (C, H, W) input expected by the CLIP image tower"""
+        try:
+            from torchvision.transforms.functional import to_pil_image
+            pil_img = to_pil_image(processed_image) if hasattr(processed_image, 'dtype') else processed_image
+            return preprocess_fn(pil_img)
+        except Exception as img_err:
+            logger.debug('Image conversion warning: %s, using original', img_err)
+            return processed_image
+
+    def _clip_input(self, processed_image, clip_entry):
+        """CLIP image-tower input, derived once per ``DecodedImage`` and CLIP variant"""
+        if isinstance(processed_image, DecodedImage):
+            return processed_image.derive(
+                ('clip', clip_entry.spec.weights_key),
+                lambda: self._clip_image_input(processed_image.tensor, clip_entry.preprocess)
+            )
+        return self._clip_image_input(processed_image, clip_entry.preprocess)
+
+    def analyze_with_medclip_batch(self, processed_images, xray_types):
+        """Batched MedCLIP/OpenCLIP analysis: one CLIP encode_image for all images, results in input order."""
+        logger.debug('STARTING MEDCLIP ANALYSIS (%s image(s))', len(processed_images))
+
+        results = [None] * len(processed_images)
         try:
             # 1) Try MedCLIP package (if it actually loaded)
-            print(f"🔍 Checking MedCLIP availability...", file=sys.stderr)
-            print(f"   MEDCLIP_AVAILABLE: {MEDCLIP_AVAILABLE}", file=sys.stderr)
-            print(f"   self.medclip_model: {self.medclip_model is not None}", file=sys.stderr)
+            logger.debug('Checking MedCLIP availability...')
+            logger.debug('MEDCLIP_AVAILABLE: %s', MEDCLIP_AVAILABLE)
+            logger.debug('self.medclip_model: %s', self.medclip_model is not None)
 
             if MEDCLIP_AVAILABLE and self.medclip_model:
-                print("✅ MedCLIP model is available, attempting prediction...", file=sys.stderr)
-                with torch.no_grad():
-                    try:
-                        if hasattr(self.medclip_model, 'forward'):
-                            print("   Using MedCLIP forward method", file=sys.stderr)
-                            outputs = self.medclip_model(processed_image.unsqueeze(0))
-                            predictions = F.softmax(outputs, dim=1)
-                        else:
-                            print("   ⚠️ WARNING: MedCLIP model has no forward method, using random predictions", file=sys.stderr)
-                            predictions = torch.rand(1, 10)
-                            predictions = F.softmax(predictions, dim=1)
-                        conditions = self.get_medical_conditions(xray_type)
-                        results = {}
-                        for i, condition in enumerate(conditions):
-                            if i < predictions.shape[1]:
-                                results[condition] = float(predictions[0][i])
-
-                        primary_diagnosis = max(results, key=results.get)
-                        print(f"✅ MedCLIP SUCCESS: Primary diagnosis = {primary_diagnosis}", file=sys.stderr)
-                        print(f"   Confidence: {float(torch.max(predictions)):.2%}", file=sys.stderr)
-
-                        return {
-                            'primary_diagnosis': primary_diagnosis,
-                            'confidence_scores': results,
-                            'overall_confidence': float(torch.max(predictions)),
-                            'model': 'MedCLIP 0.0.3'
-                        }
-                    except Exception as model_error:
-                        print(f"❌ MedCLIP prediction error: {model_error}", file=sys.stderr)
-                        import traceback
-                        print(f"   Traceback: {traceback.format_exc()}", file=sys.stderr)
+                logger.debug('MedCLIP model is available, attempting prediction...')
+                for i, (processed_image, xray_type) in enumerate(zip(processed_images, xray_types)):
+                    results[i] = self._predict_with_medclip_package(processed_image, xray_type)
             else:
-                print("⚠️ MedCLIP not available, trying OpenCLIP...", file=sys.stderr)
+                logger.debug('MedCLIP not available, trying OpenCLIP...')
+
+            pending = [i for i, result in enumerate(results) if result is None]
 
             # 2) Try BiomedCLIP via OpenCLIP (Microsoft's medical-specific CLIP model)
-            print(f"🔍 Checking OpenCLIP availability: {OPENCLIP_AVAILABLE}", file=sys.stderr)
-            if OPENCLIP_AVAILABLE:
-                print("✅ OpenCLIP available, attempting to load model...", file=sys.stderr)
+            logger.debug('Checking OpenCLIP availability: %s', OPENCLIP_AVAILABLE)
+            if pending and OPENCLIP_AVAILABLE and self.clip_registry:
+                logger.debug('OpenCLIP available, using registry model...')
                 try:
-                    print("DEBUG: Attempting to load BiomedCLIP (trained on 15M medical images)...", file=sys.stderr)
-                    # Try BiomedCLIP first (best for medical imaging)
-                    # Trained on 15M medical image-text pairs from PubMed
-                    try:
-                        model, _, preprocess_fn = open_clip.create_model_and_transforms(
-                            'hf-hub:microsoft/BiomedCLIP-PubMedBERT_256-vit_base_patch16_224'
-                        )
-                        tokenizer = open_clip.get_tokenizer('hf-hub:microsoft/BiomedCLIP-PubMedBERT_256-vit_base_patch16_224')
-                        print("✅ BiomedCLIP loaded successfully!", file=sys.stderr)
-                        model_name = "BiomedCLIP (Medical Specialist)"
-                    except Exception as biomed_err:
-                        # Fallback to standard ViT-B-32 if BiomedCLIP unavailable
-                        print(f"⚠️ BiomedCLIP unavailable ({str(biomed_err)[:100]}), using ViT-B-32 fallback", file=sys.stderr)
-                        model, _, preprocess_fn = open_clip.create_model_and_transforms(
-                            'ViT-B-32',
-                            pretrained='laion2b_s34b_b79k'
-                        )
-                        tokenizer = open_clip.get_tokenizer('ViT-B-32')
-                        model_name = "Medical CLIP (OpenCLIP ViT-B-32)"
-                    model.eval()
-                    model = model.to(self.device)
-                    
-                    print("DEBUG: OpenCLIP model loaded successfully", file=sys.stderr)
-                    
-                    # Prepare medical-specific prompts with professional terminology
-                    conditions = self.get_medical_conditions(xray_type)
-                    # Use multiple medical phrasings for better accuracy
-                    prompts = []
-                    for c in conditions:
-                        if xray_type == 'chest':
-                            prompts.append(f"frontal chest radiograph demonstrating {c.lower()} with characteristic radiological findings")
-                        elif xray_type == 'bone':
-                            prompts.append(f"bone radiograph showing {c.lower()} with typical imaging features")
-                        elif xray_type == 'dental':
-                            prompts.append(f"dental radiograph revealing {c.lower()} with diagnostic findings")
-                        elif xray_type == 'spine':
-                            prompts.append(f"spinal radiograph indicating {c.lower()} with pathological changes")
-                        else:
-                            prompts.append(f"radiograph demonstrating {c.lower()} with typical medical imaging features")
-                    
-                    # Convert processed tensor to PIL image for OpenCLIP preprocessing
-                    try:
-                        from torchvision.transforms.functional import to_pil_image
-                        pil_img = to_pil_image(processed_image) if hasattr(processed_image, 'dtype') else processed_image
-                        image_input = preprocess_fn(pil_img).unsqueeze(0).to(self.device)
-                    except Exception as img_err:
-                        print(f"DEBUG: Image conversion warning: {img_err}, using original", file=sys.stderr)
-                        image_input = processed_image.unsqueeze(0).to(self.device)
-                    
-                    # Tokenize text
-                    text_tokens = tokenizer(prompts).to(self.device)
-                    
-                    # Get embeddings and compute similarity
+                    clip_entry = self.clip_registry.resolve()
+                    if clip_entry is None:
+                        raise RuntimeError(f"No OpenCLIP model could be loaded: {self.clip_registry.stats()['failed']}")
+                    model_name = clip_entry.spec.display_name
+
+                    # Stack every pending image into one batch for the image tower
+                    image_input = torch.stack([
+                        self._clip_input(processed_images[i], clip_entry) for i in pending
+                    ]).to(self.device)
+
                     with torch.no_grad():
-                        image_features = model.encode_image(image_input)
-                        text_features = model.encode_text(text_tokens)
-                        
-                        # Normalize features
-                        image_features = F.normalize(image_features, dim=-1)
-                        text_features = F.normalize(text_features, dim=-1)
-                        
-                        # Calculate similarity (logits)
-                        logits = (100.0 * image_features @ text_features.T)
-                        probs = F.softmax(logits, dim=-1).squeeze(0)
-                    
-                    results = {cond: float(probs[i]) for i, cond in enumerate(conditions)}
-                    primary = max(results, key=results.get)
-
-                    print(f"DEBUG: Medical CLIP analysis successful. Primary: {primary}, Confidence: {float(probs.max()):.2f}", file=sys.stderr)
-                    print(f"DEBUG: Using model: {model_name}", file=sys.stderr)
-
-                    return {
-                        'primary_diagnosis': primary,
-                        'confidence_scores': results,
-                        'overall_confidence': float(probs.max()),
-                        'model': model_name
-                    }
+                        image_features = F.normalize(self._encode_image(clip_entry, image_input).float(), dim=-1)
+
+                    for row, i in enumerate(pending):
+                        conditions = self.get_medical_conditions(xray_types[i])
+                        # Precomputed, normalized text features for this model and xray_type
+                        text_features = self.get_text_features(clip_entry, xray_types[i])
+
+                        # Calculate similarity (logits): a single matrix multiply per image
+                        with torch.no_grad():
+                            logits = (100.0 * image_features[row] @ text_features.T)
+                            probs = F.softmax(logits, dim=-1)
+
+                        scores = {cond: float(probs[j]) for j, cond in enumerate(conditions)}
+                        primary = max(scores, key=scores.get)
+
+                        logger.debug('Medical CLIP analysis successful. Primary: %s, Confidence: %.2f', primary, float(probs.max()))
+
+                        results[i] = {
+                            'primary_diagnosis': primary,
+                            'confidence_scores': scores,
+                            'overall_confidence': float(probs.max()),
+                            'model': model_name
+                        }
+                    logger.debug('Using model: %s', model_name)
+                    pending = []
                 except Exception as e:
-                    print(f"❌ Medical CLIP OpenCLIP path failed: {e}", file=sys.stderr)
-                    import traceback
-                    print(f"   Traceback: {traceback.format_exc()}", file=sys.stderr)
-            else:
-                print("⚠️ OpenCLIP not available", file=sys.stderr)
+                    logger.error('Medical CLIP OpenCLIP path failed: %s', e, exc_info=True)
+            elif pending:
+                logger.warning('OpenCLIP not available')
 
             # 3) Final fallback
-            print("⚠️⚠️⚠️ FALLING BACK TO CV ANALYSIS (THIS SHOULD NOT HAPPEN IN PRODUCTION) ⚠️⚠️⚠️", file=sys.stderr)
-            return self.fallback_analysis(processed_image, xray_type)
+            if pending:
+                logger.warning('FALLING BACK TO CV ANALYSIS (THIS SHOULD NOT HAPPEN IN PRODUCTION)')
+                record_fallback('cv_analysis', len(pending))
+                for i in pending:
+                    results[i] = self.fallback_analysis(processed_images[i], xray_types[i])
+            return results
         except Exception as e:
-            print(f"❌ CRITICAL: MedCLIP/BiomedCLIP analysis error: {e}", file=sys.stderr)
-            import traceback
-            print(f"   Full traceback: {traceback.format_exc()}", file=sys.stderr)
-            print("⚠️ FALLING BACK TO CV ANALYSIS DUE TO ERROR", file=sys.stderr)
-            return self.fallback_analysis(processed_image, xray_type)
+            logger.error('MedCLIP/BiomedCLIP analysis error: %s', e, exc_info=True)
+            logger.warning('FALLING BACK TO CV ANALYSIS DUE TO ERROR')
+            record_fallback('cv_analysis', sum(result is None for result in results))
+            return [
+                result if result is not None else self.fallback_analysis(processed_image, xray_type)
+                for result, processed_image, xray_type in zip(results, processed_images, xray_types)
+            ]
     
     def get_medical_conditions(self, xray_type):
         """Get medical conditions based on X-ray type"""
@@ -469,14 +997,11 @@ class MedicalAIPipeline:
     
     def fallback_analysis(self, processed_image, xray_type):
         """Fallback analysis using computer vision"""
-        print("=" * 80, file=sys.stderr)
-        print("🚨 FALLBACK ANALYSIS ACTIVATED", file=sys.stderr)
-        print("⚠️ WARNING: Using basic CV analysis instead of AI models", file=sys.stderr)
-        print("=" * 80, file=sys.stderr)
+        logger.warning('FALLBACK ANALYSIS ACTIVATED')
 
         try:
             # Basic image analysis
-            image_np = processed_image.numpy() if hasattr(processed_image, 'numpy') else processed_image
+            image_np = self._image_numpy(processed_image)
             
             # Analyze image characteristics
             brightness = np.mean(image_np)
@@ -522,14 +1047,11 @@ class MedicalAIPipeline:
                 'findings': findings
             }
 
-            print(f"🚨 FALLBACK RESULT: {primary} (confidence: 0.75)", file=sys.stderr)
-            print("=" * 80, file=sys.stderr)
+            logger.warning('FALLBACK RESULT: %s (confidence: 0.75)', primary)
             return result
 
         except Exception as e:
-            print(f"❌ CRITICAL: Fallback analysis error: {e}", file=sys.stderr)
-            import traceback
-            print(f"   Traceback: {traceback.format_exc()}", file=sys.stderr)
+            logger.error('Fallback analysis error: %s', e, exc_info=True)
             return {
                 'primary_diagnosis': 'Analysis Failed',
                 'confidence_scores': {'Error': 1.0},
@@ -538,30 +1060,41 @@ class MedicalAIPipeline:
                 'findings': ['Analysis could not be completed']
             }
     
-    def generate_medical_report(self, diagnosis, patient_info, xray_type):
-        """Generate professional medical report using DeepSeek 3.1 (OPTIONAL - Fast fallback available)"""
-        print("=" * 80, file=sys.stderr)
-        print("📝 GENERATING MEDICAL REPORT WITH DEEPSEEK (OPTIONAL)", file=sys.stderr)
-        print("=" * 80, file=sys.stderr)
+    def generate_medical_report(self, diagnosis, patient_info, xray_type, on_delta=None):
+        """Generate professional medical report using DeepSeek 3.1 (OPTIONAL - Fast fallback available)
+
+        With ``on_delta`` the DeepSeek call is streamed and every text chunk is
+        passed to ``on_delta`` as it arrives. If the stream fails part-way the
+        fallback report is returned, so the returned report is authoritative.
+        """
+        logger.debug('GENERATING MEDICAL REPORT WITH DEEPSEEK (OPTIONAL)')
 
         try:
             api_key = os.environ.get('DEEPSEEK_API_KEY')
             use_deepseek = os.environ.get('USE_DEEPSEEK', 'false').lower() == 'true'
 
-            print(f"🔑 API Key status: {'Found' if api_key else 'NOT FOUND'}", file=sys.stderr)
-            print(f"⚙️ USE_DEEPSEEK setting: {use_deepseek}", file=sys.stderr)
+            logger.debug('API Key status: %s', 'Found' if api_key else 'NOT FOUND')
+            logger.debug('USE_DEEPSEEK setting: %s', use_deepseek)
 
             if api_key:
-                print(f"   API Key length: {len(api_key)} characters", file=sys.stderr)
-                print(f"   API Key prefix: {api_key[:10]}...", file=sys.stderr)
+                logger.debug('API Key length: %s characters', len(api_key))
 
             if not api_key or not use_deepseek:
+                record_fallback('report_llm_disabled' if not use_deepseek else 'report_no_api_key')
                 if not use_deepseek:
-                    print("⚡ FAST MODE: Skipping DeepSeek, using instant fallback report", file=sys.stderr)
+                    logger.debug('FAST MODE: Skipping DeepSeek, using instant fallback report')
                 else:
-                    print("❌ DEEPSEEK_API_KEY not found in environment, using fallback report", file=sys.stderr)
+                    logger.warning('DEEPSEEK_API_KEY not found in environment, using fallback report')
                 return self.fallback_report(diagnosis, patient_info, xray_type)
-            
+
+            # Repeated studies (e.g. normal chest films) are answered from the report cache
+            cache_key = self.report_cache.key(diagnosis, patient_info, xray_type)
+            cached_report = self.report_cache.get(cache_key)
+            if cached_report is not None:
+                logger.debug('Report cache hit - skipping DeepSeek call')
+                cached_report['cache_hit'] = True
+                return cached_report
+
             # Prepare prompt for DeepSeek
             prompt = f"""
 Como mÃ©dico radiologista especialista, analise os seguintes achados de IA e gere um relatÃ³rio mÃ©dico profissional:
@@ -585,68 +1118,73 @@ Gere um relatÃ³rio mÃ©dico estruturado incluindo:
 Use linguagem mÃ©dica profissional e seja especÃ­fico nas recomendaÃ§Ãµes.
 """
             
-            # Call DeepSeek 3.1 via OpenRouter
-            print("📡 Calling DeepSeek API via OpenRouter...", file=sys.stderr)
-            print("⏱️  Request timeout: 30 seconds (fast mode)", file=sys.stderr)
-            print("🔄 Waiting for API response...", file=sys.stderr)
-
-            try:
-                response = requests.post(
-                'https://openrouter.ai/api/v1/chat/completions',
-                headers={
-                    'Authorization': f'Bearer {api_key}',
-                    'Content-Type': 'application/json'
-                },
-                json={
-                    'model': 'deepseek/deepseek-chat',
-                    'messages': [
-                        {
-                            'role': 'system',
-                            'content': 'VocÃª Ã© um mÃ©dico radiologista experiente. Gere relatÃ³rios mÃ©dicos profissionais e precisos.'
-                        },
-                        {
-                            'role': 'user',
-                            'content': prompt
-                        }
-                    ],
-                    'max_tokens': 1000,
-                    'temperature': 0.3
+            # Call DeepSeek 3.1 via OpenRouter (shared, pooled, retrying client)
+            client = self.get_llm_client()
+            logger.debug('Calling DeepSeek API via %s...', client.base_url)
+            logger.debug('Request timeout: %.0f seconds, up to %s retries', client.timeout, client.max_retries)
+            logger.debug('Waiting for API response...')
+
+            messages = [
+                {
+                    'role': 'system',
+                    'content': 'VocÃª Ã© um mÃ©dico radiologista experiente. Gere relatÃ³rios mÃ©dicos profissionais e precisos.'
                 },
-                timeout=30  # Fast timeout - fallback if slow
-                )
-            except requests.exceptions.Timeout:
-                print("⏱️ DeepSeek API timeout (30s) - using fast fallback", file=sys.stderr)
-                return self.fallback_report(diagnosis, patient_info, xray_type)
-            except requests.exceptions.RequestException as e:
-                print(f"❌ DeepSeek API connection error: {e}", file=sys.stderr)
+                {
+                    'role': 'user',
+                    'content': prompt
+                }
+            ]
+            try:
+                if on_delta is not None:
+                    # Stream tokens so the caller can show the report while it is generated
+                    chunks = []
+                    for delta in client.stream_chat_completion(
+                        messages=messages,
+                        api_key=api_key,
+                        model='deepseek/deepseek-chat',
+                        max_tokens=1000,
+                        temperature=0.3
+                    ):
+                        chunks.append(delta)
+                        on_delta(delta)
+                    report = ''.join(chunks)
+                else:
+                    report = client.chat_completion(
+                        messages=messages,
+                        api_key=api_key,
+                        model='deepseek/deepseek-chat',
+                        max_tokens=1000,
+                        temperature=0.3
+                    )
+            except LLMRequestError as e:
+                record_fallback('report_llm_timeout' if e.timed_out else 'report_llm_error')
+                if e.timed_out:
+                    logger.warning('DeepSeek API timeout (%.0fs) - using fast fallback', client.timeout)
+                else:
+                    logger.error('DeepSeek API error: %s', e)
                 return self.fallback_report(diagnosis, patient_info, xray_type)
 
-            print(f"✅ Response received!", file=sys.stderr)
-            print(f"📡 DeepSeek API response status: {response.status_code}", file=sys.stderr)
+            logger.debug('DeepSeek report generated successfully (%s chars)', len(report))
+            generated = {
+                'report': report,
+                'generated_by': 'DeepSeek 3.1',
+                'timestamp': datetime.now().isoformat()
+            }
+            self.report_cache.put(cache_key, generated)
+            return generated
 
-            if response.status_code == 200:
-                result = response.json()
-                report = result['choices'][0]['message']['content']
-                print(f"✅ DeepSeek report generated successfully ({len(report)} chars)", file=sys.stderr)
-                print("=" * 80, file=sys.stderr)
-                return {
-                    'report': report,
-                    'generated_by': 'DeepSeek 3.1',
-                    'timestamp': datetime.now().isoformat()
-                }
-            else:
-                print(f"❌ DeepSeek API error: {response.status_code}", file=sys.stderr)
-                print(f"   Response: {response.text[:200]}", file=sys.stderr)
-                print("⚠️ Using fallback report", file=sys.stderr)
-                return self.fallback_report(diagnosis, patient_info, xray_type)
-                
         except Exception as e:
-            print(f"❌ Report generation error: {e}", file=sys.stderr)
-            import traceback
-            print(f"   Traceback: {traceback.format_exc()}", file=sys.stderr)
-            print("⚠️ Using fallback report", file=sys.stderr)
+            logger.error('Report generation error: %s', e, exc_info=True)
+            record_fallback('report_llm_error')
             return self.fallback_report(diagnosis, patient_info, xray_type)
     
+    def get_llm_client(self):
+        """Shared OpenRouter client, so report requests reuse pooled keep-alive connections"""
+        with self._llm_client_lock:
+            if self._llm_client is None:
+                self._llm_client = OpenRouterClient.from_env()
+            return self._llm_client
+
     def fallback_report(self, diagnosis, patient_info, xray_type):
         """Fallback medical report generation"""
         primary = diagnosis['primary_diagnosis']
@@ -678,110 +1216,555 @@ Este relatório foi gerado por sistema de IA e deve ser interpretado por médico
             'timestamp': datetime.now().isoformat()
         }
     
-    def generate_heatmap(self, processed_image, diagnosis):
-        """Generate heatmap visualization for medical images
+    def heatmap_grid(self, processed_image, activation_map=None, max_side=None):
+        """Activation grid behind a heatmap, as uint8 in [0, 255]
+
+        Grad-CAM maps are kept at feature-map resolution (7x7 for 224px input).
+        The intensity-based fallback is blurred at image resolution and, with
+        ``max_side``, area-downsampled so its longer side fits.
+
+        MONAI tensors are (C, W, H) (see ``to_monai_layout``), so the image and
+        the Grad-CAM map computed from it are transposed back to (H, W) to line
+        up with the X-ray as ``read_grayscale`` returns it.
 
-        Note: Real Grad-CAM requires model-specific layer targeting and is complex.
-        This implementation uses intensity-based visualization as a reliable fallback.
-        For production-grade Grad-CAM, consider fine-tuning with the specific model architecture.
+        Returns:
+            (kind, grid, gray) where kind is 'grad_cam' or 'intensity' and gray is
+            the uint8 image used as overlay base, both (H, W)
         """
-        try:
-            print("🔥 Generating heatmap visualization...", file=sys.stderr)
+        image_np = self._image_numpy(processed_image)
 
-            # NOTE: Real Grad-CAM implementation requires exact model architecture knowledge
-            # and can be unstable. Using reliable intensity-based visualization for now.
-            # Future improvement: Implement custom Grad-CAM with proper layer inspection
+        if len(image_np.shape) == 3:
+            gray = np.mean(image_np, axis=0)
+        else:
+            gray = image_np
+        if self.monai_transforms is not None:
+            gray = gray.T
+            if activation_map is not None:
+                activation_map = activation_map.T
+        value_range = float(gray.max() - gray.min())
+        gray_u8 = np.uint8(255 * (gray - gray.min()) / value_range) if value_range > 0 else np.zeros(gray.shape, np.uint8)
+
+        if activation_map is not None:
+            return 'grad_cam', np.uint8(255 * np.clip(activation_map, 0.0, 1.0)), gray_u8
+
+        # Apply Gaussian blur to smooth the heatmap, then normalize
+        grid = np.uint8(cv2.normalize(cv2.GaussianBlur(gray_u8, (21, 21), 0), None, 0, 255, cv2.NORM_MINMAX))
+        if max_side and max(grid.shape) > max_side:
+            scale = max_side / max(grid.shape)
+            size = (max(1, round(grid.shape[1] * scale)), max(1, round(grid.shape[0] * scale)))
+            grid = cv2.resize(grid, size, interpolation=cv2.INTER_AREA)
+        return 'intensity', grid, gray_u8
+
+    def render_heatmap(self, grid, size=None, image_format='png', base_image=None, image_path=None):
+        """Render an activation grid to a colored data URI
+
+        Args:
+            grid: ``grid`` dict of a compact visualization, or a (kind, uint8 array) pair
+            size: Longer side of the output in pixels (default: base image size, else 224)
+            image_format: 'png' or 'webp'
+            base_image: uint8 grayscale X-ray that Grad-CAM maps are blended over
+            image_path: Original X-ray to read as base image when base_image is not given
+
+        Returns:
+            ``data:image/<format>;base64,...`` string
+        """
+        if isinstance(grid, dict):
+            kind = grid.get('kind', 'grad_cam')
+            height, width = grid['shape']
+            values = np.frombuffer(base64.b64decode(grid['data']), dtype=np.uint8).reshape(height, width)
+        else:
+            kind, values = grid
+
+        image_format = (image_format or 'png').lower()
+        if image_format not in ('png', 'webp'):
+            raise ValueError(f"Unsupported heatmap format: {image_format}")
+
+        if base_image is None and image_path:
+            # Decoded no larger than the output needs (1/2, 1/4 or 1/8 scale)
+            base_image = read_grayscale(image_path, target_size=int(size) if size else None)
+            if base_image is None:
+                raise ValueError(f"Could not read base image: {image_path}")
+
+        # Keep the base image's aspect ratio, or the grid's when there is no base
+        reference = base_image.shape if base_image is not None else values.shape
+        if size or base_image is None:
+            scale = int(size or 224) / max(reference)
+            out_size = (max(1, round(reference[1] * scale)), max(1, round(reference[0] * scale)))
+        else:
+            out_size = (reference[1], reference[0])
 
-            # Create enhanced intensity-based heatmap
-            print("📊 Creating enhanced visualization based on image features", file=sys.stderr)
-            image_np = processed_image.numpy() if hasattr(processed_image, 'numpy') else processed_image
+        interpolation = cv2.INTER_CUBIC if max(out_size) > max(values.shape) else cv2.INTER_AREA
+        # Apply colormap (JET shows hot=red, cold=blue)
+        colored = cv2.applyColorMap(cv2.resize(values, out_size, interpolation=interpolation), cv2.COLORMAP_JET)
 
-            if len(image_np.shape) == 3:
-                gray = np.mean(image_np, axis=0)
-            else:
-                gray = image_np
+        if kind == 'grad_cam' and base_image is not None:
+            # Blend over the X-ray so highlighted regions keep their anatomical context
+            base = cv2.resize(base_image, out_size, interpolation=cv2.INTER_AREA)
+            colored = cv2.addWeighted(cv2.cvtColor(base, cv2.COLOR_GRAY2BGR), 0.6, colored, 0.4, 0)
+
+        params = [cv2.IMWRITE_WEBP_QUALITY, 85] if image_format == 'webp' else []
+        _, buffer = cv2.imencode(f'.{image_format}', colored, params)
+        return f"data:image/{image_format};base64,{base64.b64encode(buffer).decode('utf-8')}"
 
-            # Apply Gaussian blur to smooth the heatmap
-            gray_smooth = cv2.GaussianBlur(np.uint8(255 * (gray - gray.min()) / (gray.max() - gray.min())), (21, 21), 0)
+    def generate_heatmap(self, processed_image, diagnosis, activation_map=None, mode='full'):
+        """Generate heatmap visualization for medical images
+
+        With an ``activation_map`` from ``densenet_grad_cam`` the Grad-CAM of
+        the primary diagnosis is upsampled and blended over the X-ray. Without
+        one (DenseNet unavailable) an intensity-based visualization is used.
+
+        ``mode`` selects the output: 'full' embeds a rendered PNG, 'compact'
+        returns only the low-resolution uint8 grid for ``render_heatmap`` to
+        turn into an image on demand, and 'none' skips the heatmap.
+        """
+        if mode == 'none':
+            return {
+                'heatmap': None,
+                'mode': 'none',
+                'description': 'Mapa de calor não solicitado'
+            }
 
-            # Normalize and create heatmap
-            heatmap = cv2.normalize(gray_smooth, None, 0, 255, cv2.NORM_MINMAX)
-            heatmap = np.uint8(heatmap)
+        try:
+            logger.debug('Generating heatmap visualization...')
 
-            # Apply colormap (JET shows hot=red, cold=blue)
-            heatmap_colored = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
+            max_side = self.heatmap_grid_size if mode == 'compact' else None
+            kind, grid, gray_u8 = self.heatmap_grid(processed_image, activation_map, max_side=max_side)
+            if kind == 'grad_cam':
+                logger.debug('Rendering Grad-CAM from the DenseNet121 pass')
+                description = f"Grad-CAM (MONAI DenseNet121) para {diagnosis['primary_diagnosis']}"
+            else:
+                logger.debug('Creating enhanced visualization based on image features')
+                record_fallback('intensity_heatmap')
+                description = f"Visualização baseada em características da imagem para {diagnosis['primary_diagnosis']}"
 
-            # Convert to base64
-            _, buffer = cv2.imencode('.png', heatmap_colored)
-            heatmap_b64 = base64.b64encode(buffer).decode('utf-8')
+            if mode == 'compact':
+                return {
+                    'heatmap': None,
+                    'mode': 'compact',
+                    'grid': {
+                        'kind': kind,
+                        'shape': list(grid.shape),
+                        'data': base64.b64encode(np.ascontiguousarray(grid).tobytes()).decode('ascii')
+                    },
+                    'description': description
+                }
 
-            print("✅ Enhanced visualization generated successfully", file=sys.stderr)
+            heatmap = self.render_heatmap((kind, grid), base_image=gray_u8)
+            logger.debug('Enhanced visualization generated successfully')
 
             return {
-                'heatmap': f"data:image/png;base64,{heatmap_b64}",
-                'description': f"Visualização baseada em características da imagem para {diagnosis['primary_diagnosis']}"
+                'heatmap': heatmap,
+                'mode': 'full',
+                'description': description
             }
 
         except Exception as e:
-            print(f"❌ Heatmap generation error: {e}", file=sys.stderr)
-            import traceback
-            print(f"   Traceback: {traceback.format_exc()}", file=sys.stderr)
+            logger.error('Heatmap generation error: %s', e, exc_info=True)
             return {
                 'heatmap': None,
                 'description': 'Mapa de calor não disponível'
             }
-    
-    def complete_analysis(self, image_path, xray_type="chest", patient_info=None):
-        """Complete medical analysis pipeline"""
-        if patient_info is None:
-            patient_info = {}
-        
+
+    def complete_analysis(self, image_path, xray_type="chest", patient_info=None, tta_views=None,
+                          on_event=None, heatmap_mode=None, request_id=None):
+        """Complete medical analysis pipeline
+
+        ``image_path`` is a file path or the encoded image bytes themselves.
+        ``heatmap_mode`` is 'full', 'compact' or 'none' (default: XRAY_AI_HEATMAP_MODE).
+
+        ``on_event``, if given, receives incremental events before the result is
+        returned: ``{'event': 'diagnosis', ...}`` as soon as the models finish,
+        ``{'event': 'report_delta', 'delta': ...}`` for each report chunk, then
+        ``{'event': 'heatmap', ...}``.
+
+        ``request_id`` tags the analysis's log records.
+        """
+        batch_on_event = (lambda index, event: on_event(event)) if on_event else None
+        return self.complete_analysis_batch([image_path], [xray_type], [patient_info], tta_views=tta_views,
+                                            on_event=batch_on_event, heatmap_modes=heatmap_mode,
+                                            request_ids=[request_id])[0]
+
+    def complete_analysis_batch(self, image_paths, xray_types="chest", patient_infos=None,
+                                batch_size=DEFAULT_BATCH_SIZE, tta_views=None, on_event=None,
+                                heatmap_modes=None, request_ids=None, on_result=None, finish_workers=1):
+        """Complete medical analysis for many studies using batched model forwards
+
+        Images (file paths or encoded bytes, which may be mixed) are
+        preprocessed one by one, stacked into batches of up to
+        ``batch_size`` for the CLIP ``encode_image`` and DenseNet121 forwards,
+        then fanned back out into one result per study, in input order, with
+        the same schema as ``complete_analysis``.
+
+        With ``tta_views`` > 1 (default: XRAY_AI_TTA_VIEWS) every image also
+        contributes seeded augmented views to the same forward pass and its
+        scores are averaged over the views.
+
+        ``on_event(index, event)`` streams the events described in
+        ``complete_analysis`` for the study at position ``index``.
+
+        ``heatmap_modes`` is one mode for every study or a list with one per
+        study. Grad-CAM is skipped for a chunk where no study wants a heatmap.
+
+        ``request_ids`` (one per study) tag each study's log records; batched
+        stages are logged with the IDs of every study in the batch.
+
+        The per-study stages after the forwards (report, heatmap, quality)
+        run in ``finish_workers`` threads, overlapping the next batch's
+        forwards, and ``on_result(index, result)`` is called as each study
+        finishes rather than when the whole batch does.
+        """
+        image_paths, xray_types, patient_infos, tta_views, heatmap_modes, request_ids = self._batch_arguments(
+            image_paths, xray_types, patient_infos, tta_views, heatmap_modes, request_ids
+        )
+        count = len(image_paths)
+        batch_size = max(1, batch_size)
+        results = [None] * count
+
+        def finish(index, finisher):
+            results[index] = finisher()
+            if on_result is not None:
+                on_result(index, results[index])
+
+        executor = None
+        if finish_workers and finish_workers > 1 and count > 1:
+            executor = ThreadPoolExecutor(max_workers=finish_workers, thread_name_prefix='analysis-finish')
         try:
-            print(f"DEBUG: Starting complete analysis for {xray_type} X-ray", file=sys.stderr)
-            print(f"DEBUG: Patient info: {patient_info}", file=sys.stderr)
-            
-            # 1. Preprocess image
-            print("DEBUG: Step 1 - Preprocessing image...", file=sys.stderr)
-            processed_image = self.preprocess_image(image_path)
-            if processed_image is None:
-                raise Exception("Image preprocessing failed")
-            print("DEBUG: Image preprocessing completed", file=sys.stderr)
-            
-            # 2. Run both models for ensemble prediction
-            print("DEBUG: Step 2 - Running AI models (OpenCLIP + DenseNet ensemble)...", file=sys.stderr)
+            finishing = []
+            for start in range(0, count, batch_size):
+                end = start + batch_size
+                chunk_on_event = (lambda index, event, start=start: on_event(start + index, event)) if on_event else None
+                finishers = self._analyze_chunk(
+                    image_paths[start:end], xray_types[start:end], patient_infos[start:end], tta_views,
+                    on_event=chunk_on_event, heatmap_modes=heatmap_modes[start:end],
+                    request_ids=request_ids[start:end]
+                )
+                for index, finisher in enumerate(finishers, start):
+                    if executor is None:
+                        finish(index, finisher)
+                    else:
+                        finishing.append(executor.submit(finish, index, finisher))
+            for future in finishing:
+                future.result()
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+        return results
+
+    def prepare_analysis_batch(self, image_paths, xray_types="chest", patient_infos=None, tta_views=None,
+                               on_event=None, heatmap_modes=None, request_ids=None):
+        """Run the batched model stages for one batch now and return the rest of each study's work
+
+        Preprocessing, the CLIP and DenseNet121 forwards and Grad-CAM run
+        over all of ``image_paths`` as one batch (arguments as in
+        ``complete_analysis_batch``; the caller sizes the batch).
+
+        Returns one callable per study, in input order, that runs the
+        per-study stages (report, heatmap, quality) and returns the same
+        result as ``complete_analysis``. The callables are independent, so
+        a caller such as the micro-batching scheduler can run them
+        concurrently and hand every result back as soon as it is ready.
+        """
+        image_paths, xray_types, patient_infos, tta_views, heatmap_modes, request_ids = self._batch_arguments(
+            image_paths, xray_types, patient_infos, tta_views, heatmap_modes, request_ids
+        )
+        return self._analyze_chunk(image_paths, xray_types, patient_infos, tta_views, on_event=on_event,
+                                   heatmap_modes=heatmap_modes, request_ids=request_ids)
+
+    def _batch_arguments(self, image_paths, xray_types, patient_infos, tta_views, heatmap_modes, request_ids):
+        """Per-study argument lists with defaults applied; raises ValueError on mismatched lengths"""
+        tta_views = max(1, int(tta_views)) if tta_views is not None else self.tta_views
+        image_paths = list(image_paths)
+        count = len(image_paths)
+        if isinstance(xray_types, str):
+            xray_types = [xray_types] * count
+        if patient_infos is None:
+            patient_infos = [None] * count
+        if heatmap_modes is None or isinstance(heatmap_modes, str):
+            heatmap_modes = [heatmap_modes] * count
+        if request_ids is None:
+            request_ids = [None] * count
+        if (len(xray_types) != count or len(patient_infos) != count or len(heatmap_modes) != count
+                or len(request_ids) != count):
+            raise ValueError("image_paths, xray_types, patient_infos, heatmap_modes and request_ids "
+                             "must have the same length")
+        heatmap_modes = [self.validate_heatmap_mode(mode or self.heatmap_mode) for mode in heatmap_modes]
+        return image_paths, xray_types, patient_infos, tta_views, heatmap_modes, request_ids
+
+    def _analysis_error(self, error):
+        return {
+            'success': False,
+            'error': str(error),
+            'timestamp': datetime.now().isoformat()
+        }
 
-            # Run OpenCLIP/BiomedCLIP
-            clip_diagnosis = self.analyze_with_medclip(processed_image, xray_type)
-            print(f"DEBUG: OpenCLIP analysis completed: {clip_diagnosis.get('primary_diagnosis', 'Unknown')}", file=sys.stderr)
+    def _result_cache_key(self, image_path, xray_type, tta_views, heatmap_mode):
+        """Content-addressed key for one study, or None when the cache is off or the file unreadable"""
+        if self.result_cache is None:
+            return None
+        try:
+            return self.result_cache.key(DecodedImage.wrap(image_path).cache_identity, xray_type, tta_views,
+                                         heatmap_mode)
+        except OSError:
+            return None
 
-            # Run DenseNet121 if available
-            densenet_diagnosis = None
-            if self.densenet_model:
-                densenet_diagnosis = self.analyze_with_densenet(processed_image, xray_type)
-                if densenet_diagnosis:
-                    print(f"DEBUG: DenseNet analysis completed: {densenet_diagnosis.get('primary_diagnosis', 'Unknown')}", file=sys.stderr)
-                    # Create ensemble prediction
-                    diagnosis = self.ensemble_predictions(clip_diagnosis, densenet_diagnosis, xray_type)
-                    print(f"DEBUG: Ensemble prediction: {diagnosis.get('primary_diagnosis', 'Unknown')}", file=sys.stderr)
+    def _record_batch_stage(self, stage, started, study_timings, results=None):
+        """Observe a batched stage once and charge its duration to every study in the batch"""
+        seconds = time.perf_counter() - started
+        model = next((result.get('model', '') for result in results or [] if result), '')
+        observe_stage(stage, seconds, model)
+        for timings in study_timings:
+            timings.add(stage, seconds)
+
+    def _event_emitter(self, on_event, index):
+        """Per-study event callback; a failing consumer never breaks the analysis"""
+        if on_event is None:
+            return None
+
+        def emit(event):
+            try:
+                on_event(index, event)
+            except Exception as e:
+                logger.warning('Event consumer failed for %s: %s', event.get('event'), e)
+        return emit
+
+    def _study_finisher(self, request_id, started, work, *args, **kwargs):
+        """Callable running ``work`` for one study in its log context and recording the outcome"""
+        def finish():
+            with log_context(request_id=request_id):
+                result = work(*args, **kwargs)
+            outcome = 'cache_hit' if result.get('cache_hit') else 'success' if result.get('success') else 'error'
+            total_ms = result.get('timings', {}).get('total_ms')
+            record_analysis(outcome, total_ms / 1000 if total_ms is not None else time.perf_counter() - started)
+            return result
+        return finish
+
+    def _analyze_chunk(self, image_paths, xray_types, patient_infos, tta_views=1, on_event=None,
+                       heatmap_modes=None, request_ids=None):
+        """Preprocess and run both models once for the whole chunk; returns each study's finisher"""
+        patient_infos = [info if info is not None else {} for info in patient_infos]
+        heatmap_modes = heatmap_modes or [self.heatmap_mode] * len(image_paths)
+        request_ids = request_ids or [None] * len(image_paths)
+        finishers = [None] * len(image_paths)
+        processed = {}
+        cache_keys = {}
+        # Every study's clock starts with the chunk, so total_ms includes time spent on its batch mates
+        chunk_started = time.perf_counter()
+        timings = [StudyTimings(chunk_started) for _ in image_paths]
+
+        # 1. Preprocess images, skipping studies whose model outputs are already cached
+        logger.debug('Step 1 - Preprocessing %s image(s)...', len(image_paths))
+        for i, image_path in enumerate(image_paths):
+            with log_context(request_id=request_ids[i]):
+                logger.debug('Starting complete analysis for %s X-ray', xray_types[i])
+                # One shared object per study: the file is read once for both the cache key and decoding
+                image = DecodedImage.wrap(image_path)
+                with timings[i].stage('cache_lookup'):
+                    cache_key = self._result_cache_key(image, xray_types[i], tta_views, heatmap_modes[i])
+                    cached = self.result_cache.get(cache_key) if cache_key else None
+                if cached is not None:
+                    logger.debug('Result cache hit for %s', image.label)
+                    emit = self._event_emitter(on_event, i)
+                    if emit:
+                        emit({'event': 'diagnosis', 'xray_type': xray_types[i], 'diagnosis': cached['diagnosis']})
+                    finishers[i] = self._study_finisher(
+                        request_ids[i], chunk_started, self._finish_cached,
+                        xray_types[i], patient_infos[i], cached, emit=emit, timings=timings[i]
+                    )
+                    continue
+                cache_keys[i] = cache_key
+                if MONAI_AVAILABLE and self.monai_transforms:
+                    with timings[i].stage('decode'):
+                        try:
+                            image.array
+                        except Exception:
+                            pass  # preprocess_image falls back to MONAI's readers or reports the failure
+                with timings[i].stage('preprocess'):
+                    tensor = self.preprocess_image(image)
+                if tensor is None:
+                    logger.warning('Complete analysis error: Image preprocessing failed (%s)', image.label)
+                    finishers[i] = self._study_finisher(request_ids[i], chunk_started, self._analysis_error,
+                                                        "Image preprocessing failed")
                 else:
-                    print("DEBUG: DenseNet failed, using OpenCLIP only", file=sys.stderr)
-                    diagnosis = clip_diagnosis
+                    processed[i] = image
+        logger.debug('Image preprocessing completed')
+
+        if not processed:
+            return finishers
+        indices = list(processed)
+        # Every image contributes one view, or tta_views views when augmentation is requested
+        images, types, owners = [], [], []
+        for row, i in enumerate(indices):
+            views = self.build_tta_views(processed[i], tta_views)
+            images.extend(views)
+            types.extend([xray_types[i]] * len(views))
+            owners.extend([row] * len(views))
+
+        def per_image(view_results):
+            grouped = [[] for _ in indices]
+            for owner, result in zip(owners, view_results):
+                grouped[owner].append(result)
+            return [self.average_diagnoses(group) for group in grouped]
+
+        # 2. Run both models for ensemble prediction, one batched forward each
+        logger.debug('Step 2 - Running AI models (OpenCLIP + DenseNet ensemble)...')
+        # Grad-CAM is only captured when at least one study wants a heatmap
+        cam_capture = {} if any(heatmap_modes[i] != 'none' for i in indices) else None
+        batch_timings = [timings[i] for i in indices]
+        for study_timings in batch_timings:
+            study_timings.batch_size = len(indices)
+        BATCH_SIZE.observe(len(indices))
+        # Batched stages belong to every study in the batch
+        batch_ids = [request_ids[i] for i in indices if request_ids[i] is not None] or None
+        try:
+            started = time.perf_counter()
+            with log_context(request_id=batch_ids, stage='clip'):
+                clip_results = self.analyze_with_medclip_batch(images, types)
+            self._record_batch_stage('clip', started, batch_timings, clip_results)
+            clip_diagnoses = per_image(clip_results)
+            if self.densenet_model:
+                started = time.perf_counter()
+                with log_context(request_id=batch_ids, stage='densenet'):
+                    densenet_results = self.analyze_with_densenet_batch(images, types, cam_capture=cam_capture)
+                self._record_batch_stage('densenet', started, batch_timings, densenet_results)
+                densenet_diagnoses = per_image(densenet_results)
             else:
-                print("DEBUG: DenseNet not available, using OpenCLIP only", file=sys.stderr)
-                diagnosis = clip_diagnosis
-            
-            # 3. Generate medical report
-            print("DEBUG: Step 3 - Generating medical report...", file=sys.stderr)
-            report = self.generate_medical_report(diagnosis, patient_info, xray_type)
-            print("DEBUG: Medical report generated", file=sys.stderr)
-            
-            # 4. Generate heatmap
-            print("DEBUG: Step 4 - Generating heatmap...", file=sys.stderr)
-            heatmap = self.generate_heatmap(processed_image, diagnosis)
-            print("DEBUG: Heatmap generated", file=sys.stderr)
-            
+                logger.debug('DenseNet not available, using OpenCLIP only')
+                record_fallback('densenet_unavailable', len(indices))
+                densenet_diagnoses = [None] * len(indices)
+            started = time.perf_counter()
+            diagnoses = [
+                self._combine_diagnoses(xray_types[i], clip_diagnoses[row], densenet_diagnoses[row])
+                for row, i in enumerate(indices)
+            ]
+            self._record_batch_stage('ensemble', started, batch_timings)
+            # Diagnoses go out before Grad-CAM, heatmaps or reports: they are the first useful output
+            emitters = {i: self._event_emitter(on_event, i) for i in indices}
+            for row, i in enumerate(indices):
+                if emitters[i]:
+                    emitters[i]({'event': 'diagnosis', 'xray_type': xray_types[i], 'diagnosis': diagnoses[row]})
+            # Grad-CAM of each study's final diagnosis, taken from its unaugmented view in the pass above
+            started = time.perf_counter()
+            with log_context(request_id=batch_ids, stage='grad_cam'):
+                activation_maps = self.densenet_grad_cam(
+                    cam_capture,
+                    [owners.index(row) for row in range(len(indices))],
+                    [xray_types[i] for i in indices],
+                    [diagnosis['primary_diagnosis'] for diagnosis in diagnoses]
+                )
+            if cam_capture is not None:
+                self._record_batch_stage('grad_cam', started, batch_timings)
+        except Exception as e:
+            logger.error('Complete analysis error: %s', e, exc_info=True, extra={'request_id': batch_ids})
+            for i in indices:
+                finishers[i] = self._study_finisher(request_ids[i], chunk_started, self._analysis_error, e)
+            return finishers
+
+        for row, i in enumerate(indices):
+            finishers[i] = self._study_finisher(
+                request_ids[i], chunk_started, self._finish_analysis,
+                processed[i], xray_types[i], patient_infos[i], diagnoses[row], activation_maps[row],
+                cache_key=cache_keys[i], emit=emitters[i], heatmap_mode=heatmap_modes[i], timings=timings[i]
+            )
+        return finishers
+
+    def _combine_diagnoses(self, xray_type, clip_diagnosis, densenet_diagnosis):
+        """Ensemble of the CLIP and DenseNet diagnoses for one study"""
+        logger.debug('OpenCLIP analysis completed: %s', clip_diagnosis.get('primary_diagnosis', 'Unknown'))
+
+        if densenet_diagnosis:
+            logger.debug('DenseNet analysis completed: %s', densenet_diagnosis.get('primary_diagnosis', 'Unknown'))
+            # Create ensemble prediction
+            diagnosis = self.ensemble_predictions(clip_diagnosis, densenet_diagnosis, xray_type)
+            logger.debug('Ensemble prediction: %s', diagnosis.get('primary_diagnosis', 'Unknown'))
+        else:
+            logger.debug('DenseNet result unavailable, using OpenCLIP only')
+            diagnosis = clip_diagnosis
+        return diagnosis
+
+    def _finish_analysis(self, processed_image, xray_type, patient_info, diagnosis, activation_map=None,
+                         cache_key=None, emit=None, heatmap_mode='full', timings=None):
+        """Report for one study, then its heatmap and quality, cached under cache_key"""
+        timings = timings or StudyTimings()
+        try:
+            report = self._stream_report(xray_type, patient_info, diagnosis, emit, timings)
+
+            # 4. Generate heatmap, last: it is the least urgent output
+            logger.debug('Step 4 - Generating heatmap...')
+            with timings.stage('heatmap'):
+                heatmap = self.generate_heatmap(processed_image, diagnosis, activation_map, mode=heatmap_mode)
+            logger.debug('Heatmap generated')
+            with timings.stage('quality'):
+                image_quality = self.assess_image_quality(processed_image)
+
+            # Only image-derived outputs are cached; the report depends on patient_info.
+            # A failed heatmap carries no 'mode' and is not cached.
+            if cache_key and 'mode' in heatmap:
+                with timings.stage('cache_store'):
+                    self.result_cache.put(cache_key, {
+                        'diagnosis': diagnosis,
+                        'visualization': heatmap,
+                        'image_quality': image_quality
+                    })
+
+            return self._compile_result(xray_type, patient_info, diagnosis, report, heatmap, image_quality,
+                                        emit=emit, timings=timings)
+
+        except Exception as e:
+            logger.error('Complete analysis error: %s', e, exc_info=True)
+            return self._analysis_error(e)
+
+    def _finish_cached(self, xray_type, patient_info, cached, emit=None, timings=None):
+        """Report for a study whose model outputs came from the result cache"""
+        timings = timings or StudyTimings()
+        try:
+            report = self._stream_report(xray_type, patient_info, cached['diagnosis'], emit, timings)
+            return self._compile_result(xray_type, patient_info, cached['diagnosis'], report,
+                                        cached['visualization'], cached['image_quality'], cache_hit=True,
+                                        emit=emit, timings=timings)
+        except Exception as e:
+            logger.error('Complete analysis error: %s', e, exc_info=True)
+            return self._analysis_error(e)
+
+    def _stream_report(self, xray_type, patient_info, diagnosis, emit, timings):
+        """Medical report for one study, sent through ``emit`` as report deltas while it is generated"""
+        on_delta = None
+        streamed = []
+        if emit:
+            def on_delta(delta):
+                streamed.append(delta)
+                emit({'event': 'report_delta', 'delta': delta})
+
+        # 3. Generate medical report
+        logger.debug('Step 3 - Generating medical report...')
+        with timings.stage('report'):
+            report = self.generate_medical_report(diagnosis, patient_info, xray_type, on_delta=on_delta)
+        logger.debug('Medical report generated')
+        if emit:
+            # Cached and fallback reports arrive whole; send them as a single delta.
+            # A stream that failed part-way is replaced by the fallback report.
+            if not streamed:
+                emit({'event': 'report_delta', 'delta': report.get('report', '')})
+            elif ''.join(streamed) != report.get('report'):
+                emit({'event': 'report_delta', 'delta': report.get('report', ''), 'replace': True})
+        return report
+
+    def _compile_result(self, xray_type, patient_info, diagnosis, report, heatmap, image_quality, cache_hit=False,
+                        emit=None, timings=None):
+        """Final result dict for one study; the heatmap event is sent through ``emit`` first
+
+        The diagnosis event was sent when the models finished and the report
+        streamed by ``_stream_report``, so the heatmap is the last event.
+
+        ``timings`` (a StudyTimings) is added to the result as ``timings``:
+        milliseconds per stage plus ``total_ms``.
+        """
+        try:
+            timings = timings or StudyTimings()
+            if emit:
+                emit({'event': 'heatmap', 'visualization': heatmap})
+
             # 5. Compile complete results
-            print("DEBUG: Step 5 - Compiling results...", file=sys.stderr)
+            logger.debug('Step 5 - Compiling results...')
             results = {
                 'success': True,
                 'timestamp': datetime.now().isoformat(),
@@ -794,26 +1777,25 @@ Este relatório foi gerado por sistema de IA e deve ser interpretado por médico
                 'clinical_recommendations': self.get_clinical_recommendations(diagnosis, xray_type),
                 'confidence_metrics': {
                     'overall_confidence': diagnosis['overall_confidence'],
-                    'image_quality': self.assess_image_quality(processed_image),
+                    'image_quality': image_quality,
                     'analysis_reliability': 'High' if diagnosis['overall_confidence'] > 0.8 else 'Medium'
                 },
                 # Add aiProvider for frontend display
                 'aiProvider': diagnosis.get('model', 'Unknown Model'),
                 'framework': diagnosis.get('model', 'Unknown Model')
             }
-            
-            print(f"DEBUG: Analysis pipeline completed successfully", file=sys.stderr)
+            if cache_hit:
+                results['cache_hit'] = True
+            results['timings'] = timings.as_dict()
+
+            logger.info('Analysis complete: %s (%.2f)', diagnosis.get('primary_diagnosis'),
+                        diagnosis.get('overall_confidence', 0.0),
+                        extra={'cache_hit': cache_hit, 'timings': results['timings']})
             return results
             
         except Exception as e:
-            print(f"Complete analysis error: {e}", file=sys.stderr)
-            import traceback
-            print(f"Traceback: {traceback.format_exc()}", file=sys.stderr)
-            return {
-                'success': False,
-                'error': str(e),
-                'timestamp': datetime.now().isoformat()
-            }
+            logger.error('Complete analysis error: %s', e, exc_info=True)
+            return self._analysis_error(e)
     
     def get_differential_diagnoses(self, diagnosis, xray_type):
         """Get differential diagnoses based on primary diagnosis"""
@@ -861,7 +1843,7 @@ Este relatório foi gerado por sistema de IA e deve ser interpretado por médico
     def assess_image_quality(self, processed_image):
         """Assess image quality metrics"""
         try:
-            image_np = processed_image.numpy() if hasattr(processed_image, 'numpy') else processed_image
+            image_np = self._image_numpy(processed_image)
             
             # Calculate quality metrics
             brightness = np.mean(image_np)
@@ -887,63 +1869,223 @@ Este relatório foi gerado por sistema de IA e deve ser interpretado por médico
         except:
             return "Unknown"
 
-# Global pipeline instance
-medical_pipeline = MedicalAIPipeline()
+# Global pipeline instance, constructed on first use by get_pipeline()
+medical_pipeline = None
+_pipeline_lock = threading.Lock()
 
-def analyze_medical_image(image_path, xray_type="chest", patient_info=None):
+def get_pipeline(runtime_config=None):
+    """Return the shared pipeline, building it (and importing the ML stack) on first call
+
+    ``runtime_config`` only takes effect on that first call.
+    """
+    global medical_pipeline
+    with _pipeline_lock:
+        if medical_pipeline is None:
+            medical_pipeline = MedicalAIPipeline(runtime_config=runtime_config)
+        return medical_pipeline
+
+def analyze_medical_image(image_path, xray_type="chest", patient_info=None, request_id=None):
     """Main function for medical image analysis"""
-    return medical_pipeline.complete_analysis(image_path, xray_type, patient_info)
+    return get_pipeline().complete_analysis(image_path, xray_type, patient_info, request_id=request_id)
+
+def profile_startup(runtime_config=None):
+    """Import and initialization time per dependency, for --startup-profile"""
+    started = time.perf_counter()
+    load_ml_dependencies()
+    imports_done = time.perf_counter()
+    pipeline = get_pipeline(runtime_config)
+    finished = time.perf_counter()
+    return {
+        'imports': {name: round(seconds, 4) for name, seconds in IMPORT_TIMINGS.items()},
+        'initialization': {name: round(seconds, 4) for name, seconds in pipeline.init_timings.items()},
+        'import_seconds': round(imports_done - started, 4),
+        'initialization_seconds': round(finished - imports_done, 4),
+        'total_seconds': round(finished - started + IMPORT_TIMINGS['numpy/PIL/cv2'], 4),
+        'models': pipeline.get_model_stats()
+    }
+
+def quantization_report(image_paths, models=QUANTIZABLE_MODELS, xray_type="chest", repeat=3,
+                        runtime_config=None):
+    """Int8 against fp32 latency, model size and score deviation, for --quantization-report
+
+    Runs both models of an fp32 pipeline on the images (one warm-up pass,
+    then ``repeat`` timed passes), converts the same weights to int8 with
+    ``apply_quantization`` and repeats, then compares the per-condition
+    scores of CLIP, DenseNet121 and their ensemble.
+    """
+    image_paths = list_image_files(image_paths)
+    if not image_paths:
+        raise ValueError("No images given for the quantization report")
+    pipeline = MedicalAIPipeline(quantize=(), runtime_config=runtime_config)
+    xray_types = [xray_type] * len(image_paths)
+    images = [DecodedImage(path) for path in image_paths]
+    for image in images:
+        if pipeline.preprocess_image(image) is None:
+            raise ValueError(f"Image preprocessing failed ({image.label})")
+
+    def clip_module():
+        if pipeline.medclip_model is not None:
+            return pipeline.medclip_model
+        entry = pipeline.clip_registry.resolve() if pipeline.clip_registry else None
+        return entry.model if entry else None
+
+    runs = {}
+    for precision in ('fp32', 'int8'):
+        if precision == 'int8':
+            pipeline.apply_quantization(models)
+        seconds = {'clip': [], 'densenet': []}
+        for timed in [False] + [True] * max(1, repeat):
+            started = time.perf_counter()
+            clip_results = pipeline.analyze_with_medclip_batch(images, xray_types)
+            clip_done = time.perf_counter()
+            densenet_results = pipeline.analyze_with_densenet_batch(images, xray_types)
+            if timed:
+                seconds['clip'].append(clip_done - started)
+                seconds['densenet'].append(time.perf_counter() - clip_done)
+        runs[precision] = {
+            'clip': clip_results,
+            'densenet': densenet_results,
+            'ensemble': [pipeline._combine_diagnoses(xray_type, c, d) for c, d in zip(clip_results, densenet_results)],
+            'ms_per_image': {name: 1000 * float(np.median(values)) / len(images) for name, values in seconds.items()},
+            'model_bytes': {
+                name: serialized_size_bytes(module) if module is not None else None
+                for name, module in (('clip', clip_module()), ('densenet', pipeline.densenet_model))
+            }
+        }
+
+    def deviation(name):
+        pairs = [(a, b) for a, b in zip(runs['fp32'][name], runs['int8'][name]) if a and b]
+        if not pairs:
+            return {'max_score_deviation': None, 'primary_agreement': None}
+        return {
+            'max_score_deviation': round(max(
+                abs(a['confidence_scores'][condition] - b['confidence_scores'].get(condition, 0.0))
+                for a, b in pairs for condition in a['confidence_scores']
+            ), 6),
+            'primary_agreement': sum(a['primary_diagnosis'] == b['primary_diagnosis'] for a, b in pairs) / len(pairs)
+        }
+
+    report = {}
+    for name in ('clip', 'densenet'):
+        fp32_ms, int8_ms = runs['fp32']['ms_per_image'][name], runs['int8']['ms_per_image'][name]
+        fp32_bytes, int8_bytes = runs['fp32']['model_bytes'][name], runs['int8']['model_bytes'][name]
+        report[name] = {
+            'quantized': name in pipeline.quantize,
+            'fp32': {'ms_per_image': round(fp32_ms, 2), 'model_bytes': fp32_bytes},
+            'int8': {'ms_per_image': round(int8_ms, 2), 'model_bytes': int8_bytes},
+            'speedup': round(fp32_ms / int8_ms, 2) if int8_ms else None,
+            'size_ratio': round(int8_bytes / fp32_bytes, 3) if fp32_bytes and int8_bytes else None,
+            **deviation(name)
+        }
+    report['ensemble'] = deviation('ensemble')
+    return {
+        'images': len(image_paths),
+        'repeat': max(1, repeat),
+        'engine': torch.backends.quantized.engine,
+        'models': report
+    }
 
 if __name__ == "__main__":
     # Main execution for subprocess call
     import sys
+    import uuid
+    # Log records go to stderr as JSON lines; stdout carries only the JSON result
+    configure_logging()
+    # Thread/affinity flags are accepted in every mode and override XRAY_AI_* settings
+    runtime_config, remaining_args = RuntimeConfig.from_args(sys.argv[1:])
+    sys.argv = sys.argv[:1] + remaining_args
+    if len(sys.argv) >= 2 and sys.argv[1] == '--startup-profile':
+        print(json.dumps(profile_startup(runtime_config), ensure_ascii=False, indent=2))
+        sys.exit(0)
+
+    if len(sys.argv) >= 2 and sys.argv[1] == '--export-onnx':
+        # Write the CLIP tower's ONNX graph ahead of deployment: --export-onnx [output_dir]
+        # (DenseNet121's random weights are exported in memory by every process instead)
+        pipeline = get_pipeline(runtime_config)
+        exported = pipeline.initialize_onnx_backend(sys.argv[2] if len(sys.argv) > 2 else None)
+        print(json.dumps({'success': bool(exported), 'models': exported}, ensure_ascii=False, indent=2))
+        sys.exit(0 if exported else 1)
+
+    if len(sys.argv) >= 2 and sys.argv[1] == '--quantization-report':
+        import argparse
+        parser = argparse.ArgumentParser(prog='medical_ai_pipeline.py --quantization-report')
+        parser.add_argument('images', nargs='+', help='Image files or directories to compare on')
+        parser.add_argument('--models', default=','.join(QUANTIZABLE_MODELS),
+                            help='Comma-separated models to quantize (clip, densenet or all)')
+        parser.add_argument('--xray-type', default='chest')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed passes per precision')
+        args = parser.parse_args(sys.argv[2:])
+        load_ml_dependencies()
+        report = quantization_report(args.images, parse_quantize_setting(args.models), args.xray_type,
+                                     args.repeat, runtime_config)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        sys.exit(0)
+
+    if len(sys.argv) >= 2 and sys.argv[1] == '--serve':
+        # Long-lived JSON-lines worker: one resident pipeline, many requests,
+        # optionally fanned out to forked worker processes with --processes N
+        from services.pipeline_worker import run_worker
+        from services.worker_pool import PoolSettings
+        pool_settings = PoolSettings.from_args(sys.argv[2:])
+        pipeline = get_pipeline(pool_settings.parent_runtime(runtime_config))
+        sys.exit(run_worker(pipeline, sys.argv[2:], runtime_config))
+
     try:
-        print("DEBUG: Python script started", file=sys.stderr)
-        print(f"DEBUG: Arguments received: {len(sys.argv)}", file=sys.stderr)
-        for i, arg in enumerate(sys.argv):
-            print(f"DEBUG: Arg {i}: {arg[:100]}...", file=sys.stderr)
+        logger.debug('Python script started')
+        logger.debug('Arguments received: %s', len(sys.argv))
         
         if len(sys.argv) >= 2:
             image_path = sys.argv[1]
             xray_type = sys.argv[2] if len(sys.argv) > 2 else "chest"
             patient_info_str = sys.argv[3] if len(sys.argv) > 3 else "{}"
             
-            print(f"DEBUG: Image path: {image_path}", file=sys.stderr)
-            print(f"DEBUG: X-ray type: {xray_type}", file=sys.stderr)
-            print(f"DEBUG: Patient info string: {patient_info_str[:200]}...", file=sys.stderr)
-            
-            # Check if image file exists
-            import os
-            if not os.path.exists(image_path):
-                print(f"DEBUG: Image file does not exist: {image_path}", file=sys.stderr)
-                error_result = {
-                    'success': False,
-                    'error': f'Image file not found: {image_path}',
-                    'timestamp': datetime.now().isoformat()
-                }
-                print(json.dumps(error_result, ensure_ascii=False))
-                sys.exit(1)
+            logger.debug('Image path: %s', image_path)
+            logger.debug('X-ray type: %s', xray_type)
             
-            # Check image file size
-            file_size = os.path.getsize(image_path)
-            print(f"DEBUG: Image file size: {file_size} bytes", file=sys.stderr)
+            if image_path == '-':
+                # Encoded image piped on stdin: decoded in memory, no temp file needed
+                image_source = sys.stdin.buffer.read()
+                logger.debug('Read %s image bytes from stdin', len(image_source))
+                if not image_source:
+                    error_result = {
+                        'success': False,
+                        'error': 'No image data received on stdin',
+                        'timestamp': datetime.now().isoformat()
+                    }
+                    print(json.dumps(error_result, ensure_ascii=False))
+                    sys.exit(1)
+            else:
+                # Check if image file exists
+                import os
+                if not os.path.exists(image_path):
+                    logger.warning('Image file does not exist: %s', image_path)
+                    error_result = {
+                        'success': False,
+                        'error': f'Image file not found: {image_path}',
+                        'timestamp': datetime.now().isoformat()
+                    }
+                    print(json.dumps(error_result, ensure_ascii=False))
+                    sys.exit(1)
+
+                # Check image file size
+                file_size = os.path.getsize(image_path)
+                logger.debug('Image file size: %s bytes', file_size)
+                image_source = image_path
             
             # Parse patient info
             try:
                 patient_info = json.loads(patient_info_str)
-                print(f"DEBUG: Patient info parsed successfully: {patient_info}", file=sys.stderr)
+                logger.debug('Patient info parsed (%s field(s))', len(patient_info))
             except Exception as e:
-                print(f"DEBUG: Failed to parse patient info: {e}", file=sys.stderr)
+                logger.warning('Failed to parse patient info: %s', e)
                 patient_info = {}
             
-            # Test image loading
+            # Test image loading; the decoded pixels are reused by the analysis
+            image = DecodedImage(image_source)
             try:
-                from PIL import Image
-                test_image = Image.open(image_path)
-                print(f"DEBUG: Image loaded successfully: {test_image.size}, mode: {test_image.mode}", file=sys.stderr)
-                test_image.close()
+                logger.debug('Image loaded successfully: %s, dtype: %s', image.array.shape, image.array.dtype)
             except Exception as e:
-                print(f"DEBUG: Failed to load image: {e}", file=sys.stderr)
+                logger.error('Failed to load image: %s', e)
                 error_result = {
                     'success': False,
                     'error': f'Failed to load image: {str(e)}',
@@ -952,10 +2094,13 @@ if __name__ == "__main__":
                 print(json.dumps(error_result, ensure_ascii=False))
                 sys.exit(1)
             
-            print("DEBUG: Starting medical analysis...", file=sys.stderr)
+            logger.debug('Starting medical analysis...')
             # Run analysis
-            result = analyze_medical_image(image_path, xray_type, patient_info)
-            print(f"DEBUG: Analysis completed, result keys: {list(result.keys()) if isinstance(result, dict) else 'Not a dict'}", file=sys.stderr)
+            get_pipeline(runtime_config)
+            # Set by the caller to correlate these logs with its own; otherwise one per run
+            request_id = os.environ.get('XRAY_AI_REQUEST_ID') or uuid.uuid4().hex
+            result = analyze_medical_image(image, xray_type, patient_info, request_id=request_id)
+            logger.debug('Analysis completed, result keys: %s', list(result.keys()) if isinstance(result, dict) else 'Not a dict')
             
             # Output result as JSON
             print(json.dumps(result, ensure_ascii=False))
@@ -965,7 +2110,7 @@ if __name__ == "__main__":
             error_result = {
                 'success': False,
                 'error': 'Missing required arguments',
-                'usage': 'python medical_ai_pipeline.py <image_path> [xray_type] [patient_info_json]'
+                'usage': 'python medical_ai_pipeline.py [--intra-op-threads N] [--inter-op-threads N] [--opencv-threads N] [--cpu-affinity LIST | --worker-index I --cores-per-worker N] <image_path|-> [xray_type] [patient_info_json] | --serve [--concurrency N] [--batch-window-ms MS] [--max-batch-size N] [--processes N] | --startup-profile | --export-onnx [output_dir] | --quantization-report [--models clip,densenet] <image|dir>...'
             }
             print(json.dumps(error_result, ensure_ascii=False))
             
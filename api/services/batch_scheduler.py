@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Dynamic Micro-Batching Scheduler
+Collects requests that arrive close together and runs them as one batched pipeline call
+"""
+
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Callable, Optional, Union
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(RuntimeError):
+    """Raised when a request arrives while the scheduler queue is at max depth"""
+
+
+@dataclass
+class SchedulerSettings:
+    """Latency vs. throughput knobs for the micro-batching scheduler"""
+    window_ms: float = 10.0
+    max_batch_size: int = 8
+    max_queue_depth: int = 256
+    concurrency: int = 1
+    finish_workers: int = 8
+
+    @classmethod
+    def from_env(cls) -> 'SchedulerSettings':
+        return cls(
+            window_ms=float(os.environ.get('XRAY_AI_BATCH_WINDOW_MS', cls.window_ms)),
+            max_batch_size=int(os.environ.get('XRAY_AI_MAX_BATCH_SIZE', cls.max_batch_size)),
+            max_queue_depth=int(os.environ.get('XRAY_AI_MAX_QUEUE_DEPTH', cls.max_queue_depth)),
+            concurrency=int(os.environ.get('XRAY_AI_WORKER_CONCURRENCY', cls.concurrency)),
+            finish_workers=int(os.environ.get('XRAY_AI_FINISH_WORKERS', cls.finish_workers))
+        )
+
+
+@dataclass
+class _PendingRequest:
+    image_path: Union[str, bytes]
+    xray_type: str
+    patient_info: Dict[str, Any]
+    tta_views: Optional[int]
+    future: asyncio.Future
+    on_event: Optional[Callable[[Dict[str, Any]], None]] = None
+    heatmap_mode: Optional[str] = None
+    request_id: Any = None
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    settled: bool = False
+
+
+class MicroBatchScheduler:
+    """
+    Asyncio front end that turns concurrent single-study requests into batches.
+
+    A batch opens when the first request arrives and closes after
+    ``window_ms`` or once ``max_batch_size`` requests are collected, whichever
+    comes first. Only the model forwards are batched: the batch runs through
+    ``prepare_analysis_batch`` in a worker thread, then every study's report
+    and heatmap run on their own in ``finish_workers`` threads and each
+    caller's future is resolved as soon as its own study is done, so one
+    slow LLM report never holds up its batch mates. ``concurrency`` batches
+    may run their forwards at the same time.
+
+    A pipeline stand-in without ``prepare_analysis_batch`` (an
+    InferencePool) gets the whole batch through ``complete_analysis_batch``
+    and reports each study back through ``on_result`` as it finishes.
+    """
+
+    def __init__(self, pipeline, settings: Optional[SchedulerSettings] = None):
+        self.pipeline = pipeline
+        self.settings = settings or SchedulerSettings.from_env()
+        self._queue: Optional[asyncio.Queue] = None
+        self._consumers: List[asyncio.Task] = []
+        self._executor = ThreadPoolExecutor(max_workers=max(1, self.settings.concurrency),
+                                            thread_name_prefix='batch')
+        self._finish_executor = ThreadPoolExecutor(max_workers=max(1, self.settings.finish_workers),
+                                                   thread_name_prefix='finish')
+        self._finishing = set()
+        # Metrics
+        self.requests_total = 0
+        self.rejected_total = 0
+        self.batches_total = 0
+        self.last_batch_size = 0
+        self.batch_size_counts: Dict[int, int] = {}
+        self.queue_wait_seconds_total = 0.0
+        self.batch_seconds_total = 0.0
+
+    async def start(self):
+        """Create the queue and consumer tasks on the running event loop"""
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=max(1, self.settings.max_queue_depth))
+        self._consumers = [
+            asyncio.ensure_future(self._consume()) for _ in range(max(1, self.settings.concurrency))
+        ]
+
+    async def stop(self):
+        """Finish queued requests, then stop the consumers"""
+        if self._queue is None:
+            return
+        await self._queue.join()
+        for task in self._consumers:
+            task.cancel()
+        await asyncio.gather(*self._consumers, return_exceptions=True)
+        self._consumers = []
+        self._queue = None
+        self._executor.shutdown(wait=True)
+        self._finish_executor.shutdown(wait=True)
+
+    async def submit(self, image_path: Union[str, bytes], xray_type: str = 'chest',
+                     patient_info: Optional[Dict[str, Any]] = None,
+                     tta_views: Optional[int] = None,
+                     on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+                     heatmap_mode: Optional[str] = None, request_id: Any = None) -> Dict[str, Any]:
+        """
+        Queue one study and wait for its analysis result.
+
+        ``on_event`` receives the pipeline's incremental events (diagnosis,
+        report deltas, heatmap); it is called from the scheduler's worker threads.
+        ``request_id`` tags the study's log records.
+        """
+        if self._queue is None:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        pending = _PendingRequest(image_path, xray_type, patient_info or {}, tta_views, future, on_event,
+                                  heatmap_mode, request_id)
+        try:
+            self._queue.put_nowait(pending)
+        except asyncio.QueueFull:
+            self.rejected_total += 1
+            raise QueueFullError(f"Scheduler queue is full ({self.settings.max_queue_depth} pending requests)")
+        self.requests_total += 1
+        return await future
+
+    async def _collect(self) -> List[_PendingRequest]:
+        """Block for the first request, then gather more until the window closes or the batch is full"""
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.settings.window_ms / 1000.0
+        while len(batch) < self.settings.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            started = time.perf_counter()
+            try:
+                # A batch call takes one tta_views value, so mixed batches run as concurrent groups
+                groups: Dict[Optional[int], List[_PendingRequest]] = {}
+                for request in batch:
+                    groups.setdefault(request.tta_views, []).append(request)
+                await asyncio.gather(*(self._run_group(loop, group, tta_views, started)
+                                       for tta_views, group in groups.items()))
+            finally:
+                self._record_batch(len(batch), time.perf_counter() - started)
+
+    def _settle(self, request: _PendingRequest, result: Optional[Dict[str, Any]] = None,
+                error: Optional[BaseException] = None):
+        """Resolve one caller's future and mark its queue item done; later calls are ignored"""
+        if request.settled:
+            return
+        request.settled = True
+        if not request.future.done():
+            if error is not None:
+                request.future.set_exception(error)
+            else:
+                request.future.set_result(result)
+        self._queue.task_done()
+
+    async def _run_group(self, loop, group: List[_PendingRequest], tta_views: Optional[int], started: float):
+        """Run one group's batched forward; its studies are settled as they finish"""
+        for request in group:
+            self.queue_wait_seconds_total += started - request.enqueued_at
+
+        callbacks = [r.on_event for r in group]
+
+        def on_event(index: int, event: Dict[str, Any]):
+            if callbacks[index] is not None:
+                callbacks[index](event)
+
+        kwargs = {
+            'image_paths': [r.image_path for r in group],
+            'xray_types': [r.xray_type for r in group],
+            'patient_infos': [r.patient_info for r in group],
+            'tta_views': tta_views,
+            'on_event': on_event if any(callbacks) else None,
+            'heatmap_modes': [r.heatmap_mode for r in group],
+            'request_ids': [r.request_id for r in group]
+        }
+        try:
+            if hasattr(self.pipeline, 'prepare_analysis_batch'):
+                finishers = await loop.run_in_executor(
+                    self._executor, lambda: self.pipeline.prepare_analysis_batch(**kwargs)
+                )
+            else:
+                def on_result(index: int, result: Dict[str, Any]):
+                    loop.call_soon_threadsafe(self._settle, group[index], result)
+
+                await loop.run_in_executor(
+                    self._executor,
+                    lambda: self.pipeline.complete_analysis_batch(
+                        batch_size=len(group), on_result=on_result,
+                        finish_workers=self.settings.finish_workers, **kwargs
+                    )
+                )
+                finishers = None
+        except Exception as e:
+            logger.error('Batched analysis of %s request(s) failed: %s', len(group), e)
+            for request in group:
+                self._settle(request, error=e)
+            return
+
+        if finishers is None:
+            # on_result settled its studies before the batch call returned; any left had no result
+            for request in group:
+                self._settle(request, error=RuntimeError("Batch finished without a result for this study"))
+            return
+        for request, finish in zip(group, finishers):
+            task = asyncio.ensure_future(self._finish(loop, request, finish))
+            self._finishing.add(task)
+            task.add_done_callback(self._finishing.discard)
+
+    async def _finish(self, loop, request: _PendingRequest, finish: Callable[[], Dict[str, Any]]):
+        """Run one study's report and heatmap stages and hand its result to the caller"""
+        try:
+            result = await loop.run_in_executor(self._finish_executor, finish)
+        except Exception as e:
+            logger.error('Finishing analysis failed: %s', e, extra={'request_id': request.request_id})
+            self._settle(request, error=e)
+        else:
+            self._settle(request, result)
+
+    def _record_batch(self, size: int, seconds: float):
+        self.batches_total += 1
+        self.last_batch_size = size
+        self.batch_size_counts[size] = self.batch_size_counts.get(size, 0) + 1
+        self.batch_seconds_total += seconds
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def metrics(self) -> Dict[str, Any]:
+        """Settings and counters for tuning latency against throughput"""
+        completed = sum(size * count for size, count in self.batch_size_counts.items())
+        return {
+            'settings': {
+                'window_ms': self.settings.window_ms,
+                'max_batch_size': self.settings.max_batch_size,
+                'max_queue_depth': self.settings.max_queue_depth,
+                'concurrency': self.settings.concurrency,
+                'finish_workers': self.settings.finish_workers
+            },
+            'queue_depth': self.queue_depth,
+            'requests_total': self.requests_total,
+            'rejected_total': self.rejected_total,
+            'batches_total': self.batches_total,
+            'last_batch_size': self.last_batch_size,
+            'mean_batch_size': completed / self.batches_total if self.batches_total else 0.0,
+            'batch_size_counts': dict(sorted(self.batch_size_counts.items())),
+            'mean_queue_wait_ms': 1000.0 * self.queue_wait_seconds_total / completed if completed else 0.0,
+            'mean_batch_ms': 1000.0 * self.batch_seconds_total / self.batches_total if self.batches_total else 0.0
+        }
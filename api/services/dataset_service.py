@@ -174,19 +174,19 @@ class MedicalDatasetService:
             dataset_info = self.get_dataset_info(dataset_id)
             
             if not dataset_info or not dataset_info.huggingface_id:
-                logger.warning(f"No Hugging Face ID for dataset {dataset_id}")
+                logger.warning("No Hugging Face ID for dataset %s", dataset_id)
                 return None
             
-            logger.info(f"Loading dataset {dataset_info.name} from Hugging Face...")
+            logger.info("Loading dataset %s from Hugging Face...", dataset_info.name)
             dataset = load_dataset(dataset_info.huggingface_id, split=split)
-            logger.info(f"Successfully loaded {len(dataset)} samples")
+            logger.info("Successfully loaded %s samples", len(dataset))
             return dataset
             
         except ImportError:
             logger.error("Hugging Face datasets library not installed")
             return None
         except Exception as e:
-            logger.error(f"Error loading dataset {dataset_id}: {e}")
+            logger.error("Error loading dataset %s: %s", dataset_id, e)
             return None
     
     def get_sample_data(self, dataset_id: str, num_samples: int = 5) -> List[Dict[str, Any]]:
@@ -209,7 +209,7 @@ class MedicalDatasetService:
             return samples
             
         except Exception as e:
-            logger.error(f"Error getting sample data: {e}")
+            logger.error("Error getting sample data: %s", e)
             return []
 
 # Global instance
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+DICOM Ingestion
+Header-only metadata reads and single-frame pixel decoding, downsampled before any float conversion
+"""
+
+import io
+import importlib.util
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from typing import Any, Optional, Union
+
+import numpy as np
+import cv2
+import logging
+
+logger = logging.getLogger(__name__)
+
+# pydicom is optional and only imported once a DICOM file is actually read
+PYDICOM_AVAILABLE = importlib.util.find_spec('pydicom') is not None
+
+DICOM_EXTENSIONS = ('.dcm', '.dicom')
+
+# Part 10 files start with a 128-byte preamble followed by this magic
+_PREAMBLE_LENGTH = 128
+_DICOM_MAGIC = b'DICM'
+
+# Integer dtypes cv2.resize accepts as they are; anything else is resized as float32
+_CV2_RESIZE_DTYPES = (np.uint8, np.uint16, np.int16)
+
+
+def is_dicom(data: bytes) -> bool:
+    """True when ``data`` starts like a DICOM Part 10 file"""
+    return data[_PREAMBLE_LENGTH:_PREAMBLE_LENGTH + len(_DICOM_MAGIC)] == _DICOM_MAGIC
+
+
+def is_dicom_path(path: str) -> bool:
+    """True for files with a DICOM extension or the DICOM magic, reading at most 132 bytes"""
+    if str(path).lower().endswith(DICOM_EXTENSIONS):
+        return True
+    try:
+        with open(path, 'rb') as f:
+            return is_dicom(f.read(_PREAMBLE_LENGTH + len(_DICOM_MAGIC)))
+    except OSError:
+        return False
+
+
+def _first_value(value, default=None):
+    """First item of a multi-valued DICOM element, or the value itself"""
+    if value is None or value == '':
+        return default
+    if isinstance(value, Sequence) and not isinstance(value, (str, bytes)):
+        return value[0] if len(value) else default
+    return value
+
+
+def _require_pydicom():
+    if not PYDICOM_AVAILABLE:
+        raise ValueError("DICOM input needs pydicom (pip install pydicom)")
+    import pydicom
+    return pydicom
+
+
+def _open(source: Union[str, bytes]):
+    return io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source
+
+
+@dataclass
+class DicomHeader:
+    """The image attributes of a DICOM file that decoding and windowing need"""
+    rows: int
+    columns: int
+    frames: int = 1
+    samples_per_pixel: int = 1
+    bits_stored: int = 16
+    photometric: str = 'MONOCHROME2'
+    rescale_slope: float = 1.0
+    rescale_intercept: float = 0.0
+    window_center: Optional[float] = None
+    window_width: Optional[float] = None
+    voi_lut_function: str = 'LINEAR'
+    has_voi_lut: bool = False
+    modality: Optional[str] = None
+    # Header dataset without pixel data, kept for VOI LUT tables
+    dataset: Any = field(default=None, repr=False, compare=False)
+
+    @classmethod
+    def from_dataset(cls, ds) -> 'DicomHeader':
+        if 'Rows' not in ds or 'Columns' not in ds:
+            raise ValueError("DICOM file has no image (Rows/Columns missing)")
+        window_center = _first_value(ds.get('WindowCenter'))
+        window_width = _first_value(ds.get('WindowWidth'))
+        # A window needs both tags; with either missing the min/max stretch is used
+        has_window = window_center is not None and bool(window_width)
+        return cls(
+            rows=int(ds.Rows),
+            columns=int(ds.Columns),
+            frames=int(_first_value(ds.get('NumberOfFrames'), 1) or 1),
+            samples_per_pixel=int(ds.get('SamplesPerPixel', 1)),
+            bits_stored=int(ds.get('BitsStored', ds.get('BitsAllocated', 16))),
+            photometric=str(ds.get('PhotometricInterpretation', 'MONOCHROME2')).upper(),
+            rescale_slope=float(_first_value(ds.get('RescaleSlope'), 1.0)),
+            rescale_intercept=float(_first_value(ds.get('RescaleIntercept'), 0.0)),
+            window_center=float(window_center) if has_window else None,
+            window_width=float(window_width) if has_window else None,
+            voi_lut_function=str(ds.get('VOILUTFunction', 'LINEAR')).upper(),
+            has_voi_lut='VOILUTSequence' in ds,
+            modality=ds.get('Modality'),
+            dataset=ds
+        )
+
+    @property
+    def pixels(self) -> int:
+        """Pixels in one frame"""
+        return self.rows * self.columns
+
+
+def read_dicom_header(source: Union[str, bytes]) -> DicomHeader:
+    """
+    Parse the header of a DICOM file or buffer without reading its pixel data.
+
+    Raises:
+        ValueError: If pydicom is missing or the data is not a DICOM image
+    """
+    pydicom = _require_pydicom()
+    try:
+        ds = pydicom.dcmread(_open(source), stop_before_pixels=True)
+    except Exception as e:
+        raise ValueError(f"Could not read DICOM header: {e}")
+    return DicomHeader.from_dataset(ds)
+
+
+def _read_frame(source: Union[str, bytes], frame: int, header: DicomHeader) -> np.ndarray:
+    """Stored values of one frame; other frames of a multi-frame file are not decoded"""
+    try:
+        from pydicom.pixels import pixel_array
+    except ImportError:
+        # pydicom 2.x decodes every frame through the dataset
+        pixels = _require_pydicom().dcmread(_open(source)).pixel_array
+        return pixels[frame] if header.frames > 1 else pixels
+    return pixel_array(_open(source), index=frame if header.frames > 1 else None)
+
+
+def reduced_size(height: int, width: int, target_size: Optional[int]) -> Optional[tuple]:
+    """
+    (width, height) that keeps both sides at least ``target_size``, or None
+    when the image is already that small (or no target is set).
+    """
+    if not target_size:
+        return None
+    scale = max(target_size / height, target_size / width)
+    if scale >= 1.0:
+        return None
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def area_downsample(pixels: np.ndarray, target_size: Optional[int]) -> np.ndarray:
+    """Area-average ``pixels`` down so both sides stay at least ``target_size``"""
+    size = reduced_size(pixels.shape[0], pixels.shape[1], target_size)
+    if size is None:
+        return pixels
+    if pixels.dtype not in _CV2_RESIZE_DTYPES:
+        pixels = pixels.astype(np.float32)
+    return cv2.resize(pixels, size, interpolation=cv2.INTER_AREA)
+
+
+def apply_window(pixels: np.ndarray, header: DicomHeader, value_range: Optional[tuple] = None) -> np.ndarray:
+    """
+    Map modality values to [0, 1] in place: the VOI LUT table if the file
+    has one, else its window (LINEAR, LINEAR_EXACT or SIGMOID), else
+    ``value_range`` (default: the min and max of ``pixels``).
+    """
+    if header.has_voi_lut:
+        try:
+            from pydicom.pixels import apply_voi_lut
+        except ImportError:
+            from pydicom.pixel_data_handlers.util import apply_voi_lut
+        lut = header.dataset.VOILUTSequence[0]
+        output_bits = int(lut.LUTDescriptor[2]) or header.bits_stored
+        pixels = np.asarray(apply_voi_lut(pixels, header.dataset, prefer_lut=True), dtype=np.float32)
+        pixels /= float(2 ** output_bits - 1)
+    elif header.window_width:
+        center, width = header.window_center, header.window_width
+        if header.voi_lut_function == 'SIGMOID':
+            pixels -= center
+            pixels *= -4.0 / width
+            np.exp(pixels, out=pixels)
+            pixels += 1.0
+            np.reciprocal(pixels, out=pixels)
+        elif header.voi_lut_function == 'LINEAR_EXACT':
+            pixels -= center - width / 2.0
+            pixels /= width
+        else:
+            # DICOM PS3.3 C.11.2.1.2.1
+            pixels -= center - 0.5
+            pixels /= max(width - 1.0, 1.0)
+            pixels += 0.5
+    else:
+        low, high = value_range or (float(pixels.min()), float(pixels.max()))
+        pixels -= low
+        pixels /= (high - low) or 1.0
+    np.clip(pixels, 0.0, 1.0, out=pixels)
+    return pixels
+
+
+def decode_dicom(source: Union[str, bytes], frame: int = 0, target_size: Optional[int] = None,
+                 header: Optional[DicomHeader] = None) -> np.ndarray:
+    """
+    Decode one frame of a DICOM file or buffer to display-ready uint8 pixels.
+
+    Stored values are area-downsampled while still integers, so the only
+    full-resolution array is the decoded frame itself; rescale
+    slope/intercept, windowing and MONOCHROME1 inversion then run in place
+    on the reduced float32 copy. The transforms are monotonic, so this
+    matches transforming first except at pixels straddling a window edge.
+
+    Returns an (H, W) grayscale array, or (H, W, 3) RGB for color files.
+
+    Raises:
+        ValueError: If the file cannot be decoded or ``frame`` is out of range
+    """
+    header = header or read_dicom_header(source)
+    if not 0 <= frame < header.frames:
+        raise ValueError(f"Frame {frame} out of range: the DICOM file has {header.frames} frame(s)")
+    try:
+        stored = _read_frame(source, frame, header)
+    except Exception as e:
+        raise ValueError(f"Could not decode DICOM pixel data: {e}")
+    logger.debug('Decoded DICOM frame %s: %s %s', frame, stored.shape, stored.dtype)
+
+    # Without a window the frame's full-resolution range is used, as a viewer would
+    stored_range = None
+    if header.samples_per_pixel == 1 and not header.window_width and not header.has_voi_lut:
+        stored_range = (int(stored.min()), int(stored.max()))
+    reduced = area_downsample(stored, target_size)
+    del stored
+    if header.samples_per_pixel > 1:
+        # Color (RGB after pydicom's conversion); no windowing applies
+        if reduced.dtype == np.uint8:
+            return reduced
+        return cv2.normalize(reduced.astype(np.float32), None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+
+    pixels = reduced.astype(np.float32)
+    del reduced
+    if header.rescale_slope != 1.0:
+        pixels *= header.rescale_slope
+    if header.rescale_intercept:
+        pixels += header.rescale_intercept
+    value_range = None
+    if stored_range is not None:
+        # Same rescale as the pixels; a negative slope swaps the ends
+        value_range = tuple(sorted(v * header.rescale_slope + header.rescale_intercept for v in stored_range))
+    pixels = apply_window(pixels, header, value_range)
+    if header.photometric == 'MONOCHROME1':
+        # Stored with white as the minimum; invert so bone is bright like every other input
+        np.subtract(1.0, pixels, out=pixels)
+    pixels *= 255.0
+    pixels += 0.5
+    return pixels.astype(np.uint8)
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+In-Memory Image Ingestion
+Read and decode X-ray images once, from files or in-memory bytes (stdin, base64 request fields)
+"""
+
+import io
+import os
+import base64
+import binascii
+import hashlib
+import sys
+from typing import Dict, Any, Callable, Hashable, Iterable, List, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+# Largest image accepted, in pixels per frame, checked from the header before decoding (0 disables)
+DEFAULT_MAX_PIXELS = int(os.environ.get('XRAY_AI_MAX_PIXELS', '64000000'))
+
+# OpenCV has no header-only read, so the limit also has to cap its own decode buffers.
+# It reads OPENCV_IO_MAX_IMAGE_PIXELS once, when first imported, hence before `import cv2`
+if DEFAULT_MAX_PIXELS and 'cv2' not in sys.modules:
+    os.environ.setdefault('OPENCV_IO_MAX_IMAGE_PIXELS', str(DEFAULT_MAX_PIXELS))
+import cv2
+import logging
+
+from services.dicom_io import (
+    DICOM_EXTENSIONS, DicomHeader, area_downsample, decode_dicom, is_dicom, is_dicom_path, read_dicom_header
+)
+
+logger = logging.getLogger(__name__)
+
+ImageSource = Union[str, bytes, bytearray, memoryview]
+
+
+# File extensions picked up when a directory of studies is given
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp') + DICOM_EXTENSIONS
+
+# Shorter side images are reduced to while decoding (0 keeps full resolution);
+# the models see 224x224, so anything above that only serves heatmap overlays
+DEFAULT_DECODE_SIZE = int(os.environ.get('XRAY_AI_DECODE_SIZE', '512'))
+
+# Pixel cap OpenCV's decoders enforce (1 << 30 is OpenCV's default when the variable is unset)
+OPENCV_MAX_PIXELS = int(os.environ.get('OPENCV_IO_MAX_IMAGE_PIXELS', str(1 << 30)))
+
+# cv2.imread flags that let libjpeg (or OpenCV, for other formats) decode at 1/factor scale
+_REDUCED_GRAYSCALE = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8
+}
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when an image's header declares more pixels than XRAY_AI_MAX_PIXELS allows"""
+
+
+def check_pixel_limit(width: int, height: int, max_pixels: Optional[int] = None):
+    """
+    Reject decompression bombs from their declared size, before any pixel is decoded.
+
+    Raises:
+        ImageTooLargeError: If width x height exceeds ``max_pixels`` (default XRAY_AI_MAX_PIXELS)
+    """
+    limit = DEFAULT_MAX_PIXELS if max_pixels is None else max_pixels
+    if limit and width * height > limit:
+        raise ImageTooLargeError(f"Image is {width}x{height} ({width * height} pixels), "
+                                 f"more than the {limit} pixel limit")
+
+
+def opencv_decode(decode: Callable[[], Optional[np.ndarray]],
+                  max_pixels: Optional[int] = None) -> Optional[np.ndarray]:
+    """
+    Run an OpenCV decode, which allocates the full image before anything can be checked.
+
+    That is only safe while OpenCV's own cap (OPENCV_MAX_PIXELS) is within the
+    pixel limit; when it is not (cv2 was imported before this module, or
+    OPENCV_IO_MAX_IMAGE_PIXELS is set higher), the image is refused undecoded.
+
+    Raises:
+        ImageTooLargeError: If OpenCV could allocate more than the limit, or refuses the image's size
+    """
+    limit = DEFAULT_MAX_PIXELS if max_pixels is None else max_pixels
+    if limit and OPENCV_MAX_PIXELS > limit:
+        raise ImageTooLargeError(f"Image is not in a format PIL reads, and OpenCV's {OPENCV_MAX_PIXELS} pixel cap "
+                                 f"exceeds the {limit} pixel limit; set OPENCV_IO_MAX_IMAGE_PIXELS to at most "
+                                 f"{limit} before OpenCV is imported")
+    try:
+        decoded = decode()
+    except cv2.error as e:
+        if 'CV_IO_MAX_IMAGE_PIXELS' in str(e):
+            raise ImageTooLargeError(f"Image is more than OpenCV's {OPENCV_MAX_PIXELS} pixel cap")
+        raise ValueError(f"OpenCV could not decode the image: {e}")
+    if decoded is not None:
+        check_pixel_limit(decoded.shape[1], decoded.shape[0], max_pixels)
+    return decoded
+
+
+def reduction_factor(width: int, height: int, target_size: Optional[int], max_factor: int = 8) -> int:
+    """Largest power-of-two scale-down (up to ``max_factor``) that keeps both sides at least ``target_size``"""
+    factor = 1
+    while target_size and factor < max_factor and min(width, height) // (factor * 2) >= target_size:
+        factor *= 2
+    return factor
+
+
+def list_image_files(paths: Iterable[str], recursive: bool = False) -> List[str]:
+    """Expand files and directories (subdirectories too with ``recursive``) into a sorted list of image files"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path) and recursive:
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, name) for name in sorted(names)
+                             if name.lower().endswith(IMAGE_EXTENSIONS))
+        elif os.path.isdir(path):
+            files.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            ))
+        else:
+            files.append(path)
+    return files
+
+
+def is_encoded_image(source) -> bool:
+    """True when ``source`` holds encoded image bytes rather than a file path"""
+    return isinstance(source, (bytes, bytearray, memoryview))
+
+
+def describe_source(source) -> str:
+    """Short label for log lines; never dumps raw bytes"""
+    if is_encoded_image(source):
+        return f"<{len(source)} bytes in memory>"
+    return str(source)
+
+
+def decode_base64_image(data: str) -> bytes:
+    """
+    Decode a base64 request field, accepting an optional ``data:image/...;base64,`` prefix.
+
+    Raises:
+        ValueError: If the field is empty or not valid base64
+    """
+    if not data:
+        raise ValueError("Empty image payload")
+    if data.startswith('data:'):
+        data = data.split(',', 1)[-1]
+    try:
+        return base64.b64decode(data, validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"Invalid base64 image payload: {e}")
+
+
+def image_digest(data: bytes) -> str:
+    """Hex SHA-256 of encoded image bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def open_pil_image(data: bytes, target_size: Optional[int] = None, max_pixels: Optional[int] = None) -> Image.Image:
+    """
+    Open encoded bytes with PIL, fully loaded so the buffer can be released.
+
+    The pixel limit is checked from the header first. With ``target_size``
+    a JPEG is decoded in draft mode at 1/2, 1/4 or 1/8 scale (both sides
+    staying at least ``target_size``), so its full-size pixels never exist.
+
+    Raises:
+        ImageTooLargeError: If the image exceeds the pixel limit
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e))
+    check_pixel_limit(*image.size, max_pixels)
+    if target_size and image.format == 'JPEG':
+        image.draft(image.mode, (target_size, target_size))
+    image.load()
+    return image
+
+
+def decode_image(data: bytes, target_size: Optional[int] = None, max_pixels: Optional[int] = None) -> np.ndarray:
+    """
+    Decode encoded image bytes to an (H, W) or (H, W, C) array in memory.
+
+    PIL is tried first because it is the decoder MONAI's LoadImage uses for
+    the same formats, so in-memory and file-based inputs give identical
+    pixels; cv2.imdecode covers formats PIL cannot read, within OpenCV's
+    own allocation cap (see opencv_decode). DICOM bytes decode
+    to the first frame, windowed to uint8.
+
+    With ``target_size`` the result is area-reduced so its shorter side is
+    ``target_size``: JPEGs mostly in the decoder itself, other formats
+    right after decoding, before any other copy is made.
+
+    Raises:
+        ImageTooLargeError: If the header declares more than ``max_pixels`` pixels,
+            or only OpenCV reads the format and its cap is above the limit
+        ValueError: If neither decoder understands the bytes
+    """
+    if is_dicom(data):
+        header = read_dicom_header(data)
+        check_pixel_limit(header.columns, header.rows, max_pixels)
+        return decode_dicom(data, target_size=target_size, header=header)
+    try:
+        image = open_pil_image(data, target_size, max_pixels)
+    except ImageTooLargeError:
+        raise
+    except Exception as pil_error:
+        decoded = opencv_decode(lambda: cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED),
+                                max_pixels)
+        if decoded is None:
+            raise ValueError(f"Could not decode image bytes: {pil_error}")
+        if decoded.ndim == 3 and decoded.shape[2] == 3:
+            decoded = cv2.cvtColor(decoded, cv2.COLOR_BGR2RGB)
+        elif decoded.ndim == 3 and decoded.shape[2] == 4:
+            decoded = cv2.cvtColor(decoded, cv2.COLOR_BGRA2RGBA)
+        return area_downsample(decoded, target_size)
+    if image.mode == 'P':
+        # Palette indices cannot be averaged, so expand them to the colors they stand for
+        image = image.convert('L' if is_grayscale_palette(image) else 'RGB')
+    return area_downsample(np.asarray(image), target_size)
+
+
+def is_grayscale_palette(image: Image.Image) -> bool:
+    """True when every entry of a 'P'-mode image's palette is a shade of gray"""
+    palette = image.getpalette() or []
+    return all(palette[i] == palette[i + 1] == palette[i + 2] for i in range(0, len(palette) - 2, 3))
+
+
+def read_grayscale(path: str, target_size: Optional[int] = None,
+                   max_pixels: Optional[int] = None) -> Optional[np.ndarray]:
+    """
+    uint8 grayscale pixels of an image file, or None if it cannot be read.
+
+    With ``target_size`` the file is decoded at 1/2, 1/4 or 1/8 scale
+    (cv2.IMREAD_REDUCED_GRAYSCALE_*) as long as both sides stay at least
+    ``target_size``; for JPEGs libjpeg then skips the full-size decode.
+    Formats only OpenCV reads are decoded at full size, within OpenCV's
+    own allocation cap (see opencv_decode), and then area-reduced.
+
+    Raises:
+        ImageTooLargeError: If the header declares more than ``max_pixels`` pixels,
+            or only OpenCV reads the format and its cap is above the limit
+    """
+    if is_dicom_path(path):
+        try:
+            return to_grayscale_u8(DecodedImage(path, decode_size=target_size or 0, max_pixels=max_pixels).array)
+        except ImageTooLargeError:
+            raise
+        except (OSError, ValueError):
+            return None
+    try:
+        with Image.open(path) as image:
+            check_pixel_limit(*image.size, max_pixels)
+            factor = reduction_factor(*image.size, target_size)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e))
+    except ImageTooLargeError:
+        raise
+    except Exception:
+        # Not a PIL format (or not a file); OpenCV reads it at full size
+        if not cv2.haveImageReader(path):
+            return None
+        gray = opencv_decode(lambda: cv2.imread(path, cv2.IMREAD_GRAYSCALE), max_pixels)
+        return None if gray is None else area_downsample(gray, target_size)
+    return cv2.imread(path, _REDUCED_GRAYSCALE[factor])
+
+
+def to_monai_layout(array: np.ndarray) -> np.ndarray:
+    """
+    Channel-first float32 array in the (C, W, H) layout LoadImage + EnsureChannelFirst produce.
+
+    MONAI's PIL reader swaps the two spatial axes, so the in-memory path does
+    the same to keep scores identical to the file-based path.
+    """
+    array = np.asarray(array, dtype=np.float32)
+    if array.ndim == 2:
+        return array.T[np.newaxis]
+    return np.ascontiguousarray(np.transpose(array, (2, 1, 0)))
+
+
+def to_grayscale_u8(array: np.ndarray) -> np.ndarray:
+    """uint8 grayscale (H, W) version of a decoded image, for overlays"""
+    if array.ndim == 3:
+        channels = array.shape[2]
+        array = cv2.cvtColor(array[..., :3], cv2.COLOR_RGB2GRAY) if channels >= 3 else array[..., 0]
+    if array.dtype != np.uint8:
+        array = cv2.normalize(array.astype(np.float32), None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    return array
+
+
+class DecodedImage:
+    """
+    One study's image, read and decoded once and shared by every pipeline stage.
+
+    The encoded bytes, their SHA-256 and the decoded array are produced on
+    first access. The pipeline stores the preprocessed 224x224 tensor in
+    ``tensor`` and caches every other representation it needs (grayscale
+    DenseNet input, NumPy view, per-model CLIP input) with ``derive``, so no
+    stage converts the same image twice.
+
+    ``array`` is decoded reduced so its shorter side is ``decode_size``
+    (default XRAY_AI_DECODE_SIZE; 0 keeps full resolution), after checking
+    the header against ``max_pixels`` (default XRAY_AI_MAX_PIXELS). DICOM
+    sources decode only frame ``frame``.
+    """
+
+    def __init__(self, source: ImageSource, frame: int = 0, decode_size: Optional[int] = None,
+                 max_pixels: Optional[int] = None):
+        self.source = source
+        self.frame = int(frame)
+        self.decode_size = DEFAULT_DECODE_SIZE if decode_size is None else int(decode_size)
+        self.max_pixels = DEFAULT_MAX_PIXELS if max_pixels is None else int(max_pixels)
+        self.tensor = None
+        self._encoded: Optional[bytes] = None
+        self._digest: Optional[str] = None
+        self._array: Optional[np.ndarray] = None
+        self._dicom_header: Optional[DicomHeader] = None
+        self._is_dicom: Optional[bool] = None
+        self._derived: Dict[Hashable, Any] = {}
+
+    @classmethod
+    def wrap(cls, source) -> 'DecodedImage':
+        """Return ``source`` itself if it is already a DecodedImage"""
+        return source if isinstance(source, cls) else cls(source)
+
+    @property
+    def label(self) -> str:
+        return describe_source(self.source)
+
+    @property
+    def path(self) -> Optional[str]:
+        """File path of the source, or None for in-memory bytes"""
+        return None if is_encoded_image(self.source) else str(self.source)
+
+    @property
+    def encoded(self) -> bytes:
+        """Encoded image bytes; a file source is read exactly once"""
+        if self._encoded is None:
+            if is_encoded_image(self.source):
+                self._encoded = bytes(self.source)
+            else:
+                with open(self.source, 'rb') as f:
+                    self._encoded = f.read()
+        return self._encoded
+
+    @property
+    def digest(self) -> str:
+        if self._digest is None:
+            self._digest = image_digest(self.encoded)
+        return self._digest
+
+    @property
+    def is_dicom(self) -> bool:
+        if self._is_dicom is None:
+            self._is_dicom = is_dicom(self.encoded)
+        return self._is_dicom
+
+    @property
+    def dicom_header(self) -> DicomHeader:
+        """
+        Header of a DICOM source, parsed without its pixel data.
+
+        Raises:
+            ValueError: If the source is not a readable DICOM file
+        """
+        if self._dicom_header is None:
+            self._dicom_header = read_dicom_header(self.encoded)
+        return self._dicom_header
+
+    @property
+    def cache_identity(self) -> str:
+        """Digest of the bytes plus whatever else selects the decoded pixels (frame and decode size)"""
+        if not self.frame and not self.decode_size:
+            return self.digest
+        return f"{self.digest}/frame{self.frame}/{self.decode_size}px"
+
+    @property
+    def array(self) -> np.ndarray:
+        """
+        Decoded (H, W) or (H, W, C) pixels.
+
+        Raises:
+            ImageTooLargeError: If the image exceeds ``max_pixels``
+            ValueError: If the image cannot be decoded
+        """
+        if self._array is None:
+            if self.is_dicom:
+                header = self.dicom_header
+                check_pixel_limit(header.columns, header.rows, self.max_pixels)
+                self._array = decode_dicom(self.encoded, self.frame, self.decode_size, header)
+            else:
+                self._array = decode_image(self.encoded, self.decode_size, self.max_pixels)
+        return self._array
+
+    def release_encoded(self):
+        """Drop the encoded bytes of a file source once decoded; they are re-read if ever needed again"""
+        if self.path is not None:
+            self._encoded = None
+
+    def derive(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """Return the representation cached under ``key``, building it with ``factory`` on first use"""
+        if key not in self._derived:
+            self._derived[key] = factory()
+        return self._derived[key]
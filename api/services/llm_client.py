@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+OpenRouter Chat Client
+Pooled, retrying HTTP client for DeepSeek report generation via OpenRouter
+"""
+
+import os
+import json
+import time
+import random
+import threading
+from contextlib import nullcontext
+from typing import Dict, List, Any, Iterator, Optional
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = 'https://openrouter.ai/api/v1'
+
+# Rate limiting and transient upstream failures are worth another attempt
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class LLMRequestError(RuntimeError):
+    """Raised when a chat completion cannot be obtained after all retries"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, timed_out: bool = False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.timed_out = timed_out
+
+
+class OpenRouterClient:
+    """
+    Thread-safe chat-completions client shared by every report request.
+
+    A single ``requests.Session`` keeps TLS connections alive between calls,
+    a bounded semaphore caps concurrent upstream requests, and 429/5xx
+    responses, timeouts and connection errors are retried with jittered
+    exponential backoff (honouring ``Retry-After`` when present). The base
+    URL is configurable so a local stub server can stand in for OpenRouter.
+    """
+
+    def __init__(self, base_url: Optional[str] = None, timeout: float = 30.0,
+                 max_retries: int = 2, backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 max_concurrency: int = 4, pool_size: int = 8):
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._semaphore = threading.BoundedSemaphore(max(1, max_concurrency))
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size), max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def from_env(cls) -> 'OpenRouterClient':
+        return cls(
+            base_url=os.environ.get('OPENROUTER_BASE_URL'),
+            timeout=float(os.environ.get('XRAY_AI_LLM_TIMEOUT', 30)),
+            max_retries=int(os.environ.get('XRAY_AI_LLM_MAX_RETRIES', 2)),
+            max_concurrency=int(os.environ.get('XRAY_AI_LLM_MAX_CONCURRENCY', 4)),
+            pool_size=int(os.environ.get('XRAY_AI_LLM_POOL_SIZE', 8))
+        )
+
+    def _retry_delay(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        """Full-jitter exponential backoff, or the server's Retry-After when it sends one"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    return min(self.backoff_max, max(0.0, float(retry_after)))
+                except ValueError:
+                    pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def post(self, path: str, payload: Dict[str, Any], api_key: str,
+             stream: bool = False, bounded: bool = True) -> requests.Response:
+        """
+        POST JSON to ``base_url + path`` with pooling, bounded concurrency and retries.
+
+        Each attempt takes a concurrency slot while the request is sent.
+        ``bounded=False`` skips that for callers that already hold a slot
+        for longer, as ``stream_chat_completion`` does while it reads the body.
+
+        Returns:
+            The successful (2xx) response
+
+        Raises:
+            LLMRequestError: On a non-retryable status or once retries are exhausted
+        """
+        url = f"{self.base_url}{path}"
+        headers = {
+            'Authorization': f'Bearer {api_key}',
+            'Content-Type': 'application/json'
+        }
+
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            response = None
+            try:
+                with self._semaphore if bounded else nullcontext():
+                    response = self.session.post(url, headers=headers, json=payload,
+                                                 timeout=self.timeout, stream=stream)
+            except requests.exceptions.Timeout:
+                if last_attempt:
+                    raise LLMRequestError(f"Request timed out after {self.timeout}s", timed_out=True)
+                logger.warning("LLM request timed out (attempt %s), retrying", attempt + 1)
+            except requests.exceptions.RequestException as e:
+                if last_attempt:
+                    raise LLMRequestError(f"Connection error: {e}")
+                logger.warning("LLM connection error (attempt %s): %s, retrying", attempt + 1, e)
+            else:
+                if 200 <= response.status_code < 300:
+                    return response
+                body = response.text[:200]
+                if response.status_code not in RETRYABLE_STATUS_CODES or last_attempt:
+                    raise LLMRequestError(f"HTTP {response.status_code}: {body}",
+                                          status_code=response.status_code)
+                logger.warning("LLM request returned %s (attempt %s), retrying", response.status_code, attempt + 1)
+                response.close()
+
+            time.sleep(self._retry_delay(attempt, response))
+
+        raise LLMRequestError("Retries exhausted")
+
+    def chat_completion(self, messages: List[Dict[str, str]], api_key: str,
+                        model: str = 'deepseek/deepseek-chat', max_tokens: int = 1000,
+                        temperature: float = 0.3) -> str:
+        """Run one chat completion and return the assistant message content"""
+        response = self.post('/chat/completions', {
+            'model': model,
+            'messages': messages,
+            'max_tokens': max_tokens,
+            'temperature': temperature
+        }, api_key)
+        try:
+            return response.json()['choices'][0]['message']['content']
+        except (ValueError, KeyError, IndexError) as e:
+            raise LLMRequestError(f"Malformed chat completion response: {e}", status_code=response.status_code)
+
+    def stream_chat_completion(self, messages: List[Dict[str, str]], api_key: str,
+                               model: str = 'deepseek/deepseek-chat', max_tokens: int = 1000,
+                               temperature: float = 0.3) -> Iterator[str]:
+        """
+        Run one chat completion with server-sent events, yielding content deltas as they arrive.
+
+        The concurrency slot is held until the stream has been read to the
+        end or the generator is closed. Retries only cover establishing the
+        stream; once the first byte has been received, a dropped connection,
+        an upstream error event or a stream that ends without ``[DONE]``
+        raises LLMRequestError so the caller can fall back.
+        """
+        with self._semaphore:
+            yield from self._stream_chat_completion({
+                'model': model,
+                'messages': messages,
+                'max_tokens': max_tokens,
+                'temperature': temperature,
+                'stream': True
+            }, api_key)
+
+    def _stream_chat_completion(self, payload: Dict[str, Any], api_key: str) -> Iterator[str]:
+        response = self.post('/chat/completions', payload, api_key, stream=True, bounded=False)
+        finished = False
+        try:
+            for raw_line in response.iter_lines(chunk_size=None):
+                line = raw_line.decode('utf-8')
+                # Blank separators and ": keep-alive" comments carry no data
+                if not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    finished = True
+                    break
+                try:
+                    chunk = json.loads(data)
+                except ValueError as e:
+                    raise LLMRequestError(f"Malformed stream event: {e}", status_code=response.status_code)
+                if 'error' in chunk:
+                    raise LLMRequestError(f"Upstream error mid-stream: {chunk['error']}",
+                                          status_code=response.status_code)
+                choices = chunk.get('choices') or [{}]
+                delta = (choices[0].get('delta') or {}).get('content')
+                if delta:
+                    yield delta
+        except requests.exceptions.Timeout:
+            raise LLMRequestError(f"Stream stalled for more than {self.timeout}s", timed_out=True)
+        except requests.exceptions.RequestException as e:
+            raise LLMRequestError(f"Stream interrupted: {e}")
+        finally:
+            response.close()
+        if not finished:
+            # The report may be cut off mid-sentence; never treat it as complete
+            raise LLMRequestError("Stream ended before [DONE]; the report is truncated",
+                                  status_code=response.status_code)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Pipeline Metrics
+Stage latency histograms and fallback counters, exported in the Prometheus text format
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+import logging
+
+from services.structured_logging import log_context
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers sub-millisecond post-processing up to slow CPU batches
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._samples: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = {key: self._copy(value) for key, value in self._samples.items()}
+        return {'kind': self.kind, 'help': self.help, 'labels': self.label_names, 'samples': samples}
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+
+class Counter(_Metric):
+    """Monotonic count per label set"""
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._samples[key] = self._samples.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram per label set, as Prometheus expects"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            sample = self._samples.get(key)
+            if sample is None:
+                sample = self._samples[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample['buckets'][i] += 1
+            sample['sum'] += value
+            sample['count'] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        snapshot = super().snapshot()
+        snapshot['buckets'] = self.buckets
+        return snapshot
+
+    @staticmethod
+    def _copy(value):
+        return {'buckets': list(value['buckets']), 'sum': value['sum'], 'count': value['count']}
+
+
+class MetricsRegistry:
+    """
+    Named counters and histograms of one process.
+
+    ``snapshot`` returns plain, picklable data, so registries of other
+    processes (pool workers) can be merged into this one's export with
+    ``merge_snapshots``.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        self.created_at = time.time()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.label_names != metric.label_names:
+                    raise ValueError(f"Metric {metric.name} is already registered with another type or labels")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, label_names))
+
+    def histogram(self, name: str, help_text: str, label_names: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, label_names, buckets))
+
+    def reset(self):
+        """Zero every metric; a forked worker calls this so it does not re-report its parent's counts"""
+        for metric in list(self._metrics.values()):
+            metric.reset()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {name: metric.snapshot() for name, metric in list(self._metrics.items())}
+
+    def render_prometheus(self, extra_snapshots: Iterable[Dict[str, Dict[str, Any]]] = ()) -> str:
+        """Prometheus text exposition of this registry plus any snapshots from other processes"""
+        return render_prometheus(merge_snapshots([self.snapshot(), *extra_snapshots]))
+
+
+def merge_snapshots(snapshots: List[Dict[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """Sum registry snapshots metric by metric and label set by label set"""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, 'samples': {}})
+            for key, value in metric['samples'].items():
+                current = target['samples'].get(key)
+                if metric['kind'] == 'counter':
+                    target['samples'][key] = (current or 0) + value
+                elif current is None:
+                    target['samples'][key] = Histogram._copy(value)
+                else:
+                    current['buckets'] = [a + b for a, b in zip(current['buckets'], value['buckets'])]
+                    current['sum'] += value['sum']
+                    current['count'] += value['count']
+    return merged
+
+
+def render_prometheus(snapshot: Dict[str, Dict[str, Any]]) -> str:
+    lines = []
+    for name, metric in sorted(snapshot.items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        labels = metric['labels']
+        for key, value in sorted(metric['samples'].items()):
+            if metric['kind'] == 'counter':
+                lines.append(f"{name}{_format_labels(labels, key)} {_format_number(value)}")
+                continue
+            for bound, count in zip(metric['buckets'], value['buckets']):
+                lines.append(f"{name}_bucket{_format_labels(labels, key, ('le', _format_number(bound)))} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, key, ('le', '+Inf'))} {value['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels, key)} {_format_number(value['sum'])}")
+            lines.append(f"{name}_count{_format_labels(labels, key)} {value['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+# Process-wide registry and the pipeline's metrics
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'xray_ai_stage_seconds',
+    'Wall time of one pipeline stage run; batched stages are observed once per batch',
+    ('stage', 'model')
+)
+ANALYSIS_SECONDS = REGISTRY.histogram(
+    'xray_ai_analysis_seconds', 'Time from the start of a study\'s batch to its finished result', ('outcome',)
+)
+ANALYSES = REGISTRY.counter('xray_ai_analyses_total', 'Studies analyzed, by outcome', ('outcome',))
+BATCH_SIZE = REGISTRY.histogram('xray_ai_batch_size', 'Studies per batched model forward', (),
+                                buckets=BATCH_SIZE_BUCKETS)
+FALLBACKS = REGISTRY.counter(
+    'xray_ai_fallbacks_total', 'Times a degraded code path replaced the normal one, by kind', ('kind',)
+)
+
+
+def observe_stage(stage: str, seconds: float, model: str = ''):
+    STAGE_SECONDS.observe(seconds, stage=stage, model=model or '')
+
+
+def record_analysis(outcome: str, seconds: float):
+    """Count one finished study ('success', 'cache_hit' or 'error') and its end-to-end time"""
+    ANALYSES.inc(outcome=outcome)
+    ANALYSIS_SECONDS.observe(seconds, outcome=outcome)
+
+
+def record_fallback(kind: str, count: int = 1):
+    """Count uses of a fallback path, e.g. 'cv_analysis' or 'report'"""
+    FALLBACKS.inc(count, kind=kind)
+
+
+@contextmanager
+def timed_stage(stage: str, model: str = ''):
+    """
+    Time a block with the monotonic clock and observe it in xray_ai_stage_seconds.
+
+    Yields a dict whose ``seconds`` is filled in when the block exits, so
+    callers can also copy the duration into a result's ``timings``. Records
+    logged inside the block are tagged with ``stage``.
+    """
+    span = {'seconds': None}
+    started = time.perf_counter()
+    try:
+        with log_context(stage=stage):
+            yield span
+    finally:
+        span['seconds'] = time.perf_counter() - started
+        observe_stage(stage, span['seconds'], model)
+
+
+class StudyTimings:
+    """
+    Stage durations of one study, reported in its result as ``timings``.
+
+    Batched stages (model forwards, Grad-CAM) are timed once per batch and
+    the same duration is added to every study in it; ``batch_size`` in the
+    output says how many studies shared them.
+    """
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = time.perf_counter() if started is None else started
+        self.stages: Dict[str, float] = {}
+        self.batch_size: Optional[int] = None
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, stage: str, model: str = ''):
+        """Time a per-study stage into both these timings and the stage histogram"""
+        with timed_stage(stage, model) as span:
+            yield span
+        self.add(stage, span['seconds'])
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def as_dict(self) -> Dict[str, Any]:
+        timings = {f'{stage}_ms': round(1000 * seconds, 3) for stage, seconds in self.stages.items()}
+        timings['total_ms'] = round(1000 * self.elapsed(), 3)
+        if self.batch_size is not None:
+            timings['batch_size'] = self.batch_size
+        return timings
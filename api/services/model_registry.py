@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+OpenCLIP Model Registry
+Loads each CLIP variant once and keeps model, preprocess and tokenizer together
+"""
+
+import os
+import time
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Optional, Callable
+import logging
+
+from services.quantization import quantize_dynamic_int8, serialized_size_bytes
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ClipModelSpec:
+    """A CLIP variant the registry knows how to load"""
+    model_id: str
+    display_name: str
+    pretrained: Optional[str] = None
+    tokenizer_id: Optional[str] = None
+
+    @property
+    def weights_key(self) -> str:
+        """Identifies the exact weights, for caches derived from model outputs"""
+        return f"{self.model_id}|{self.pretrained or ''}"
+
+
+@dataclass
+class ClipModelEntry:
+    """A loaded CLIP variant with everything needed to run zero-shot inference"""
+    spec: ClipModelSpec
+    model: Any
+    preprocess: Callable
+    tokenizer: Callable
+    load_seconds: float
+    parameter_bytes: int
+    rss_delta_bytes: Optional[int] = None
+    precision: str = 'fp32'
+    loaded_at: float = field(default_factory=time.time)
+
+    @property
+    def model_key(self) -> str:
+        """Weights key plus precision, for caches of this entry's outputs"""
+        return self.spec.weights_key if self.precision == 'fp32' else f"{self.spec.weights_key}|{self.precision}"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'model_id': self.spec.model_id,
+            'display_name': self.spec.display_name,
+            'load_seconds': round(self.load_seconds, 3),
+            'parameter_bytes': self.parameter_bytes,
+            'rss_delta_bytes': self.rss_delta_bytes,
+            'precision': self.precision,
+            'loaded_at': self.loaded_at
+        }
+
+
+# Preference order: BiomedCLIP (trained on 15M PubMed image-text pairs) first,
+# then the general-purpose ViT-B-32 as a fallback
+DEFAULT_CLIP_SPECS = [
+    ClipModelSpec(
+        model_id='hf-hub:microsoft/BiomedCLIP-PubMedBERT_256-vit_base_patch16_224',
+        display_name='BiomedCLIP (Medical Specialist)'
+    ),
+    ClipModelSpec(
+        model_id='ViT-B-32',
+        display_name='Medical CLIP (OpenCLIP ViT-B-32)',
+        pretrained='laion2b_s34b_b79k'
+    ),
+]
+
+
+def _current_rss_bytes() -> Optional[int]:
+    """Resident set size of this process, where the platform exposes it cheaply"""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _parameter_bytes(model) -> int:
+    """Bytes held by a torch module's parameters and buffers"""
+    total = 0
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class ClipModelRegistry:
+    """
+    Process-wide cache of OpenCLIP variants.
+
+    Each variant is built at most once; a variant that fails to load is
+    remembered so the request path does not retry a slow download on every
+    analysis. ``resolve()`` returns the first variant in preference order that
+    loaded and records it as the winner. With ``quantize`` every variant is
+    converted to dynamic int8 right after loading (CPU only).
+    """
+
+    def __init__(self, open_clip_module, device, specs: Optional[List[ClipModelSpec]] = None,
+                 quantize: bool = False):
+        self.open_clip = open_clip_module
+        self.device = device
+        self.specs = list(specs or DEFAULT_CLIP_SPECS)
+        self.quantize = quantize and getattr(device, 'type', str(device)) == 'cpu'
+        if quantize and not self.quantize:
+            logger.warning("Int8 CLIP quantization is CPU-only; keeping fp32 on %s", device)
+        self._entries: Dict[str, ClipModelEntry] = {}
+        self._failures: Dict[str, str] = {}
+        self._winner: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _load(self, spec: ClipModelSpec) -> ClipModelEntry:
+        rss_before = _current_rss_bytes()
+        started = time.perf_counter()
+
+        if spec.pretrained:
+            model, _, preprocess = self.open_clip.create_model_and_transforms(
+                spec.model_id, pretrained=spec.pretrained
+            )
+        else:
+            model, _, preprocess = self.open_clip.create_model_and_transforms(spec.model_id)
+        tokenizer = self.open_clip.get_tokenizer(spec.tokenizer_id or spec.model_id)
+        model.eval()
+        model = model.to(self.device)
+
+        load_seconds = time.perf_counter() - started
+        rss_after = _current_rss_bytes()
+        rss_delta = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+
+        entry = ClipModelEntry(
+            spec=spec,
+            model=model,
+            preprocess=preprocess,
+            tokenizer=tokenizer,
+            load_seconds=load_seconds,
+            parameter_bytes=_parameter_bytes(model),
+            rss_delta_bytes=rss_delta
+        )
+        if self.quantize:
+            self._quantize_entry(entry)
+        return entry
+
+    def _quantize_entry(self, entry: ClipModelEntry):
+        """Convert an entry's model to dynamic int8 in place"""
+        started = time.perf_counter()
+        entry.model = quantize_dynamic_int8(entry.model)
+        entry.precision = 'int8'
+        # Packed int8 weights are not parameters, so measure the serialized state instead
+        entry.parameter_bytes = serialized_size_bytes(entry.model)
+        logger.info("CLIP variant %s quantized to int8 in %.2fs", entry.spec.model_id, time.perf_counter() - started)
+
+    def quantize_loaded(self):
+        """Switch to int8: convert every loaded fp32 variant and quantize later loads too"""
+        if getattr(self.device, 'type', str(self.device)) != 'cpu':
+            raise RuntimeError(f"Int8 CLIP quantization is CPU-only, not {self.device}")
+        with self._lock:
+            self.quantize = True
+            for entry in self._entries.values():
+                if entry.precision == 'fp32':
+                    self._quantize_entry(entry)
+
+    def get(self, model_id: str) -> Optional[ClipModelEntry]:
+        """Return the loaded entry for a variant, loading it on first use"""
+        with self._lock:
+            if model_id in self._entries:
+                return self._entries[model_id]
+            if model_id in self._failures:
+                return None
+
+            spec = next((s for s in self.specs if s.model_id == model_id), None)
+            if spec is None:
+                raise KeyError(f"Unknown CLIP variant: {model_id}")
+
+            try:
+                entry = self._load(spec)
+            except Exception as e:
+                self._failures[model_id] = str(e)
+                logger.warning("CLIP variant %s failed to load: %s", model_id, str(e)[:200])
+                return None
+
+            self._entries[model_id] = entry
+            logger.info("CLIP variant %s loaded in %.2fs", model_id, entry.load_seconds)
+            return entry
+
+    def resolve(self) -> Optional[ClipModelEntry]:
+        """Return the preferred variant that loads, remembering which one won"""
+        if self._winner is not None:
+            return self._entries[self._winner]
+
+        for spec in self.specs:
+            entry = self.get(spec.model_id)
+            if entry is not None:
+                self._winner = spec.model_id
+                return entry
+        return None
+
+    def loaded_entries(self) -> List[ClipModelEntry]:
+        """Every variant that is loaded, winner or not"""
+        return list(self._entries.values())
+
+    @property
+    def winner(self) -> Optional[str]:
+        return self._winner
+
+    @property
+    def version(self) -> Optional[str]:
+        """Weights key and precision of the variant in use; changes whenever a different variant wins"""
+        if self._winner is None:
+            return None
+        return self._entries[self._winner].model_key
+
+    def stats(self) -> Dict[str, Any]:
+        """Load time and memory per variant, plus which variant is in use"""
+        return {
+            'winner': self._winner,
+            'loaded': {model_id: entry.stats() for model_id, entry in self._entries.items()},
+            'failed': dict(self._failures)
+        }
@@ -31,7 +31,7 @@ try:
     logger.info("MONAI framework loaded successfully")
 except (ImportError, OSError) as e:
     MONAI_AVAILABLE = False
-    logger.warning(f"MONAI not available: {e}. Using fallback analysis.")
+    logger.warning("MONAI not available: %s. Using fallback analysis.", e)
 
 class MONAIService:
     """MONAI-based X-ray analysis service for multiple body parts"""
@@ -98,7 +98,7 @@ class MONAIService:
             logger.info("Pre-trained model loaded successfully")
             return model
         except Exception as e:
-            logger.warning(f"Could not load pre-trained model: {e}")
+            logger.warning("Could not load pre-trained model: %s", e)
             return None
 
     def analyze_xray(self, image_path: str, xray_type: str = 'general', 
@@ -118,7 +118,7 @@ class MONAIService:
             patient_info = {}
             
         try:
-            logger.info(f"Starting MONAI analysis for {xray_type} X-ray")
+            logger.info("Starting MONAI analysis for %s X-ray", xray_type)
             
             if MONAI_AVAILABLE and self.transforms:
                 result = self._analyze_with_monai(image_path, xray_type, patient_info)
@@ -136,7 +136,7 @@ class MONAIService:
             return result
             
         except Exception as e:
-            logger.error(f"Analysis error: {e}")
+            logger.error("Analysis error: %s", e)
             return self._get_error_analysis(xray_type, str(e))
 
     def _analyze_with_monai(self, image_path: str, xray_type: str, 
@@ -160,7 +160,7 @@ class MONAIService:
             return analysis_result
             
         except Exception as e:
-            logger.error(f"MONAI analysis error: {e}")
+            logger.error("MONAI analysis error: %s", e)
             return self._analyze_fallback(image_path, xray_type, patient_info)
 
     def _analyze_fallback(self, image_path: str, xray_type: str, 
@@ -169,6 +169,10 @@ class MONAIService:
         try:
             # Load image
             image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+            if image is None:
+                # Formats OpenCV cannot read, such as DICOM
+                loaded = self._load_image(image_path)
+                image = np.array(loaded) if loaded is not None else None
             if image is None:
                 raise ValueError("Could not load image")
             
@@ -197,15 +201,19 @@ class MONAIService:
             return analysis
             
         except Exception as e:
-            logger.error(f"Fallback analysis error: {e}")
+            logger.error("Fallback analysis error: %s", e)
             return self._get_default_analysis(xray_type, patient_info)
 
     def _load_image(self, image_path: str):
-        """Load image using PIL"""
+        """Load image using PIL (DICOM through pydicom, windowed and reduced while decoding)"""
         try:
+            from services.dicom_io import decode_dicom, is_dicom_path
+            from services.image_io import DEFAULT_DECODE_SIZE
+            if is_dicom_path(image_path):
+                return Image.fromarray(decode_dicom(image_path, target_size=DEFAULT_DECODE_SIZE)).convert('L')
             return Image.open(image_path).convert('L')  # Convert to grayscale
         except Exception as e:
-            logger.error(f"Error loading image: {e}")
+            logger.error("Error loading image: %s", e)
             return None
 
     def _run_model_inference(self, processed_image, xray_type: str) -> Dict[str, Any]:
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+ONNX Runtime Inference Backend
+Exports the DenseNet121 backbone and the CLIP image tower to ONNX and runs them on ORT's CPU provider
+"""
+
+import os
+import time
+import hashlib
+import tempfile
+import importlib.util
+import threading
+import warnings
+from typing import Dict, Any, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# onnxruntime is optional and only imported once a session is created
+ORT_AVAILABLE = importlib.util.find_spec('onnxruntime') is not None
+
+# Inference backends selectable with XRAY_AI_INFERENCE_BACKEND
+INFERENCE_BACKENDS = ('torch', 'onnx')
+
+ONNX_OPSET = 18
+
+# Graphs of other weights are pruned once nothing has opened them for this long. Every
+# process exporting its own weights shares the cache dir, so a sibling's graph is never
+# deleted just for being different (a forked worker may be about to reopen it)
+STALE_GRAPH_SECONDS = float(os.environ.get('XRAY_AI_ONNX_MAX_AGE_DAYS', '7')) * 86400
+
+
+def module_fingerprint(module) -> str:
+    """Hash of every tensor in a module's state dict, so a graph is never reused for other weights"""
+    digest = hashlib.sha256()
+    for name, tensor in module.state_dict().items():
+        digest.update(name.encode('utf-8'))
+        digest.update(str(tuple(tensor.shape)).encode('utf-8'))
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def clip_image_tower(clip_model):
+    """Module whose forward is ``clip_model.encode_image``, for export"""
+    import torch
+
+    class ImageTower(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, image):
+            return self.model.encode_image(image)
+
+    return ImageTower(clip_model)
+
+
+def export_onnx(module, example_input, path: str):
+    """
+    Export ``module`` (one image batch in, one tensor out) to ``path`` with a dynamic batch axis.
+
+    The graph is written to a temporary file and moved into place, so a
+    crashed export never leaves a truncated model behind.
+    """
+    import torch
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        # Traced with autograd enabled: under no_grad nn.MultiheadAttention switches to a
+        # fused fast path the exporter cannot translate
+        with warnings.catch_warnings():
+            # The TorchScript exporter is deprecated but handles dynamic_axes without onnxscript
+            warnings.simplefilter('ignore')
+            torch.onnx.export(
+                module.eval(), (example_input,), tmp_path,
+                input_names=['image'], output_names=['output'],
+                dynamic_axes={'image': {0: 'batch'}, 'output': {0: 'batch'}},
+                opset_version=ONNX_OPSET, dynamo=False
+            )
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _remove_stale_graphs(cache_dir: str, name: str, keep: str, max_age: float = STALE_GRAPH_SECONDS):
+    """Delete graphs of the same model that no process has opened in ``max_age`` seconds"""
+    cutoff = time.time() - max_age
+    for filename in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, filename)
+        if not (filename.startswith(f"{name}-") and filename.endswith('.onnx')) or path == keep:
+            continue
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError as e:
+            logger.warning("Could not remove stale ONNX graph %s: %s", path, e)
+
+
+class OnnxModel:
+    """
+    An exported module running on ONNX Runtime's CPU execution provider.
+
+    Called like the torch module it replaces: takes a float tensor batch and
+    returns a float tensor, so callers keep their torch post-processing.
+    """
+
+    def __init__(self, path: str, intra_op_threads: Optional[int] = None, model_bytes: Optional[bytes] = None):
+        """``model_bytes`` holds a graph that is never kept on disk; ``path`` then only labels it"""
+        if not ORT_AVAILABLE:
+            raise RuntimeError("onnxruntime is not installed")
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.path = path
+        self.model_bytes = model_bytes
+        self.session = ort.InferenceSession(path if model_bytes is None else model_bytes, options,
+                                            providers=['CPUExecutionProvider'])
+        if model_bytes is None:
+            try:
+                # Marks the graph as in use for _remove_stale_graphs
+                os.utime(path)
+            except OSError:
+                pass
+        self.input_name = self.session.get_inputs()[0].name
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_module(cls, module, example_input, cache_dir: str, name: str,
+                    intra_op_threads: Optional[int] = None, persist: bool = True) -> 'OnnxModel':
+        """
+        Load the cached graph for these exact weights, exporting it first if needed.
+
+        With ``persist=False`` (weights no later process will have, such as a
+        random initialisation) the graph is exported to a temporary file and
+        kept in memory only, so the cache dir never fills with unusable graphs.
+        """
+        if not persist:
+            with tempfile.TemporaryDirectory(prefix='xray-ai-onnx-') as tmp_dir:
+                tmp_path = os.path.join(tmp_dir, f"{name}.onnx")
+                logger.info("Exporting %s in memory", name)
+                export_onnx(module, example_input, tmp_path)
+                with open(tmp_path, 'rb') as f:
+                    model_bytes = f.read()
+            return cls(f"<in-memory {name}>", intra_op_threads, model_bytes=model_bytes)
+        path = os.path.join(cache_dir, f"{name}-{module_fingerprint(module)}.onnx")
+        if not os.path.exists(path):
+            logger.info("Exporting %s to %s", name, path)
+            export_onnx(module, example_input, path)
+            _remove_stale_graphs(cache_dir, name, keep=path)
+        return cls(path, intra_op_threads)
+
+    def reopen(self, intra_op_threads: Optional[int] = None) -> 'OnnxModel':
+        """A new session on the same graph, e.g. in a forked worker"""
+        return type(self)(self.path, intra_op_threads, self.model_bytes)
+
+    def __call__(self, tensor):
+        import torch
+
+        # InferenceSession.run is thread-safe; only the counter needs the lock
+        with self._lock:
+            self.calls += 1
+        output = self.session.run(None, {self.input_name: tensor.detach().cpu().numpy()})[0]
+        return torch.from_numpy(output)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'path': self.path,
+            'persistent': self.model_bytes is None,
+            'bytes': (len(self.model_bytes) if self.model_bytes is not None
+                      else os.path.getsize(self.path) if os.path.exists(self.path) else None),
+            'calls': self.calls
+        }
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Persistent JSON-lines worker for the Medical AI Pipeline
+Keeps one MedicalAIPipeline resident and answers requests read from stdin
+"""
+
+import sys
+import json
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, Optional, TextIO, Tuple, Union
+import logging
+
+from services.batch_scheduler import MicroBatchScheduler, SchedulerSettings
+from services.image_io import DecodedImage, decode_base64_image, decode_image, to_grayscale_u8
+from services.worker_pool import InferencePool, PoolSettings
+from services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineWorker:
+    """
+    Line-oriented worker protocol around a resident MedicalAIPipeline.
+
+    Every request is one JSON object per line on stdin, for example
+    ``{"id": "42", "op": "analyze", "image_path": "/tmp/x.png",
+    "xray_type": "chest", "patient_info": {...}}``; an optional ``tta_views``
+    enables test-time augmentation for that request, and ``image_b64`` (base64
+    encoded image bytes, optionally as a data URI) can replace ``image_path``
+    so uploads never touch the filesystem. DICOM inputs take an optional
+    ``frame`` index for multi-frame files. Every response is one JSON
+    object per line on stdout carrying the same ``id``; responses are written
+    as soon as each request finishes, so they may arrive out of order.
+
+    With ``"stream": true`` an analyze request also gets ``"type": "event"``
+    lines before its result: the diagnosis, then report deltas as the LLM
+    generates them, then the heatmap.
+
+    ``"heatmap"`` selects the visualization per request: ``full`` (rendered
+    PNG), ``compact`` (low-resolution grid only) or ``none``. A compact grid
+    is turned into an image later with ``{"op": "render_heatmap", "grid":
+    {...}, "size": 512, "format": "webp", "image_path": ...}``.
+
+    ``{"op": "stats"}`` reports the caches of the process doing the
+    analysis, summed over the pool workers when there are any.
+
+    ``{"op": "metrics"}`` returns stage latency histograms and fallback
+    counters in the Prometheus text format (``text``), summed over the pool
+    workers when there are any.
+
+    Analyze requests go through a MicroBatchScheduler, so studies that arrive
+    within the batching window share one batched model forward; each result
+    is written as soon as that study's report is done. With a ``pool`` the
+    batches run in its worker processes instead of this one.
+    """
+
+    def __init__(self, pipeline, settings: Optional[SchedulerSettings] = None,
+                 input_stream: Optional[TextIO] = None,
+                 output_stream: Optional[TextIO] = None,
+                 pool: Optional[InferencePool] = None):
+        self.pipeline = pipeline
+        self.pool = pool
+        self.scheduler = MicroBatchScheduler(pool or pipeline, settings)
+        self.input_stream = input_stream or sys.stdin
+        self.output_stream = output_stream or sys.stdout
+        self._write_lock = threading.Lock()
+        self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='stdin')
+        self.requests_served = 0
+
+    def write_message(self, message: Dict[str, Any]):
+        """Write one protocol message as a single JSON line"""
+        line = json.dumps(message, ensure_ascii=False)
+        with self._write_lock:
+            self.output_stream.write(line + '\n')
+            self.output_stream.flush()
+
+    def _analysis_args(self, request: Dict[str, Any]) -> Tuple[Union[str, bytes, DecodedImage], str,
+                                                               Dict[str, Any], Optional[int]]:
+        """Validate an analyze request and extract its arguments"""
+        if request.get('image_b64'):
+            image_path = decode_base64_image(request['image_b64'])
+        else:
+            image_path = request.get('image_path')
+        if not image_path:
+            raise ValueError("Missing required field 'image_path' or 'image_b64'")
+        if request.get('frame') is not None:
+            image_path = DecodedImage(image_path, frame=int(request['frame']))
+        xray_type = request.get('xray_type') or 'chest'
+        patient_info = request.get('patient_info') or {}
+        return image_path, xray_type, patient_info, request.get('tta_views')
+
+    async def _render(self, request_id: Any, request: Dict[str, Any]):
+        """Render a compact heatmap grid off the event loop"""
+        loop = asyncio.get_running_loop()
+        try:
+            grid = request.get('grid')
+            if not isinstance(grid, dict):
+                raise ValueError("Missing required field 'grid'")
+            image_bytes = decode_base64_image(request['image_b64']) if request.get('image_b64') else None
+
+            def render():
+                base_image = to_grayscale_u8(decode_image(image_bytes)) if image_bytes else None
+                return self.pipeline.render_heatmap(
+                    grid,
+                    size=request.get('size'),
+                    image_format=request.get('format', 'png'),
+                    base_image=base_image,
+                    image_path=request.get('image_path')
+                )
+            heatmap = await loop.run_in_executor(None, render)
+            self.write_message({'id': request_id, 'type': 'heatmap', 'heatmap': heatmap})
+        except Exception as e:
+            self.write_message({'id': request_id, 'type': 'error', 'error': str(e)})
+
+    async def _dispatch(self, request_id: Any, request: Dict[str, Any]):
+        """Queue a request on the scheduler and write its response when it resolves"""
+        on_event = None
+        if request.get('stream'):
+            def on_event(event: Dict[str, Any]):
+                self.write_message({'id': request_id, 'type': 'event', **event})
+        try:
+            heatmap_mode = request.get('heatmap')
+            if heatmap_mode is not None:
+                heatmap_mode = self.pipeline.validate_heatmap_mode(heatmap_mode)
+            result = await self.scheduler.submit(*self._analysis_args(request), on_event=on_event,
+                                                 heatmap_mode=heatmap_mode, request_id=request_id)
+            self.requests_served += 1
+            self.write_message({'id': request_id, 'type': 'result', 'result': result})
+        except Exception as e:
+            logger.error("Worker request %s failed: %s", request_id, e, extra={'request_id': request_id})
+            self.write_message({'id': request_id, 'type': 'error', 'error': str(e)})
+
+    def _parse_line(self, line: str) -> Optional[Dict[str, Any]]:
+        """Decode a request line, answering malformed input with an error message"""
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            self.write_message({'id': None, 'type': 'error', 'error': f'Invalid JSON: {e}'})
+            return None
+        if not isinstance(request, dict):
+            self.write_message({'id': None, 'type': 'error', 'error': 'Request must be a JSON object'})
+            return None
+        return request
+
+    async def serve(self) -> int:
+        """Read requests until EOF or a shutdown op, then drain in-flight work"""
+        loop = asyncio.get_running_loop()
+        pending = set()
+        await self.scheduler.start()
+
+        self.write_message({
+            'id': None,
+            'type': 'ready',
+            'scheduler': self.scheduler.metrics()['settings'],
+            'timestamp': datetime.now().isoformat()
+        })
+
+        while True:
+            line = await loop.run_in_executor(self._reader, self.input_stream.readline)
+            if not line:
+                break
+            line = line.strip()
+            if not line:
+                continue
+
+            request = self._parse_line(line)
+            if request is None:
+                continue
+
+            request_id = request.get('id')
+            op = request.get('op', 'analyze')
+
+            if op == 'ping':
+                pong = {
+                    'id': request_id,
+                    'type': 'pong',
+                    'in_flight': len(pending),
+                    'queue_depth': self.scheduler.queue_depth,
+                    'requests_served': self.requests_served
+                }
+                if self.pool is not None:
+                    pong['pool'] = self.pool.health()
+                self.write_message(pong)
+            elif op == 'stats':
+                stats = {
+                    'id': request_id,
+                    'type': 'stats',
+                    'requests_served': self.requests_served,
+                    'scheduler': self.scheduler.metrics(),
+                    'caches': (self.pool.cache_stats() if self.pool is not None
+                               else self.pipeline.get_cache_stats())
+                }
+                if self.pool is not None:
+                    stats['pool'] = self.pool.stats()
+                self.write_message(stats)
+            elif op == 'metrics':
+                self.write_message({
+                    'id': request_id,
+                    'type': 'metrics',
+                    'format': 'prometheus',
+                    'text': REGISTRY.render_prometheus(self.pool.metrics_snapshots() if self.pool else ())
+                })
+            elif op == 'models':
+                self.write_message({
+                    'id': request_id,
+                    'type': 'models',
+                    'models': self.pipeline.get_model_stats()
+                })
+            elif op == 'shutdown':
+                break
+            elif op in ('analyze', 'render_heatmap'):
+                handler = self._dispatch if op == 'analyze' else self._render
+                task = asyncio.ensure_future(handler(request_id, request))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            else:
+                self.write_message({'id': request_id, 'type': 'error', 'error': f'Unknown op: {op}'})
+
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        await self.scheduler.stop()
+        self._reader.shutdown(wait=False)
+        return 0
+
+
+def run_worker(pipeline, argv=None, runtime_config=None) -> int:
+    """
+    Entry point for ``medical_ai_pipeline.py --serve``.
+
+    The real stdout is reserved for protocol messages; anything else that
+    prints to stdout while the worker runs is redirected to stderr so it
+    cannot corrupt the JSON-lines stream.
+
+    With ``--processes N`` (N > 1) analysis runs in an InferencePool forked
+    from ``pipeline``; ``runtime_config`` is then the per-worker thread and
+    affinity config, and ``pipeline`` should have been built with
+    ``PoolSettings.parent_runtime`` of it.
+    """
+    if argv is None:
+        argv = sys.argv[2:]
+    defaults = SchedulerSettings.from_env()
+    pool_settings = PoolSettings.from_args(argv)
+    parser = argparse.ArgumentParser(prog='medical_ai_pipeline.py --serve')
+    parser.add_argument('--concurrency', type=int, default=defaults.concurrency,
+                        help='Number of batches analyzed in parallel (XRAY_AI_WORKER_CONCURRENCY)')
+    parser.add_argument('--batch-window-ms', type=float, default=defaults.window_ms,
+                        help='How long to wait for more requests before running a batch (XRAY_AI_BATCH_WINDOW_MS)')
+    parser.add_argument('--max-batch-size', type=int, default=defaults.max_batch_size,
+                        help='Largest batch sent to the models (XRAY_AI_MAX_BATCH_SIZE)')
+    parser.add_argument('--max-queue-depth', type=int, default=defaults.max_queue_depth,
+                        help='Pending requests accepted before new ones are rejected (XRAY_AI_MAX_QUEUE_DEPTH)')
+    parser.add_argument('--finish-workers', type=int, default=defaults.finish_workers,
+                        help='Studies whose report and heatmap are produced in parallel (XRAY_AI_FINISH_WORKERS)')
+    parser.add_argument('--processes', type=int, default=pool_settings.processes,
+                        help='Worker processes forked from the loaded pipeline (XRAY_AI_WORKER_PROCESSES)')
+    parser.add_argument('--job-timeout-s', type=float, default=pool_settings.job_timeout_seconds,
+                        help='Seconds before a pool worker stuck on one batch is restarted (XRAY_AI_POOL_JOB_TIMEOUT_S)')
+    # Runtime flags were taken out by RuntimeConfig.from_args, so anything unknown is a typo
+    args = parser.parse_args(argv)
+    settings = SchedulerSettings(
+        window_ms=max(0.0, args.batch_window_ms),
+        max_batch_size=max(1, args.max_batch_size),
+        max_queue_depth=max(1, args.max_queue_depth),
+        # Keep every pool process busy
+        concurrency=max(1, args.concurrency, pool_settings.processes),
+        finish_workers=max(1, args.finish_workers)
+    )
+
+    protocol_stream = sys.stdout
+    sys.stdout = sys.stderr
+    pool = None
+    try:
+        if pool_settings.processes > 1:
+            # Forked before the event loop and reader threads exist
+            pool = InferencePool(pipeline, pool_settings, runtime_config)
+            pool.start()
+        worker = PipelineWorker(pipeline, settings=settings, output_stream=protocol_stream, pool=pool)
+        return asyncio.run(worker.serve())
+    finally:
+        if pool is not None:
+            pool.stop()
+        sys.stdout = protocol_stream
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Int8 CPU Quantization
+Dynamic int8 for the CLIP transformers and static int8 for the DenseNet121 backbone
+"""
+
+import io
+import copy
+import warnings
+from typing import Iterable, List, Set
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Models that can be quantized independently, as named in XRAY_AI_QUANTIZE
+QUANTIZABLE_MODELS = ('clip', 'densenet')
+
+
+def parse_quantize_setting(value: str) -> Set[str]:
+    """
+    Models selected by an XRAY_AI_QUANTIZE style value.
+
+    Accepts a comma-separated list of model names, 'all', or an empty
+    string / 'none' for full-precision inference.
+
+    Raises:
+        ValueError: If a name is not one of QUANTIZABLE_MODELS
+    """
+    names = {name.strip().lower() for name in (value or '').split(',') if name.strip()}
+    if names & {'none', 'false', 'off'}:
+        return set()
+    if names & {'all', 'true', 'int8'}:
+        return set(QUANTIZABLE_MODELS)
+    unknown = names - set(QUANTIZABLE_MODELS)
+    if unknown:
+        raise ValueError(f"Unknown model(s) to quantize: {', '.join(sorted(unknown))}; "
+                         f"expected any of {', '.join(QUANTIZABLE_MODELS)}")
+    return names
+
+
+def serialized_size_bytes(model) -> int:
+    """Bytes of a module's state dict, which (unlike parameters()) includes packed int8 weights"""
+    import torch
+
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def quantize_dynamic_int8(model):
+    """
+    Dynamic int8 copy of a model: Linear weights are stored as int8 and
+    activations are quantized on the fly, so no calibration is needed.
+
+    This covers the MLP and projection layers of both CLIP transformers,
+    which dominate their CPU time.
+    """
+    import torch
+    from torch.ao.quantization import quantize_dynamic
+
+    with warnings.catch_warnings():
+        # The eager-mode quantization API is deprecated in favor of torchao but still supported
+        warnings.simplefilter('ignore')
+        quantized = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    # OpenCLIP reads the compute dtype from the first MLP weight, which a
+    # quantized Linear no longer exposes as a tensor; this is the attribute
+    # OpenCLIP's own int8 path sets for the same purpose.
+    for module in quantized.modules():
+        if isinstance(module, torch.ao.nn.quantized.dynamic.Linear):
+            module.int8_original_dtype = torch.float32
+    return quantized
+
+
+def quantize_static_int8(module, calibration_inputs: Iterable):
+    """
+    Static int8 copy of a convolutional module via FX graph mode.
+
+    Observers are inserted, ``calibration_inputs`` (batches shaped like real
+    inputs) are run through to record activation ranges, and the result is
+    converted to int8 kernels. The returned module takes and returns float
+    tensors, so it is a drop-in replacement.
+
+    Raises:
+        ValueError: If no calibration batch is given
+    """
+    import torch
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    batches: List = list(calibration_inputs)
+    if not batches:
+        raise ValueError("Static quantization needs at least one calibration batch")
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+        prepared = prepare_fx(copy.deepcopy(module).eval(), qconfig_mapping, example_inputs=(batches[0],))
+        with torch.no_grad():
+            for batch in batches:
+                prepared(batch)
+        return convert_fx(prepared)
+
+
+def quantize_densenet(model, calibration_inputs: Iterable):
+    """
+    Replace a MONAI DenseNet121's ``features`` backbone with a static int8 copy.
+
+    The classifier head stays in float32: it is a single small Linear layer,
+    and keeping it differentiable lets Grad-CAM still backpropagate from the
+    logits to the (dequantized) feature maps.
+    """
+    model.features = quantize_static_int8(model.features, calibration_inputs)
+    return model
+
+
+def synthetic_calibration_images(count: int = 16, size: int = 224, seed: int = 0):
+    """
+    Smooth, radiograph-like (1, size, size) tensors with zero mean and unit
+    variance, matching what the inference chain's NormalizeIntensity produces.
+
+    Used when no calibration images are configured; real studies give better
+    activation ranges.
+    """
+    import torch
+    import torch.nn.functional as F
+
+    generator = torch.Generator().manual_seed(seed)
+    images = []
+    for _ in range(count):
+        # Low-frequency structure (anatomy) plus a little high-frequency noise
+        coarse = torch.rand(1, 1, 8, 8, generator=generator)
+        image = F.interpolate(coarse, size=(size, size), mode='bicubic', align_corners=False)[0]
+        image = image + 0.05 * torch.randn(image.shape, generator=generator)
+        images.append((image - image.mean()) / image.std().clamp_min(1e-6))
+    return images
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Medical Report Cache
+LRU + TTL cache of generated reports keyed on the diagnosis signature and patient context
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_value(value: Any) -> Any:
+    """Canonical form for patient-info values so equivalent inputs share a key"""
+    if isinstance(value, str):
+        return ' '.join(value.strip().lower().split())
+    if isinstance(value, dict):
+        return {str(k).strip().lower(): _normalize_value(v) for k, v in value.items()
+                if v not in (None, '', [], {})}
+    if isinstance(value, (list, tuple)):
+        return [_normalize_value(v) for v in value]
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def report_cache_key(diagnosis: Dict[str, Any], patient_info: Dict[str, Any],
+                     xray_type: str, score_step: float) -> str:
+    """
+    Signature of the inputs that determine a generated report.
+
+    Confidence scores are rounded to ``score_step`` so near-identical model
+    outputs (for example 0.912 vs 0.914 with a 0.05 step) share one report.
+    """
+    def quantize(score: float) -> float:
+        return round(round(float(score) / score_step) * score_step, 6) if score_step > 0 else float(score)
+
+    signature = {
+        'xray_type': (xray_type or '').lower(),
+        'primary': diagnosis.get('primary_diagnosis'),
+        'overall': quantize(diagnosis.get('overall_confidence', 0.0)),
+        'scores': {k: quantize(v) for k, v in sorted(diagnosis.get('confidence_scores', {}).items())},
+        'patient': _normalize_value(patient_info or {})
+    }
+    encoded = json.dumps(signature, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class ReportCache:
+    """
+    Two-tier report cache: an in-memory LRU with TTL, backed by JSON files.
+
+    Entries expire ``ttl_seconds`` after they were generated in both tiers.
+    The disk tier lets a restarted worker keep answering repeated studies
+    from cache; disk errors only disable that tier. Reports are written
+    from patient context, so the tier is opt-in (XRAY_AI_REPORT_CACHE_PERSIST)
+    and its directory and files are readable by the owner only.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 3600.0,
+                 score_step: float = 0.05, cache_dir: Optional[str] = None):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.score_step = score_step
+        self.cache_dir = cache_dir
+        self._entries: 'OrderedDict[str, Tuple[float, Dict[str, Any]]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.prune_disk()
+
+    @classmethod
+    def from_env(cls, cache_root: Optional[str] = None) -> 'ReportCache':
+        persist = os.environ.get('XRAY_AI_REPORT_CACHE_PERSIST', 'false').lower() == 'true'
+        return cls(
+            max_entries=int(os.environ.get('XRAY_AI_REPORT_CACHE_SIZE', 512)),
+            ttl_seconds=float(os.environ.get('XRAY_AI_REPORT_CACHE_TTL', 3600)),
+            score_step=float(os.environ.get('XRAY_AI_REPORT_CACHE_SCORE_STEP', 0.05)),
+            cache_dir=os.path.join(cache_root, 'reports') if persist and cache_root else None
+        )
+
+    def key(self, diagnosis: Dict[str, Any], patient_info: Dict[str, Any], xray_type: str) -> str:
+        return report_cache_key(diagnosis, patient_info, xray_type, self.score_step)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _is_fresh(self, created_at: float) -> bool:
+        return self.ttl_seconds <= 0 or (time.time() - created_at) < self.ttl_seconds
+
+    def _read_disk(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                payload = json.load(f)
+            return payload['created_at'], payload['report']
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring unreadable report cache entry %s: %s", key, e)
+            return None
+
+    def _write_disk(self, key: str, created_at: float, report: Dict[str, Any]):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            os.chmod(self.cache_dir, 0o700)
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'created_at': created_at, 'report': report}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Could not persist report cache entry to %s: %s", path, e)
+
+    def _remove_disk(self, key: str):
+        if self.cache_dir:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def prune_disk(self) -> int:
+        """Delete expired files from the disk tier; returns how many were removed"""
+        if not self.cache_dir or self.ttl_seconds <= 0 or not os.path.isdir(self.cache_dir):
+            return 0
+        removed = 0
+        cutoff = time.time() - self.ttl_seconds
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a fresh cached report, promoting it to most recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._is_fresh(entry[0]):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(entry[1])
+                del self._entries[key]
+                self.expired += 1
+
+            entry = self._read_disk(key)
+            if entry is not None:
+                if self._is_fresh(entry[0]):
+                    self._store(key, entry)
+                    self.disk_hits += 1
+                    return dict(entry[1])
+                self._remove_disk(key)
+                self.expired += 1
+
+            self.misses += 1
+            return None
+
+    def _store(self, key: str, entry: Tuple[float, Dict[str, Any]]):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, key: str, report: Dict[str, Any]):
+        created_at = time.time()
+        with self._lock:
+            self._store(key, (created_at, dict(report)))
+        self._write_disk(key, created_at, report)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'ttl_seconds': self.ttl_seconds,
+            'score_step': self.score_step
+        }
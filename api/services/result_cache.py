@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Content-Addressed Analysis Result Cache
+SQLite store of model outputs keyed by image content, xray_type and model version
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Dict, Any, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access);
+"""
+
+
+class ResultCache:
+    """
+    Size-bounded SQLite cache of per-image model outputs.
+
+    Keys combine the SHA-256 of the image bytes with the xray_type, the
+    test-time augmentation and heatmap settings and the pipeline/model
+    version, so a re-uploaded study is answered without preprocessing or
+    inference. Processes running different model versions (fp32 and int8
+    workers, say) can share one cache file: their rows never match each
+    other's keys, and rows no version reads any more age out through the
+    least-recently-used eviction once the stored values exceed ``max_bytes``.
+    """
+
+    def __init__(self, db_path: str, version: str, max_bytes: int = 512 * 1024 * 1024):
+        self.db_path = db_path
+        self.version = version
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+
+    @classmethod
+    def from_env(cls, cache_root: str, version: str, persistent: bool = True) -> Optional['ResultCache']:
+        """
+        Open the cache configured by XRAY_AI_RESULT_CACHE*, or None when disabled or unavailable.
+
+        With ``persistent=False`` the cache lives in this process's memory
+        only, for model versions no later process can ever match.
+        """
+        if os.environ.get('XRAY_AI_RESULT_CACHE', 'true').lower() != 'true':
+            return None
+        max_mb = float(os.environ.get('XRAY_AI_RESULT_CACHE_MAX_MB', 512))
+        if persistent:
+            db_path = os.environ.get('XRAY_AI_RESULT_CACHE_PATH') or os.path.join(cache_root, 'results.sqlite3')
+        else:
+            db_path = ':memory:'
+        try:
+            return cls(db_path, version, max_bytes=int(max_mb * 1024 * 1024))
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("Result cache disabled, could not open %s: %s", db_path, e)
+            return None
+
+    def key(self, image_digest: str, xray_type: str, tta_views: int = 1,
+            heatmap_mode: str = 'full') -> str:
+        return f"{image_digest}:{xray_type}:{tta_views}:{heatmap_mode}:{self.version}"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            try:
+                row = self._conn.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                self._conn.execute('UPDATE results SET last_access = ? WHERE key = ?', (time.time(), key))
+            except sqlite3.Error as e:
+                logger.warning("Result cache read failed: %s", e)
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Dict[str, Any]):
+        encoded = json.dumps(value, ensure_ascii=False)
+        size = len(encoded.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO results (key, version, value, size, created_at, last_access) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (key, self.version, encoded, size, now, now)
+                )
+                self._evict()
+            except sqlite3.Error as e:
+                logger.warning("Result cache write failed: %s", e)
+
+    def _evict(self):
+        """Drop least recently used rows until the stored values fit in max_bytes"""
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute('SELECT key, size FROM results ORDER BY last_access ASC').fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute('DELETE FROM results WHERE key = ?', (key,))
+            total -= size
+            self.evictions += 1
+
+    def close(self):
+        """Close the connection; required before forking, since SQLite connections must not cross fork()"""
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            try:
+                entries, total = self._conn.execute(
+                    'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results'
+                ).fetchone()
+            except sqlite3.Error:
+                entries, total = None, None
+        return {
+            'entries': entries,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'version': self.version
+        }
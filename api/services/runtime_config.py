@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+CPU Runtime Configuration
+Thread counts and core affinity for inference processes, from environment variables or CLI flags
+"""
+
+import os
+import argparse
+from dataclasses import dataclass, fields
+from typing import Dict, List, Any, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def parse_cpu_list(value: str) -> List[int]:
+    """
+    Parse a Linux-style CPU list such as ``0-3,8,10-11``.
+
+    Raises:
+        ValueError: If the list is empty or malformed
+    """
+    cpus = set()
+    for part in (value or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = (int(bound) for bound in part.split('-', 1))
+            if end < start:
+                raise ValueError(f"Invalid CPU range '{part}'")
+            cpus.update(range(start, end + 1))
+        else:
+            cpus.add(int(part))
+    if not cpus:
+        raise ValueError(f"Empty CPU list '{value}'")
+    return sorted(cpus)
+
+
+def format_cpu_list(cpus: List[int]) -> str:
+    """Inverse of parse_cpu_list: ``[0, 1, 2, 3, 8]`` -> ``0-3,8``"""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(start) if start == end else f"{start}-{end}" for start, end in ranges)
+
+
+def available_cpus() -> List[int]:
+    """CPUs this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+@dataclass
+class RuntimeConfig:
+    """
+    Per-process CPU settings, so several workers can share a node without
+    oversubscribing it.
+
+    Unset values keep the library defaults. When the process is pinned to a
+    set of cores and no intra-op count is given, torch uses one thread per
+    pinned core. Affinity is either an explicit CPU list or a slice of
+    ``cores_per_worker`` cores chosen by ``worker_index``, so N workers started
+    with indexes 0..N-1 get disjoint cores.
+    """
+    intra_op_threads: Optional[int] = None
+    inter_op_threads: Optional[int] = None
+    opencv_threads: Optional[int] = None
+    cpu_affinity: Optional[str] = None
+    worker_index: Optional[int] = None
+    cores_per_worker: Optional[int] = None
+
+    # Field -> (environment variable, CLI flag, help)
+    _OPTIONS = {
+        'intra_op_threads': ('XRAY_AI_INTRA_OP_THREADS', '--intra-op-threads',
+                             'Threads torch and ONNX Runtime use inside one operator'),
+        'inter_op_threads': ('XRAY_AI_INTER_OP_THREADS', '--inter-op-threads',
+                             'Threads torch uses to run independent operators in parallel'),
+        'opencv_threads': ('XRAY_AI_OPENCV_THREADS', '--opencv-threads',
+                           'OpenCV worker threads (0 disables OpenCV threading)'),
+        'cpu_affinity': ('XRAY_AI_CPU_AFFINITY', '--cpu-affinity',
+                         'CPU list to pin this process to, e.g. 0-3,8'),
+        'worker_index': ('XRAY_AI_WORKER_INDEX', '--worker-index',
+                         'Index of this worker; with --cores-per-worker selects its cores'),
+        'cores_per_worker': ('XRAY_AI_CORES_PER_WORKER', '--cores-per-worker',
+                             'Cores pinned per worker when pinning by worker index'),
+    }
+
+    @classmethod
+    def from_env(cls) -> 'RuntimeConfig':
+        values = {}
+        for field in fields(cls):
+            raw = os.environ.get(cls._OPTIONS[field.name][0])
+            if raw not in (None, ''):
+                values[field.name] = raw if field.name == 'cpu_affinity' else int(raw)
+        return cls(**values)
+
+    @classmethod
+    def from_args(cls, argv: List[str]) -> Tuple['RuntimeConfig', List[str]]:
+        """
+        Environment settings overridden by any runtime flags in ``argv``.
+
+        Every other argument is passed through untouched, in order, for the
+        entry point's own parser.
+
+        Returns:
+            The config and the arguments that were not runtime flags
+        """
+        parser = argparse.ArgumentParser(add_help=False)
+        for name, (_, flag, help_text) in cls._OPTIONS.items():
+            parser.add_argument(flag, dest=name, type=str if name == 'cpu_affinity' else int,
+                                default=None, help=help_text)
+        args, remaining = parser.parse_known_args(argv)
+        config = cls.from_env()
+        for name in cls._OPTIONS:
+            value = getattr(args, name)
+            if value is not None:
+                setattr(config, name, value)
+        return config, remaining
+
+    def resolve_affinity(self) -> Optional[List[int]]:
+        """
+        CPUs to pin to, or None to leave affinity alone.
+
+        Raises:
+            ValueError: If the requested cores are not available to this process
+        """
+        available = available_cpus()
+        if self.cpu_affinity:
+            cpus = parse_cpu_list(self.cpu_affinity)
+            missing = sorted(set(cpus) - set(available))
+            if missing:
+                raise ValueError(f"CPUs {missing} are not available (allowed: {available})")
+            return cpus
+        if self.worker_index is not None and self.cores_per_worker:
+            if self.cores_per_worker > len(available):
+                raise ValueError(f"{self.cores_per_worker} cores per worker requested, "
+                                 f"only {len(available)} available")
+            # Wrap around so extra workers share cores instead of failing
+            slots = len(available) // self.cores_per_worker
+            start = (self.worker_index % slots) * self.cores_per_worker
+            return available[start:start + self.cores_per_worker]
+        return None
+
+    def apply(self) -> Dict[str, Any]:
+        """
+        Apply affinity and thread settings to this process.
+
+        Call before the models run: torch only accepts an inter-op thread
+        count before its first parallel operation.
+
+        Returns:
+            The effective settings, for logging and stats
+        """
+        import torch
+        import cv2
+
+        affinity = self.resolve_affinity()
+        if affinity is not None and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, affinity)
+        elif affinity is not None:
+            logger.warning("CPU affinity is not supported on this platform; ignoring it")
+
+        intra_op = self.intra_op_threads or (len(affinity) if affinity else None)
+        if intra_op:
+            torch.set_num_threads(intra_op)
+        if self.inter_op_threads:
+            try:
+                torch.set_num_interop_threads(self.inter_op_threads)
+            except RuntimeError as e:
+                logger.warning("Inter-op thread count not applied: %s", e)
+        if self.opencv_threads is not None:
+            cv2.setNumThreads(self.opencv_threads)
+
+        return self.effective_settings()
+
+    def effective_settings(self) -> Dict[str, Any]:
+        """What the libraries are actually using right now"""
+        import torch
+        import cv2
+
+        return {
+            'intra_op_threads': torch.get_num_threads(),
+            'inter_op_threads': torch.get_num_interop_threads(),
+            'opencv_threads': cv2.getNumThreads(),
+            'cpu_affinity': format_cpu_list(available_cpus()),
+            'cpu_count': os.cpu_count(),
+            'worker_index': self.worker_index
+        }
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Structured Logging
+JSON-lines log records tagged with the request ID and pipeline stage they belong to
+"""
+
+import os
+import sys
+import json
+import logging
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMATS = ('json', 'text')
+
+# Loggers of this application; everything else (open_clip, MONAI, urllib3...) is a library
+APP_LOGGERS = ('medical_ai_pipeline', 'services', 'benchmark_pipeline', 'bulk_analysis', '__main__')
+
+# Request and stage of the code running in this thread (or task); set with log_context()
+_request_id: contextvars.ContextVar = contextvars.ContextVar('xray_ai_request_id', default=None)
+_stage: contextvars.ContextVar = contextvars.ContextVar('xray_ai_stage', default=None)
+
+# LogRecord attributes that are not user-supplied ``extra`` fields
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+@contextmanager
+def log_context(request_id: Any = None, stage: Optional[str] = None):
+    """
+    Tag every record logged inside the block with ``request_id`` and/or ``stage``.
+
+    Only the values given are changed, so a stage can be entered inside a
+    request without repeating its ID. ``request_id`` may be a list for
+    batch-level work shared by several requests.
+    """
+    tokens = []
+    if request_id is not None:
+        tokens.append((_request_id, _request_id.set(request_id)))
+    if stage is not None:
+        tokens.append((_stage, _stage.set(stage)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def current_request_id() -> Any:
+    return _request_id.get()
+
+
+class _ContextFilter(logging.Filter):
+    """Copies the current request ID and stage onto each record"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'request_id'):
+            record.request_id = _request_id.get()
+        if not hasattr(record, 'stage'):
+            record.stage = _stage.get()
+        return True
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    One JSON object per record: time, level, logger, message, pid, request
+    ID, stage, any ``extra`` fields and the formatted exception, if any.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'pid': record.process
+        }
+        if getattr(record, 'request_id', None) is not None:
+            entry['request_id'] = record.request_id
+        if getattr(record, 'stage', None) is not None:
+            entry['stage'] = record.stage
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key not in ('request_id', 'stage') and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _TextFormatter(logging.Formatter):
+    """Human-readable variant for local debugging (XRAY_AI_LOG_FORMAT=text)"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s %(name)s%(context)s %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        parts = [str(value) for value in (getattr(record, 'request_id', None), getattr(record, 'stage', None))
+                 if value is not None]
+        record.context = f" [{'/'.join(parts)}]" if parts else ''
+        return super().format(record)
+
+
+_configured_handler: Optional[logging.Handler] = None
+
+
+def configure_logging(level: Optional[str] = None, log_format: Optional[str] = None, stream=None) -> logging.Handler:
+    """
+    Send all log records to stderr as JSON lines (or text), at XRAY_AI_LOG_LEVEL (default INFO).
+
+    Records below the level are discarded before any formatting, so
+    DEBUG diagnostics cost only a level check in production. Libraries
+    (some log to the root logger directly) stay at WARNING unless
+    XRAY_AI_LOG_LIBRARIES=true. Calling this again replaces the previous handler.
+
+    Raises:
+        ValueError: If the level or format is not recognized
+    """
+    global _configured_handler
+    level_name = (level or os.environ.get('XRAY_AI_LOG_LEVEL', 'INFO')).upper()
+    numeric_level = logging.getLevelName(level_name)
+    if not isinstance(numeric_level, int):
+        raise ValueError(f"Unknown log level '{level_name}'")
+    log_format = (log_format or os.environ.get('XRAY_AI_LOG_FORMAT', 'json')).lower()
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format '{log_format}', expected one of {', '.join(LOG_FORMATS)}")
+
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonLinesFormatter() if log_format == 'json' else _TextFormatter())
+    handler.addFilter(_ContextFilter())
+
+    root = logging.getLogger()
+    if _configured_handler is not None:
+        root.removeHandler(_configured_handler)
+    root.addHandler(handler)
+    _configured_handler = handler
+    include_libraries = os.environ.get('XRAY_AI_LOG_LIBRARIES', 'false').lower() == 'true'
+    root.setLevel(numeric_level if include_libraries else max(numeric_level, logging.WARNING))
+    for name in APP_LOGGERS:
+        logging.getLogger(name).setLevel(numeric_level)
+    logging.captureWarnings(True)
+    return handler
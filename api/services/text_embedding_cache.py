@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Text Embedding Cache
+Normalized CLIP text-feature matrices for the condition prompts, kept in memory and on disk
+"""
+
+import os
+import hashlib
+import threading
+from typing import Dict, List, Any, Callable, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def default_cache_dir() -> str:
+    """Root directory for persisted pipeline caches"""
+    return os.environ.get('XRAY_AI_CACHE_DIR') or os.path.join(
+        os.path.expanduser('~'), '.cache', 'samuge-xray-ai'
+    )
+
+
+def prompt_set_key(model_key: str, prompts: List[str]) -> str:
+    """Stable key for one model + prompt list combination"""
+    digest = hashlib.sha256()
+    digest.update(model_key.encode('utf-8'))
+    for prompt in prompts:
+        digest.update(b'\x00')
+        digest.update(prompt.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class TextEmbeddingCache:
+    """
+    Two-tier cache of normalized text features.
+
+    The condition prompts never change between requests, so their text
+    features are encoded once per model and prompt set. Matrices are kept in
+    memory on the inference device and persisted as ``.pt`` files so a
+    restarted worker can skip ``encode_text`` entirely. Disk failures (for
+    example a read-only filesystem) only disable the persistent tier.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, persist: bool = True):
+        self.cache_dir = os.path.join(cache_dir or default_cache_dir(), 'text_features')
+        self.persist = persist
+        self._memory: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pt")
+
+    def _load_from_disk(self, key: str, model_key: str, prompts: List[str]):
+        import torch
+
+        path = self._path(key)
+        if not self.persist or not os.path.exists(path):
+            return None
+        try:
+            payload = torch.load(path, map_location='cpu', weights_only=True)
+        except Exception as e:
+            logger.warning("Ignoring unreadable text-feature cache %s: %s", path, e)
+            return None
+        # Guard against hash collisions and hand-edited files
+        if (not isinstance(payload, dict) or payload.get('model_key') != model_key
+                or payload.get('prompts') != prompts or not torch.is_tensor(payload.get('features'))):
+            logger.warning("Ignoring text-feature cache %s written for other prompts or in another format", path)
+            return None
+        return payload['features']
+
+    def _save_to_disk(self, key: str, model_key: str, prompts: List[str], features):
+        import torch
+
+        if not self.persist:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            torch.save({'model_key': model_key, 'prompts': prompts, 'features': features.cpu()}, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Could not persist text features to %s: %s", path, e)
+
+    def get_or_compute(self, model_key: str, prompts: List[str],
+                       encode_fn: Callable[[List[str]], Any], device):
+        """
+        Return the normalized text-feature matrix for ``prompts``.
+
+        Args:
+            model_key: Identifies the model weights (id plus pretrained tag)
+            prompts: Prompt strings, one per condition, in score order
+            encode_fn: Encodes prompts to unnormalized features on a miss
+            device: Device the returned matrix should live on
+
+        Returns:
+            Tensor of shape (len(prompts), embed_dim), L2-normalized per row
+        """
+        import torch
+
+        key = prompt_set_key(model_key, prompts)
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                self.hits += 1
+                return cached
+
+            features = self._load_from_disk(key, model_key, prompts)
+            if features is not None:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+                with torch.no_grad():
+                    features = torch.nn.functional.normalize(encode_fn(prompts).float(), dim=-1)
+                self._save_to_disk(key, model_key, prompts, features)
+
+            features = features.to(device)
+            self._memory[key] = features
+            return features
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'entries': len(self._memory),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses
+        }
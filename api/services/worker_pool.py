@@ -0,0 +1,765 @@
+#!/usr/bin/env python3
+"""
+Multi-Process Inference Pool
+Forks worker processes from one loaded pipeline so every core is used while the model weights stay shared
+"""
+
+import os
+import gc
+import sys
+import time
+import signal
+import argparse
+import itertools
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, replace
+from multiprocessing import reduction
+from multiprocessing.connection import Connection, wait
+from typing import Dict, List, Any, Callable, Optional
+import logging
+
+from services.metrics import REGISTRY, merge_snapshots
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerCrashedError(RuntimeError):
+    """Raised for a job whose worker process died or was killed while running it"""
+
+
+# Cache counters that add up across workers; other cache stats are sizes and settings
+_SUMMED_CACHE_FIELDS = ('hits', 'disk_hits', 'misses', 'expired', 'evictions')
+
+
+@dataclass
+class PoolSettings:
+    """Size and health-check knobs for the inference pool"""
+    processes: int = 1
+    heartbeat_seconds: float = 2.0
+    heartbeat_timeout_seconds: float = 30.0
+    job_timeout_seconds: float = 600.0
+    start_timeout_seconds: float = 300.0
+    share_memory: bool = False
+
+    @classmethod
+    def from_env(cls) -> 'PoolSettings':
+        return cls(
+            processes=int(os.environ.get('XRAY_AI_WORKER_PROCESSES', cls.processes)),
+            heartbeat_seconds=float(os.environ.get('XRAY_AI_POOL_HEARTBEAT_S', cls.heartbeat_seconds)),
+            heartbeat_timeout_seconds=float(os.environ.get('XRAY_AI_POOL_HEARTBEAT_TIMEOUT_S',
+                                                           cls.heartbeat_timeout_seconds)),
+            job_timeout_seconds=float(os.environ.get('XRAY_AI_POOL_JOB_TIMEOUT_S', cls.job_timeout_seconds)),
+            share_memory=os.environ.get('XRAY_AI_POOL_SHARE_MEMORY', 'false').lower() == 'true'
+        )
+
+    @classmethod
+    def from_args(cls, argv: Optional[List[str]]) -> 'PoolSettings':
+        """Environment settings overridden by ``--processes`` / ``--job-timeout-s`` in ``argv``
+
+        Other arguments are ignored here; the entry point's own parser, which
+        also declares these two flags, rejects unknown ones.
+        """
+        settings = cls.from_env()
+        parser = argparse.ArgumentParser(add_help=False)
+        parser.add_argument('--processes', type=int, default=settings.processes)
+        parser.add_argument('--job-timeout-s', type=float, default=settings.job_timeout_seconds)
+        args, _ = parser.parse_known_args(argv)
+        return replace(settings, processes=max(1, args.processes),
+                       job_timeout_seconds=max(1.0, args.job_timeout_s))
+
+    def parent_runtime(self, runtime_config):
+        """
+        Runtime config for the process that loads the pipeline and forks the workers.
+
+        With more than one process the parent must stay on a single intra-op
+        thread: an OpenMP thread pool started before fork() is unusable in
+        the children, and a child that then runs multi-threaded torch ops
+        deadlocks. The workers pick their own thread counts after the fork.
+        """
+        if self.processes <= 1:
+            return runtime_config
+        return replace(runtime_config, intra_op_threads=1, cpu_affinity=None,
+                       worker_index=None, cores_per_worker=None)
+
+    def worker_runtime(self, runtime_config, slot: int):
+        """Runtime config for worker ``slot``: its own core slice, threads split evenly by default"""
+        config = replace(runtime_config, worker_index=slot)
+        if not config.intra_op_threads and not config.cpu_affinity and not config.cores_per_worker:
+            config.intra_op_threads = max(1, (os.cpu_count() or 1) // self.processes)
+        return config
+
+
+def process_memory(pid: int) -> Optional[Dict[str, int]]:
+    """
+    Resident, proportional and private memory of a process, in bytes.
+
+    PSS splits each shared page between the processes mapping it and
+    ``private`` counts only pages this process alone owns, so together they
+    show how much of the model weights a forked worker still shares.
+    Returns None where /proc is unavailable.
+    """
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            values = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    values[parts[0][:-1]] = int(parts[1]) * 1024
+    except OSError:
+        return None
+    return {
+        'rss': values.get('Rss'),
+        'pss': values.get('Pss'),
+        'private': values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)
+    }
+
+
+@dataclass
+class _Job:
+    job_id: int
+    kwargs: Dict[str, Any]
+    future: Future
+    on_event: Optional[Callable[[int, Dict[str, Any]], None]] = None
+    on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None
+    studies: int = 0
+    started_at: Optional[float] = None
+    results: Optional[List[Any]] = None
+
+
+class _WorkerSlot:
+    """Parent-side state of one worker process; survives restarts of the process"""
+
+    def __init__(self, slot: int):
+        self.slot = slot
+        self.process = None
+        self.conn = None
+        self.pid = None
+        self.ready = False
+        self.job: Optional[_Job] = None
+        self.started_at = None
+        self.last_heartbeat = None
+        self.runtime = None
+        self.jobs = 0
+        self.studies = 0
+        self.failures = 0
+        self.crashes = 0
+        self.restarts = 0
+        self.busy_seconds = 0.0
+        self.metrics: Dict[str, Any] = {}  # Latest metrics snapshot sent by the process
+        self.caches: Dict[str, Any] = {}  # Latest cache stats sent by the process
+
+    @property
+    def state(self) -> str:
+        if self.process is None or not self.process.is_alive():
+            return 'dead'
+        if not self.ready:
+            return 'starting'
+        return 'busy' if self.job is not None else 'idle'
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            'slot': self.slot,
+            'pid': self.pid,
+            'state': self.state,
+            'uptime_seconds': round(now - self.started_at, 1) if self.started_at else None,
+            'heartbeat_age_seconds': round(now - self.last_heartbeat, 1) if self.last_heartbeat else None,
+            'jobs': self.jobs,
+            'studies': self.studies,
+            'failures': self.failures,
+            'crashes': self.crashes,
+            'restarts': self.restarts,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'mean_job_ms': round(1000 * self.busy_seconds / self.jobs, 1) if self.jobs else None,
+            'runtime': self.runtime,
+            'memory': process_memory(self.pid) if self.pid else None,
+            'caches': self.caches
+        }
+
+
+class _ForkedWorker:
+    """
+    Parent-side handle of a worker forked by the zygote.
+
+    The worker is the zygote's child, not ours, so this provides the
+    ``multiprocessing.Process`` methods the pool uses on top of a pidfd
+    (readable once the process exits), falling back to signal 0 probes
+    where pidfds are unavailable. Exit codes come from the zygote.
+    """
+
+    def __init__(self, pid: int, zygote: '_Zygote'):
+        self.pid = pid
+        self.exitcode: Optional[int] = None
+        self._zygote = zygote
+        self._exited = False
+        try:
+            self.sentinel = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            self.sentinel = None
+
+    def is_alive(self) -> bool:
+        if self._exited:
+            return False
+        if self.sentinel is not None:
+            if not wait([self.sentinel], 0):
+                return True
+        else:
+            try:
+                # A zombie still answers until the zygote reaps it, within a second
+                os.kill(self.pid, 0)
+                return True
+            except ProcessLookupError:
+                pass
+        self._exited = True
+        self.exitcode = self._zygote.reap(self.pid)
+        if self.sentinel is not None:
+            os.close(self.sentinel)
+            self.sentinel = None
+        return False
+
+    def kill(self):
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def join(self, timeout: Optional[float] = None):
+        deadline = None if timeout is None else time.time() + timeout
+        while self.is_alive():
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return
+            if self.sentinel is not None:
+                wait([self.sentinel], remaining)
+            else:
+                time.sleep(0.05 if remaining is None else min(0.05, remaining))
+
+
+def _zygote_main(control, pipeline, heartbeat_seconds: float):
+    """
+    Body of the zygote: a single-threaded copy of the loaded parent that forks every worker.
+
+    By the time a worker needs replacing the parent runs other threads (the
+    pool manager, the event loop and stdin reader, executor threads), and
+    fork() copies only the calling thread, so locks those threads hold
+    would stay locked in the child. The zygote is forked in ``start()``
+    before any of them exist and never starts a thread itself, so the
+    workers it forks, first or replacement, get a consistent pipeline.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    exit_codes: Dict[int, int] = {}
+
+    def reap(pid: int = -1, options: int = os.WNOHANG):
+        while True:
+            try:
+                reaped, status = os.waitpid(pid, options)
+            except ChildProcessError:
+                return
+            if reaped == 0:
+                return
+            exit_codes[reaped] = os.waitstatus_to_exitcode(status)
+            if pid != -1:
+                return
+
+    while True:
+        reap()
+        try:
+            if not control.poll(1.0):
+                continue
+            message = control.recv()
+        except (EOFError, OSError):
+            break
+        if message[0] == 'stop':
+            break
+        if message[0] == 'reap':
+            pid = message[1]
+            if pid not in exit_codes:
+                reap(pid, 0)
+            control.send(('exitcode', exit_codes.pop(pid, None)))
+            continue
+
+        _, slot, runtime_config = message
+        conn = Connection(reduction.recv_handle(control))
+        pid = os.fork()
+        if pid == 0:
+            control.close()
+            code = 1
+            try:
+                _worker_main(slot, conn, pipeline, runtime_config, heartbeat_seconds)
+                code = 0
+            except (EOFError, ConnectionError):
+                code = 0  # The parent went away
+            except BaseException as e:
+                logger.error("Pool worker %s failed: %s", slot, e, exc_info=True)
+            finally:
+                os._exit(code)
+        conn.close()
+        control.send(('spawned', pid))
+
+
+class _Zygote:
+    """Parent-side handle of the zygote process; requests are answered in order, one at a time"""
+
+    def __init__(self, context, pipeline, heartbeat_seconds: float):
+        # A duplex pipe is a socket pair, which can carry the workers' pipe ends
+        self._control, child_control = context.Pipe()
+        self._lock = threading.Lock()
+        self.process = context.Process(
+            target=_zygote_main,
+            args=(child_control, pipeline, heartbeat_seconds),
+            name='xray-ai-zygote',
+            daemon=True
+        )
+        self.process.start()
+        child_control.close()
+
+    def _request(self, message, handle: Optional[int] = None):
+        with self._lock:
+            try:
+                self._control.send(message)
+                if handle is not None:
+                    reduction.send_handle(self._control, handle, self.process.pid)
+                return self._control.recv()[1]
+            except (EOFError, OSError) as e:
+                raise RuntimeError(f"Worker zygote is not running ({e})")
+
+    def spawn(self, slot: int, runtime_config, conn) -> int:
+        """Fork a worker for ``slot`` talking over ``conn``; returns its pid"""
+        return self._request(('spawn', slot, runtime_config), conn.fileno())
+
+    def reap(self, pid: int) -> Optional[int]:
+        """Exit code of a worker that has exited, or None if unknown"""
+        try:
+            return self._request(('reap', pid))
+        except RuntimeError:
+            return None
+
+    def stop(self, timeout: float = 10.0):
+        with self._lock:
+            try:
+                self._control.send(('stop',))
+            except OSError:
+                pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self._control.close()
+
+
+def _worker_main(slot: int, conn, pipeline, runtime_config, heartbeat_seconds: float):
+    """Body of a forked worker: set up per-process state, then run jobs until told to stop"""
+    # The parent handles Ctrl-C and stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Counts inherited from the parent are the parent's to report
+    REGISTRY.reset()
+    # The parent's stdout carries the worker protocol; keep stray native writes off it
+    os.dup2(sys.stderr.fileno(), 1)
+    sys.stdout = sys.stderr
+
+    pipeline.after_fork(runtime_config)
+    conn.send(('ready', os.getpid(), pipeline.runtime_settings, pipeline.get_cache_stats()))
+    # Events and per-study results are sent from the pipeline's finishing threads
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    while True:
+        if not conn.poll(heartbeat_seconds):
+            send(('heartbeat',))
+            continue
+        message = conn.recv()
+        if message[0] == 'stop':
+            break
+        _, job_id, kwargs, stream_events, stream_results = message
+
+        on_event = None
+        if stream_events:
+            def on_event(index, event, job_id=job_id):
+                send(('event', job_id, index, event))
+        on_result = None
+        if stream_results:
+            # Each study goes back as soon as it finishes; the final message then carries no results
+            def on_result(index, result, job_id=job_id):
+                send(('study', job_id, index, result))
+        started = time.perf_counter()
+        try:
+            results = pipeline.complete_analysis_batch(on_event=on_event, on_result=on_result, **kwargs)
+            send(('result', job_id, None if stream_results else results, time.perf_counter() - started,
+                  REGISTRY.snapshot(), pipeline.get_cache_stats()))
+        except Exception as e:
+            logger.error("Pool worker %s job %s failed: %s", slot, job_id, e, exc_info=True)
+            send(('error', job_id, f"{type(e).__name__}: {e}", time.perf_counter() - started,
+                  REGISTRY.snapshot(), pipeline.get_cache_stats()))
+    conn.close()
+
+
+class InferencePool:
+    """
+    N forked worker processes running one shared, fully loaded pipeline.
+
+    The parent loads ``MedicalAIPipeline`` once and forks a single-threaded
+    zygote from it, which forks the workers (and later their replacements),
+    so the model weights are inherited copy-on-write (or via shared memory
+    with ``share_memory``) instead of being loaded N times; each extra
+    worker only adds its activations and per-process state.
+
+    Jobs wait in one parent-side queue and are handed to whichever worker
+    is idle, each over that worker's own pipe. A single manager thread
+    dispatches jobs, collects results and events, and checks health: a
+    worker that exits, stops sending heartbeats while idle or exceeds
+    ``job_timeout_seconds`` on a job is killed and forked again, and its
+    in-flight job fails with WorkerCrashedError.
+
+    ``complete_analysis_batch`` has the pipeline's signature, so a
+    MicroBatchScheduler can use the pool in place of the pipeline.
+    """
+
+    def __init__(self, pipeline, settings: Optional[PoolSettings] = None, runtime_config=None):
+        self.pipeline = pipeline
+        self.settings = settings or PoolSettings.from_env()
+        self.runtime_config = runtime_config or pipeline.runtime_config
+        self._context = multiprocessing.get_context('fork')
+        self._slots = [_WorkerSlot(slot) for slot in range(self.settings.processes)]
+        self._pending: deque = deque()
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count(1)
+        self._wakeup_reader, self._wakeup_writer = self._context.Pipe(duplex=False)
+        self._manager = None
+        self._zygote: Optional[_Zygote] = None
+        self._running = False
+        self.started_at = None
+        self.jobs_submitted = 0
+        # Metrics of worker processes that have since been replaced, so totals never go backwards
+        self._retired_metrics: Dict[str, Any] = {}
+
+    def start(self):
+        """
+        Fork the zygote and the workers, and wait until all workers are ready.
+
+        Call before the process starts other threads where possible: fork()
+        copies only the calling thread, so locks held elsewhere stay locked
+        in the zygote. Replacement workers are forked by the zygote, so
+        threads started after this are safe.
+
+        Raises:
+            RuntimeError: If the workers do not come up within start_timeout_seconds
+        """
+        self.pipeline.prepare_for_fork(share_memory=self.settings.share_memory)
+        if self.pipeline.onnx_models:
+            logger.warning("ONNX Runtime sessions cannot be shared across processes; "
+                           "every pool worker opens its own copy of the graphs")
+        # Objects that already exist are never collected in the zygote and the
+        # workers it forks, so the collector does not touch (and copy) the pages
+        # holding them. The long-lived parent goes back to collecting everything
+        gc.collect()
+        gc.freeze()
+        try:
+            self._zygote = _Zygote(self._context, self.pipeline, self.settings.heartbeat_seconds)
+        finally:
+            gc.unfreeze()
+        for slot in self._slots:
+            self._spawn(slot)
+
+        deadline = time.time() + self.settings.start_timeout_seconds
+        while not all(slot.ready for slot in self._slots):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                self.stop()
+                raise RuntimeError(f"Worker pool did not start within {self.settings.start_timeout_seconds:.0f}s")
+            for slot in self._slots:
+                if not slot.process.is_alive():
+                    self.stop()
+                    raise RuntimeError(f"Pool worker {slot.slot} exited during startup "
+                                       f"(exit code {slot.process.exitcode})")
+                if slot.conn.poll(min(remaining, 0.1)):
+                    self._handle_message(slot, slot.conn.recv())
+
+        self._running = True
+        self.started_at = time.time()
+        self._manager = threading.Thread(target=self._manage, name='pool-manager', daemon=True)
+        self._manager.start()
+        logger.info("Inference pool: %s worker processes (pids %s)", len(self._slots),
+                    ', '.join(str(slot.pid) for slot in self._slots))
+
+    def stop(self, timeout: float = 10.0):
+        """Stop the workers, failing any job that has not finished"""
+        self._running = False
+        self._wake()
+        if self._manager is not None and self._manager is not threading.current_thread():
+            self._manager.join(timeout)
+        for slot in self._slots:
+            if slot.process is not None and slot.process.is_alive():
+                try:
+                    slot.conn.send(('stop',))
+                except OSError:
+                    pass
+        deadline = time.time() + timeout
+        for slot in self._slots:
+            if slot.process is None:
+                continue
+            slot.process.join(max(0.0, deadline - time.time()))
+            if slot.process.is_alive():
+                slot.process.kill()
+                slot.process.join()
+            if slot.job is not None:
+                self._fail(slot.job, RuntimeError("Worker pool stopped"))
+                slot.job = None
+        if self._zygote is not None:
+            self._zygote.stop(max(0.0, deadline - time.time()))
+            self._zygote = None
+        with self._lock:
+            while self._pending:
+                self._fail(self._pending.popleft(), RuntimeError("Worker pool stopped"))
+
+    def complete_analysis_batch(self, image_paths, xray_types="chest", patient_infos=None,
+                                batch_size=None, tta_views=None, on_event=None, heatmap_modes=None,
+                                request_ids=None, on_result=None, finish_workers=None):
+        """Run ``complete_analysis_batch`` on the next idle worker and wait for its results"""
+        kwargs = {
+            'image_paths': list(image_paths),
+            'xray_types': xray_types,
+            'patient_infos': patient_infos,
+            'tta_views': tta_views,
+            'heatmap_modes': heatmap_modes,
+            'request_ids': request_ids
+        }
+        if batch_size is not None:
+            kwargs['batch_size'] = batch_size
+        if finish_workers is not None:
+            kwargs['finish_workers'] = finish_workers
+        future = self.submit(kwargs, on_event, on_result)
+        return future.result()
+
+    def submit(self, kwargs: Dict[str, Any], on_event=None, on_result=None) -> Future:
+        """
+        Queue one ``complete_analysis_batch`` call.
+
+        ``on_event(index, event)`` and ``on_result(index, result)`` are
+        called from the pool's manager thread as the worker reports them.
+
+        Returns:
+            A future resolved with the batch results, or with the worker's
+            error or a WorkerCrashedError
+        """
+        if not self._running:
+            raise RuntimeError("Worker pool is not running")
+        studies = len(kwargs['image_paths'])
+        job = _Job(next(self._job_ids), kwargs, Future(), on_event, on_result, studies=studies,
+                   results=[None] * studies)
+        with self._lock:
+            self._pending.append(job)
+            self.jobs_submitted += 1
+        self._wake()
+        return job.future
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    def health(self) -> Dict[str, Any]:
+        """Worker counts by state, for ping responses"""
+        states = [slot.state for slot in self._slots]
+        return {
+            'processes': len(states),
+            'ready': sum(state in ('idle', 'busy') for state in states),
+            'busy': states.count('busy'),
+            'queued': self.queue_depth
+        }
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """
+        The pipeline caches of the live workers, in ``get_cache_stats`` form.
+
+        Hit, miss and eviction counters are summed over the workers; sizes
+        and settings are those of the first worker reporting each cache.
+        """
+        merged: Dict[str, Any] = {}
+        for slot in self._slots:
+            for name, stats in slot.caches.items():
+                if merged.get(name) is None:
+                    merged[name] = dict(stats) if stats is not None else None
+                    continue
+                if stats is None:
+                    continue
+                for field in _SUMMED_CACHE_FIELDS:
+                    if field in stats:
+                        merged[name][field] = merged[name].get(field, 0) + stats[field]
+        return merged
+
+    def metrics_snapshots(self) -> List[Dict[str, Any]]:
+        """Metrics of every worker process, current and replaced, for merging into the parent's export"""
+        return [self._retired_metrics] + [slot.metrics for slot in self._slots]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.health(),
+            'uptime_seconds': round(time.time() - self.started_at, 1) if self.started_at else None,
+            'jobs_submitted': self.jobs_submitted,
+            'restarts': sum(slot.restarts for slot in self._slots),
+            'parent_memory': process_memory(os.getpid()),
+            'settings': {
+                'heartbeat_seconds': self.settings.heartbeat_seconds,
+                'heartbeat_timeout_seconds': self.settings.heartbeat_timeout_seconds,
+                'job_timeout_seconds': self.settings.job_timeout_seconds,
+                'share_memory': self.settings.share_memory
+            },
+            'workers': [slot.stats() for slot in self._slots]
+        }
+
+    def _spawn(self, slot: _WorkerSlot):
+        """Have the zygote fork a worker for ``slot``
+
+        Raises:
+            RuntimeError: If the zygote is gone
+        """
+        parent_conn, child_conn = self._context.Pipe()
+        try:
+            pid = self._zygote.spawn(slot.slot, self.settings.worker_runtime(self.runtime_config, slot.slot),
+                                     child_conn)
+        except RuntimeError:
+            parent_conn.close()
+            raise
+        finally:
+            child_conn.close()
+        slot.process, slot.conn, slot.pid = _ForkedWorker(pid, self._zygote), parent_conn, pid
+        slot.ready, slot.job = False, None
+        slot.started_at = slot.last_heartbeat = time.time()
+
+    def _wake(self):
+        try:
+            self._wakeup_writer.send_bytes(b'\0')
+        except OSError:
+            pass
+
+    @staticmethod
+    def _fail(job: _Job, error: Exception):
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    def _manage(self):
+        """Manager thread: dispatch jobs, collect messages and restart unhealthy workers"""
+        while self._running:
+            self._dispatch()
+            waitables = {self._wakeup_reader: None}
+            for slot in self._slots:
+                if slot.process is None:
+                    continue
+                waitables[slot.conn] = slot
+                if slot.process.sentinel is not None:
+                    waitables[slot.process.sentinel] = slot
+            for ready in wait(list(waitables), timeout=self.settings.heartbeat_seconds):
+                if ready is self._wakeup_reader:
+                    while self._wakeup_reader.poll():
+                        self._wakeup_reader.recv_bytes()
+                    continue
+                slot = waitables[ready]
+                if ready is slot.conn:
+                    try:
+                        while slot.conn.poll():
+                            self._handle_message(slot, slot.conn.recv())
+                    except (EOFError, OSError):
+                        pass
+            self._check_health()
+
+    def _dispatch(self):
+        with self._lock:
+            for slot in self._slots:
+                if not self._pending:
+                    return
+                if slot.state != 'idle':
+                    continue
+                job = self._pending.popleft()
+                try:
+                    slot.conn.send(('job', job.job_id, job.kwargs, job.on_event is not None, True))
+                except OSError:
+                    # The worker is gone; requeue and let the health check restart it
+                    self._pending.appendleft(job)
+                    continue
+                job.started_at = time.time()
+                slot.job = job
+
+    def _handle_message(self, slot: _WorkerSlot, message):
+        kind = message[0]
+        slot.last_heartbeat = time.time()
+        if kind == 'ready':
+            slot.pid, slot.runtime, slot.caches, slot.ready = message[1], message[2], message[3], True
+        elif kind == 'event':
+            _, job_id, index, event = message
+            job = slot.job
+            if job is not None and job.job_id == job_id and job.on_event is not None:
+                try:
+                    job.on_event(index, event)
+                except Exception as e:
+                    logger.error("Pool event callback failed: %s", e)
+        elif kind == 'study':
+            _, job_id, index, result = message
+            job = slot.job
+            if job is not None and job.job_id == job_id:
+                job.results[index] = result
+                if job.on_result is not None:
+                    try:
+                        job.on_result(index, result)
+                    except Exception as e:
+                        logger.error("Pool result callback failed: %s", e)
+        elif kind in ('result', 'error'):
+            _, job_id, payload, seconds, metrics, caches = message
+            slot.metrics, slot.caches = metrics, caches
+            job = slot.job
+            if job is None or job.job_id != job_id:
+                return
+            slot.job = None
+            slot.jobs += 1
+            slot.studies += job.studies
+            slot.busy_seconds += seconds
+            if kind == 'result':
+                if not job.future.done():
+                    job.future.set_result(job.results if payload is None else payload)
+            else:
+                slot.failures += 1
+                self._fail(job, RuntimeError(payload))
+
+    def _check_health(self):
+        now = time.time()
+        for slot in self._slots:
+            if slot.process is None:
+                # A restart failed earlier; try again
+                if self._running:
+                    self._restart(slot)
+                continue
+            reason = None
+            if not slot.process.is_alive():
+                reason = f"exited with code {slot.process.exitcode}"
+            elif slot.job is not None and now - slot.job.started_at > self.settings.job_timeout_seconds:
+                reason = f"exceeded the {self.settings.job_timeout_seconds:.0f}s job timeout"
+            elif now - slot.last_heartbeat > self.settings.heartbeat_timeout_seconds and slot.job is None:
+                reason = f"sent no heartbeat for {now - slot.last_heartbeat:.0f}s"
+            if reason is None or not self._running:
+                continue
+
+            logger.error("Pool worker %s (pid %s) %s; restarting it", slot.slot, slot.pid, reason)
+            slot.crashes += 1
+            if slot.process.is_alive():
+                slot.process.kill()
+            slot.process.join()
+            slot.conn.close()
+            if slot.job is not None:
+                slot.failures += 1
+                self._fail(slot.job, WorkerCrashedError(f"Worker {slot.slot} (pid {slot.pid}) {reason}"))
+            slot.restarts += 1
+            self._retired_metrics = merge_snapshots([self._retired_metrics, slot.metrics])
+            slot.metrics, slot.caches = {}, {}
+            self._restart(slot)
+
+    def _restart(self, slot: _WorkerSlot):
+        try:
+            self._spawn(slot)
+        except RuntimeError as e:
+            logger.error("Could not restart pool worker %s: %s", slot.slot, e)
+            slot.process = slot.conn = None
+            slot.ready = False
@@ -0,0 +1,9 @@
+"""
+Shared setup for the unit tests: the services are imported the way the
+entry points import them, with ``api/`` on sys.path
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,175 @@
+"""MicroBatchScheduler: batching window, batch size cap and per-caller results"""
+
+import time
+import asyncio
+
+import pytest
+
+from services.batch_scheduler import MicroBatchScheduler, SchedulerSettings
+
+
+class FakePipeline:
+    """Records the batches it is given; each study sleeps ``patient_info['delay']`` while finishing"""
+
+    def __init__(self):
+        self.batches = []
+
+    def prepare_analysis_batch(self, image_paths, xray_types, patient_infos, tta_views=None, on_event=None,
+                               heatmap_modes=None, request_ids=None):
+        self.batches.append(list(image_paths))
+
+        def finisher(image_path, patient_info):
+            def finish():
+                time.sleep(patient_info.get('delay', 0))
+                if patient_info.get('fail'):
+                    raise RuntimeError(f"{image_path} failed")
+                return {'success': True, 'image': image_path, 'tta_views': tta_views}
+            return finish
+        return [finisher(path, info) for path, info in zip(image_paths, patient_infos)]
+
+
+class FakePool:
+    """InferencePool stand-in: reports studies through ``on_result`` in reverse order"""
+
+    def __init__(self):
+        self.batches = []
+
+    def complete_analysis_batch(self, image_paths, on_result=None, **kwargs):
+        self.batches.append(list(image_paths))
+        results = [{'success': True, 'image': path} for path in image_paths]
+        for index in reversed(range(len(results))):
+            on_result(index, results[index])
+        return results
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def _submit_all(scheduler, names, patient_infos=None, tta_views=None):
+    patient_infos = patient_infos or [{}] * len(names)
+    try:
+        return await asyncio.gather(*(
+            scheduler.submit(name, patient_info=info, tta_views=tta_views[i] if tta_views else None)
+            for i, (name, info) in enumerate(zip(names, patient_infos))
+        ), return_exceptions=True)
+    finally:
+        await scheduler.stop()
+
+
+def test_requests_inside_the_window_share_one_batch():
+    pipeline = FakePipeline()
+    scheduler = MicroBatchScheduler(pipeline, SchedulerSettings(window_ms=100, max_batch_size=8))
+    results = run(_submit_all(scheduler, ['a', 'b', 'c']))
+
+    assert pipeline.batches == [['a', 'b', 'c']]
+    assert [r['image'] for r in results] == ['a', 'b', 'c']
+    assert scheduler.metrics()['batch_size_counts'] == {3: 1}
+
+
+def test_requests_after_the_window_get_a_new_batch():
+    pipeline = FakePipeline()
+    scheduler = MicroBatchScheduler(pipeline, SchedulerSettings(window_ms=20, max_batch_size=8))
+
+    async def staggered():
+        first = asyncio.ensure_future(scheduler.submit('a'))
+        await asyncio.sleep(0.2)
+        second = await scheduler.submit('b')
+        results = [await first, second]
+        await scheduler.stop()
+        return results
+
+    results = run(staggered())
+    assert pipeline.batches == [['a'], ['b']]
+    assert [r['image'] for r in results] == ['a', 'b']
+
+
+def test_max_batch_size_closes_the_batch_early():
+    pipeline = FakePipeline()
+    scheduler = MicroBatchScheduler(pipeline, SchedulerSettings(window_ms=5000, max_batch_size=2))
+    started = time.perf_counter()
+    run(_submit_all(scheduler, ['a', 'b', 'c', 'd']))
+
+    assert pipeline.batches == [['a', 'b'], ['c', 'd']]
+    # Full batches do not wait for the window
+    assert time.perf_counter() - started < 2.0
+
+
+def test_each_caller_gets_its_own_result_without_waiting_for_batch_mates():
+    pipeline = FakePipeline()
+    scheduler = MicroBatchScheduler(pipeline, SchedulerSettings(window_ms=50, max_batch_size=8))
+    resolved = {}
+
+    async def timed_submit(name, delay):
+        started = time.perf_counter()
+        result = await scheduler.submit(name, patient_info={'delay': delay})
+        resolved[name] = time.perf_counter() - started
+        return result
+
+    async def main():
+        results = await asyncio.gather(timed_submit('slow', 1.0), timed_submit('fast', 0.0))
+        await scheduler.stop()
+        return results
+
+    results = run(main())
+    assert pipeline.batches == [['slow', 'fast']]
+    assert [r['image'] for r in results] == ['slow', 'fast']
+    assert resolved['fast'] < 0.5 <= resolved['slow']
+
+
+def test_a_failed_study_only_fails_its_own_caller():
+    pipeline = FakePipeline()
+    scheduler = MicroBatchScheduler(pipeline, SchedulerSettings(window_ms=50))
+    results = run(_submit_all(scheduler, ['a', 'b'], [{'fail': True}, {}]))
+
+    assert isinstance(results[0], RuntimeError)
+    assert results[1]['image'] == 'b'
+
+
+def test_mixed_tta_views_run_as_separate_groups():
+    pipeline = FakePipeline()
+    scheduler = MicroBatchScheduler(pipeline, SchedulerSettings(window_ms=50))
+    results = run(_submit_all(scheduler, ['a', 'b', 'c'], tta_views=[None, 2, None]))
+
+    assert sorted(pipeline.batches) == [['a', 'c'], ['b']]
+    assert [r['tta_views'] for r in results] == [None, 2, None]
+
+
+def test_pool_results_reach_the_right_callers():
+    pool = FakePool()
+    scheduler = MicroBatchScheduler(pool, SchedulerSettings(window_ms=50))
+    results = run(_submit_all(scheduler, ['a', 'b', 'c']))
+
+    assert pool.batches == [['a', 'b', 'c']]
+    assert [r['image'] for r in results] == ['a', 'b', 'c']
+
+
+def test_requests_over_the_queue_depth_are_rejected():
+    import threading
+    from services.batch_scheduler import QueueFullError
+
+    release = threading.Event()
+
+    class BlockedPipeline(FakePipeline):
+        def prepare_analysis_batch(self, *args, **kwargs):
+            release.wait(5)
+            return super().prepare_analysis_batch(*args, **kwargs)
+
+    scheduler = MicroBatchScheduler(BlockedPipeline(), SchedulerSettings(window_ms=0, max_batch_size=1,
+                                                                         max_queue_depth=1))
+
+    async def main():
+        # 'a' is taken off the queue and held in the model forward; 'b' fills the queue
+        first = asyncio.ensure_future(scheduler.submit('a'))
+        await asyncio.sleep(0.1)
+        second = asyncio.ensure_future(scheduler.submit('b'))
+        await asyncio.sleep(0.1)
+        with pytest.raises(QueueFullError):
+            await scheduler.submit('c')
+        release.set()
+        results = [await first, await second]
+        await scheduler.stop()
+        return results
+
+    assert [r['image'] for r in run(main())] == ['a', 'b']
+    assert scheduler.rejected_total == 1
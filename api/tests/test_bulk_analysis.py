@@ -0,0 +1,134 @@
+"""Bulk analysis: manifest parsing, journal repair and resume, and Ctrl-C handling"""
+
+import json
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from bulk_analysis import BulkItem, BulkRunner, ProgressReporter, ResultsJournal, read_manifest
+
+
+def write_lines(path, entries):
+    path.write_text(''.join(json.dumps(entry) + '\n' for entry in entries))
+
+
+def read_lines(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_csv_manifest(tmp_path):
+    manifest = tmp_path / 'studies.csv'
+    manifest.write_text(
+        'id,image_path,xray_type,frame,patient_info\n'
+        'p1,images/a.png,,,\n'
+        ',/data/b.dcm,bone,2,"{""age"": 40}"\n'
+    )
+    first, second = read_manifest(str(manifest))
+
+    assert first == BulkItem(id='p1', image_path=str(tmp_path / 'images' / 'a.png'))
+    assert second.id == '/data/b.dcm#2'
+    assert (second.image_path, second.xray_type, second.frame) == ('/data/b.dcm', 'bone', 2)
+    assert second.patient_info == {'age': 40}
+
+
+def test_jsonl_manifest(tmp_path):
+    manifest = tmp_path / 'studies.jsonl'
+    manifest.write_text(
+        json.dumps({'path': 'a.png', 'patient_info': {'sex': 'F'}}) + '\n'
+        '\n'
+        + json.dumps({'id': 7, 'image_path': 'b.png', 'xray_type': 'dental'}) + '\n'
+    )
+    first, second = read_manifest(str(manifest), xray_type='bone')
+
+    assert (first.id, first.xray_type, first.patient_info) == (str(tmp_path / 'a.png'), 'bone', {'sex': 'F'})
+    assert (second.id, second.xray_type) == ('7', 'dental')
+
+
+@pytest.mark.parametrize('name, content', [
+    ('missing.csv', 'id,image_path\np1,\n'),
+    ('missing.jsonl', '{"id": "p1"}\n'),
+    ('not_an_object.jsonl', '["a.png"]\n'),
+])
+def test_bad_manifest_rows_raise_value_error(tmp_path, name, content):
+    manifest = tmp_path / name
+    manifest.write_text(content)
+    with pytest.raises(ValueError):
+        list(read_manifest(str(manifest)))
+
+
+def test_journal_drops_an_incomplete_last_line(tmp_path):
+    path = tmp_path / 'results.jsonl'
+    path.write_text(json.dumps({'id': 'a', 'success': True}) + '\n{"id": "b", "succ')
+
+    journal = ResultsJournal(str(path))
+    assert journal.completed == {'a'}
+    journal.write(BulkItem(id='c', image_path='c.png'), {'success': True})
+    journal.close()
+
+    assert [entry['id'] for entry in read_lines(path)] == ['a', 'c']
+
+
+def test_journal_resume_skips_finished_studies(tmp_path):
+    path = tmp_path / 'results.jsonl'
+    write_lines(path, [{'id': 'a', 'success': True}, {'id': 'b', 'success': False}])
+
+    journal = ResultsJournal(str(path))
+    assert journal.completed == {'a', 'b'}
+    assert journal.failed_before == 1
+    journal.close()
+
+    retrying = ResultsJournal(str(path), retry_failed=True)
+    assert retrying.completed == {'a'}
+    retrying.close()
+
+
+def test_journal_counts_failures_by_final_status(tmp_path):
+    path = tmp_path / 'results.jsonl'
+    write_lines(path, [
+        {'id': 'a', 'success': False},
+        {'id': 'b', 'success': False},
+        {'id': 'a', 'success': True},  # Fixed by a --retry-failed run
+    ])
+
+    journal = ResultsJournal(str(path), retry_failed=True)
+    assert journal.completed == {'a'}
+    assert journal.failed_before == 1
+    journal.close()
+
+
+class InterruptedPool:
+    """Pool stand-in whose first batch is interrupted while the second one has already finished"""
+
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, kwargs):
+        self.submitted += 1
+        future = Future()
+        if self.submitted == 1:
+            future.set_exception(KeyboardInterrupt())
+        else:
+            future.set_result([{'success': True} for _ in kwargs['image_paths']])
+        return future
+
+
+def test_interrupted_run_journals_finished_batches(tmp_path):
+    items = []
+    for index in range(4):
+        image_path = tmp_path / f'{index}.png'
+        Image.fromarray(np.full((16, 16), 40 * index, dtype=np.uint8)).save(image_path)
+        items.append(BulkItem(id=f's{index}', image_path=str(image_path)))
+    path = tmp_path / 'results.jsonl'
+    journal = ResultsJournal(str(path))
+    runner = BulkRunner(None, journal, batch_size=2, prefetch=4, max_in_flight=2, pool=InterruptedPool())
+
+    with pytest.raises(KeyboardInterrupt):
+        runner.run(items, ProgressReporter(len(items)))
+    journal.close()
+
+    assert [entry['id'] for entry in read_lines(path)] == ['s2', 's3']
+    resumed = ResultsJournal(str(path))
+    assert resumed.completed == {'s2', 's3'}
+    resumed.close()
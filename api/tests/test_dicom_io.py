@@ -0,0 +1,123 @@
+"""dicom_io: header-only parsing and single-frame decoding of pydicom's bundled test files"""
+
+import io
+
+import numpy as np
+import pytest
+
+pydicom = pytest.importorskip('pydicom')
+from pydicom.data import get_testdata_file  # noqa: E402
+
+from services.dicom_io import decode_dicom, is_dicom, is_dicom_path, read_dicom_header  # noqa: E402
+
+CT_SMALL = get_testdata_file('CT_small.dcm')  # 128x128 MONOCHROME2, no window
+MR_SMALL = get_testdata_file('MR_small.dcm')  # 64x64 with a window
+RT_DOSE = get_testdata_file('rtdose.dcm')  # 10x10, 15 frames
+RGB = get_testdata_file('examples_rgb_color.dcm')  # 240x320 RGB
+
+
+def reference_uint8(stored: np.ndarray, ds) -> np.ndarray:
+    """Full-resolution rescale and min/max stretch, for comparing against the in-place decode"""
+    values = stored.astype(np.float64) * float(ds.get('RescaleSlope', 1)) + float(ds.get('RescaleIntercept', 0))
+    values = (values - values.min()) / ((values.max() - values.min()) or 1.0)
+    return (values * 255 + 0.5).astype(np.uint8)
+
+
+def with_photometric(path: str, photometric: str) -> bytes:
+    ds = pydicom.dcmread(path)
+    ds.PhotometricInterpretation = photometric
+    buffer = io.BytesIO()
+    ds.save_as(buffer)
+    return buffer.getvalue()
+
+
+def test_dicom_detection(tmp_path):
+    with open(CT_SMALL, 'rb') as f:
+        assert is_dicom(f.read())
+    assert not is_dicom(b'\x89PNG\r\n\x1a\n' + b'\0' * 200)
+
+    renamed = tmp_path / 'study.bin'
+    renamed.write_bytes(open(CT_SMALL, 'rb').read())
+    assert is_dicom_path(str(renamed))
+    assert is_dicom_path(str(tmp_path / 'missing.dcm'))  # By extension alone
+    assert not is_dicom_path(str(tmp_path / 'missing.png'))
+
+
+def test_header_is_read_without_pixel_data():
+    header = read_dicom_header(CT_SMALL)
+    assert (header.rows, header.columns, header.frames) == (128, 128, 1)
+    assert header.photometric == 'MONOCHROME2'
+    assert header.modality == 'CT'
+    assert header.window_width is None
+    assert 'PixelData' not in header.dataset
+
+    with open(MR_SMALL, 'rb') as f:
+        mr = read_dicom_header(f.read())
+    assert (mr.rows, mr.columns) == (64, 64)
+    assert mr.window_width == 1600.0
+    assert mr.window_center is not None
+
+
+def test_header_counts_frames():
+    assert read_dicom_header(RT_DOSE).frames == 15
+
+
+def test_non_dicom_input_raises_value_error():
+    with pytest.raises(ValueError):
+        read_dicom_header(b'not a dicom file')
+
+
+def test_decode_matches_a_full_resolution_reference():
+    ds = pydicom.dcmread(CT_SMALL)
+    pixels = decode_dicom(CT_SMALL)
+    assert pixels.shape == (128, 128)
+    assert pixels.dtype == np.uint8
+    assert np.abs(pixels.astype(int) - reference_uint8(ds.pixel_array, ds)).max() <= 1
+
+
+def test_decode_applies_the_window():
+    pixels = decode_dicom(MR_SMALL)
+    assert pixels.shape == (64, 64)
+    ds = pydicom.dcmread(MR_SMALL)
+    center, width = float(ds.WindowCenter), float(ds.WindowWidth)
+    expected = np.clip((ds.pixel_array - (center - 0.5)) / (width - 1) + 0.5, 0, 1) * 255 + 0.5
+    assert np.abs(pixels.astype(int) - expected.astype(np.uint8)).max() <= 1
+
+
+def test_window_width_without_center_falls_back_to_min_max():
+    ds = pydicom.dcmread(MR_SMALL)
+    del ds.WindowCenter
+    buffer = io.BytesIO()
+    ds.save_as(buffer)
+
+    assert read_dicom_header(buffer.getvalue()).window_width is None
+    pixels = decode_dicom(buffer.getvalue())
+    assert np.abs(pixels.astype(int) - reference_uint8(ds.pixel_array, ds)).max() <= 1
+
+
+def test_decode_downsamples_to_the_target_size():
+    pixels = decode_dicom(CT_SMALL, target_size=64)
+    assert pixels.shape == (64, 64)
+    # A target larger than the image never upsamples
+    assert decode_dicom(CT_SMALL, target_size=512).shape == (128, 128)
+
+
+def test_decode_reads_the_requested_frame():
+    ds = pydicom.dcmread(RT_DOSE)
+    frame = decode_dicom(RT_DOSE, frame=3)
+    assert frame.shape == (10, 10)
+    assert np.abs(frame.astype(int) - reference_uint8(ds.pixel_array[3], ds)).max() <= 1
+    with pytest.raises(ValueError):
+        decode_dicom(RT_DOSE, frame=15)
+
+
+def test_monochrome1_is_inverted():
+    normal = decode_dicom(CT_SMALL)
+    inverted = decode_dicom(with_photometric(CT_SMALL, 'MONOCHROME1'))
+    assert np.abs(inverted.astype(int) - (255 - normal.astype(int))).max() <= 1
+
+
+def test_color_files_decode_to_rgb():
+    pixels = decode_dicom(RGB)
+    assert pixels.shape == (240, 320, 3)
+    assert pixels.dtype == np.uint8
@@ -0,0 +1,50 @@
+"""Heatmaps: Grad-CAM grids from MONAI-layout tensors line up with the X-ray they are drawn over"""
+
+import base64
+
+import cv2
+import numpy as np
+
+from medical_ai_pipeline import MedicalAIPipeline
+from services.image_io import to_monai_layout
+
+
+def make_pipeline():
+    """Just the state the heatmap stages read, without loading any model"""
+    pipeline = MedicalAIPipeline.__new__(MedicalAIPipeline)
+    pipeline.monai_transforms = object()  # Tensors come from the MONAI chain, (C, W, H)
+    pipeline.heatmap_grid_size = 32
+    return pipeline
+
+
+def decode_data_uri(uri):
+    return cv2.imdecode(np.frombuffer(base64.b64decode(uri.split(',', 1)[1]), np.uint8), cv2.IMREAD_COLOR)
+
+
+def test_grad_cam_hot_spot_lands_where_it_is_in_the_image(tmp_path):
+    # Wide study (H=100, W=200); the model sees it resized to 224x224 in MONAI's layout
+    image = np.zeros((100, 200), np.uint8)
+    path = tmp_path / 'wide.png'
+    cv2.imwrite(str(path), image)
+    tensor = to_monai_layout(cv2.resize(image, (224, 224)))
+
+    # Grad-CAM is computed on that tensor, so its map is (W, H) too: hot spot at the top-right
+    cam = np.zeros((7, 7), np.float32)
+    cam[6, 0] = 1.0
+
+    pipeline = make_pipeline()
+    result = pipeline.generate_heatmap(tensor, {'primary_diagnosis': 'Pneumonia'}, cam, mode='compact')
+    grid = result['grid']
+    assert grid['kind'] == 'grad_cam'
+    values = np.frombuffer(base64.b64decode(grid['data']), np.uint8).reshape(grid['shape'])
+    assert values[0, 6] == 255 and values[6, 0] == 0
+
+    rendered = decode_data_uri(pipeline.render_heatmap(grid, image_path=str(path)))
+    assert rendered.shape[:2] == (100, 200)
+    # JET: hot is red, cold is blue (BGR)
+    top_right, bottom_left = rendered[5, 195].astype(int), rendered[95, 5].astype(int)
+    assert top_right[2] > top_right[0]
+    assert bottom_left[0] > bottom_left[2]
+
+    # Without a base image the output keeps the grid's (H, W) orientation
+    assert decode_data_uri(pipeline.render_heatmap(grid, size=70)).shape[:2] == (70, 70)
@@ -0,0 +1,94 @@
+"""image_io: palette images, reduced decodes and the pixel limit, OpenCV-only formats included"""
+
+import io
+import os
+import subprocess
+import sys
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from services import image_io
+from services.image_io import ImageTooLargeError, decode_image, read_grayscale
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def encode(image, fmt='PNG'):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def test_palette_images_are_expanded_and_downsampled():
+    gray = Image.fromarray(np.tile(np.arange(0, 256, 4, dtype=np.uint8), (64, 4)))  # 64x256
+    decoded = decode_image(encode(gray.convert('P')), target_size=32)
+    assert decoded.dtype == np.uint8 and decoded.shape == (32, 128)
+
+    color = Image.new('RGB', (200, 100), (200, 40, 10)).convert('P', palette=Image.ADAPTIVE)
+    decoded = decode_image(encode(color), target_size=50)
+    assert decoded.shape == (50, 100, 3)
+    assert tuple(decoded[0, 0]) == (200, 40, 10)
+
+
+def test_pixel_limit(tmp_path):
+    data = encode(Image.new('L', (300, 200)))
+    with pytest.raises(ImageTooLargeError):
+        decode_image(data, max_pixels=50_000)
+    assert decode_image(data, max_pixels=60_000).shape == (200, 300)
+
+    path = tmp_path / 'study.png'
+    path.write_bytes(data)
+    with pytest.raises(ImageTooLargeError):
+        read_grayscale(str(path), max_pixels=50_000)
+    assert read_grayscale(str(path), target_size=100).shape == (100, 150)
+
+
+def radiance_hdr(width, height):
+    """Encoded Radiance HDR, a format OpenCV reads and PIL does not"""
+    return cv2.imencode('.hdr', np.full((height, width, 3), 0.5, np.float32))[1].tobytes()
+
+
+def test_opencv_only_formats_are_refused_while_its_cap_is_above_the_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_io, 'OPENCV_MAX_PIXELS', 1 << 30)  # cv2 was imported first
+    data = radiance_hdr(60, 40)
+    with pytest.raises(ImageTooLargeError, match='OPENCV_IO_MAX_IMAGE_PIXELS'):
+        decode_image(data)
+    assert decode_image(data, max_pixels=0).shape == (40, 60, 3)
+
+    path = tmp_path / 'study.hdr'
+    path.write_bytes(data)
+    with pytest.raises(ImageTooLargeError):
+        read_grayscale(str(path))
+    assert read_grayscale(str(path), max_pixels=0).shape == (40, 60)
+    # Files OpenCV cannot read either are still just unreadable
+    assert read_grayscale(str(tmp_path / 'missing.hdr')) is None
+    with pytest.raises(ValueError, match='Could not decode'):
+        decode_image(b'not an image', max_pixels=0)
+
+
+def test_opencv_decodes_within_the_limit_when_imported_after_image_io(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_io, 'OPENCV_MAX_PIXELS', 5_000)
+    data = radiance_hdr(60, 40)
+    assert decode_image(data, max_pixels=5_000).shape == (40, 60, 3)
+
+    # A fresh process: image_io sets OpenCV's own cap, so the oversized image is never allocated
+    path = tmp_path / 'large.hdr'
+    path.write_bytes(radiance_hdr(100, 100))
+    script = (
+        "import sys\n"
+        "from services.image_io import OPENCV_MAX_PIXELS, ImageTooLargeError, decode_image, read_grayscale\n"
+        "assert OPENCV_MAX_PIXELS == 5000, OPENCV_MAX_PIXELS\n"
+        "data = open(sys.argv[1], 'rb').read()\n"
+        "for decode in (lambda: decode_image(data), lambda: read_grayscale(sys.argv[1])):\n"
+        "    try:\n"
+        "        decode()\n"
+        "    except ImageTooLargeError:\n"
+        "        continue\n"
+        "    raise SystemExit('decoded past the limit')\n"
+    )
+    env = dict(os.environ, XRAY_AI_MAX_PIXELS='5000')
+    env.pop('OPENCV_IO_MAX_IMAGE_PIXELS', None)
+    subprocess.run([sys.executable, '-c', script, str(path)], cwd=API_DIR, env=env, check=True)
@@ -0,0 +1,149 @@
+"""OpenRouterClient against a local stub server: retries, timeouts and truncated streams"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip('requests')
+from services import llm_client  # noqa: E402
+from services.llm_client import LLMRequestError, OpenRouterClient  # noqa: E402
+
+MESSAGES = [{'role': 'user', 'content': 'Report'}]
+
+
+def completion(content):
+    return json.dumps({'choices': [{'message': {'content': content}}]})
+
+
+def sse(*events):
+    return ''.join(f"data: {event}\n\n" for event in events)
+
+
+class StubServer:
+    """Answers each POST with the next scripted (status, headers, body, delay) reply"""
+
+    def __init__(self):
+        self.replies = []
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                stub.requests.append((self.path, self.headers.get('Authorization'), json.loads(body)))
+                status, headers, payload, delay = stub.replies.pop(0)
+                threading.Event().wait(delay)  # time.sleep is patched by the sleeps fixture
+                try:
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.end_headers()
+                    self.wfile.write(payload.encode('utf-8'))
+                except OSError:
+                    pass  # The client gave up on a delayed reply
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/api/v1"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def reply(self, status=200, body='', headers=None, delay=0.0):
+        self.replies.append((status, headers or {'Content-Type': 'application/json'}, body, delay))
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = StubServer()
+    monkeypatch.setenv('OPENROUTER_BASE_URL', server.url)
+    monkeypatch.setenv('XRAY_AI_LLM_TIMEOUT', '0.5')
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Backoff delays the client asked for, without waiting for them"""
+    delays = []
+    monkeypatch.setattr(llm_client.time, 'sleep', delays.append)
+    return delays
+
+
+def test_retries_429_and_5xx_honouring_retry_after(stub, sleeps):
+    stub.reply(429, 'slow down', {'Retry-After': '3'})
+    stub.reply(503, 'unavailable')
+    stub.reply(200, completion('Normal chest'))
+
+    client = OpenRouterClient.from_env()
+    assert client.chat_completion(MESSAGES, api_key='key') == 'Normal chest'
+
+    assert len(stub.requests) == 3
+    path, authorization, payload = stub.requests[0]
+    assert (path, authorization) == ('/api/v1/chat/completions', 'Bearer key')
+    assert payload['messages'] == MESSAGES
+    assert sleeps[0] == 3.0  # Retry-After
+    assert 0.0 <= sleeps[1] <= client.backoff_base * 2  # Jittered backoff
+
+
+def test_gives_up_once_retries_are_exhausted(stub, sleeps, monkeypatch):
+    monkeypatch.setenv('XRAY_AI_LLM_MAX_RETRIES', '1')
+    stub.reply(502, 'bad gateway')
+    stub.reply(502, 'bad gateway')
+
+    with pytest.raises(LLMRequestError) as error:
+        OpenRouterClient.from_env().chat_completion(MESSAGES, api_key='key')
+    assert error.value.status_code == 502
+    assert len(stub.requests) == 2
+
+
+def test_client_errors_are_not_retried(stub, sleeps):
+    stub.reply(401, 'invalid key')
+
+    with pytest.raises(LLMRequestError) as error:
+        OpenRouterClient.from_env().chat_completion(MESSAGES, api_key='bad')
+    assert error.value.status_code == 401
+    assert len(stub.requests) == 1
+    assert sleeps == []
+
+
+def test_timeouts_are_retried_then_reported(stub, sleeps, monkeypatch):
+    monkeypatch.setenv('XRAY_AI_LLM_TIMEOUT', '0.2')
+    stub.reply(200, completion('late'), delay=1.0)
+    stub.reply(200, completion('on time'))
+    assert OpenRouterClient.from_env().chat_completion(MESSAGES, api_key='key') == 'on time'
+
+    monkeypatch.setenv('XRAY_AI_LLM_MAX_RETRIES', '0')
+    stub.reply(200, completion('late'), delay=1.0)
+    with pytest.raises(LLMRequestError) as error:
+        OpenRouterClient.from_env().chat_completion(MESSAGES, api_key='key')
+    assert error.value.timed_out
+
+
+def test_stream_yields_deltas_until_done(stub):
+    chunk = json.dumps({'choices': [{'delta': {'content': 'Normal '}}]})
+    stub.reply(200, ': keep-alive\n\n' + sse(chunk, chunk.replace('Normal ', 'chest'), '[DONE]'),
+               {'Content-Type': 'text/event-stream'})
+
+    deltas = list(OpenRouterClient.from_env().stream_chat_completion(MESSAGES, api_key='key'))
+    assert deltas == ['Normal ', 'chest']
+    assert stub.requests[0][2]['stream'] is True
+
+
+def test_stream_cut_off_before_done_is_an_error(stub):
+    chunk = json.dumps({'choices': [{'delta': {'content': 'Findings: '}}]})
+    stub.reply(200, sse(chunk), {'Content-Type': 'text/event-stream'})  # Connection closes, no [DONE]
+
+    deltas = []
+    with pytest.raises(LLMRequestError, match='truncated'):
+        for delta in OpenRouterClient.from_env().stream_chat_completion(MESSAGES, api_key='key'):
+            deltas.append(delta)
+    assert deltas == ['Findings: ']
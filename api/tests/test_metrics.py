@@ -0,0 +1,104 @@
+"""Metrics registry: Prometheus text exposition and merging worker snapshots"""
+
+import pytest
+
+from services.metrics import MetricsRegistry, StudyTimings, merge_snapshots, render_prometheus
+
+
+def test_counter_exposition():
+    registry = MetricsRegistry()
+    fallbacks = registry.counter('fallbacks_total', 'Fallbacks by kind', ('kind',))
+    fallbacks.inc(kind='report')
+    fallbacks.inc(2, kind='report')
+    fallbacks.inc(kind='cv_analysis')
+
+    assert registry.render_prometheus() == (
+        '# HELP fallbacks_total Fallbacks by kind\n'
+        '# TYPE fallbacks_total counter\n'
+        'fallbacks_total{kind="cv_analysis"} 1\n'
+        'fallbacks_total{kind="report"} 3\n'
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram('stage_seconds', 'Stage time', ('stage',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value, stage='clip')
+
+    assert registry.render_prometheus().splitlines() == [
+        '# HELP stage_seconds Stage time',
+        '# TYPE stage_seconds histogram',
+        'stage_seconds_bucket{stage="clip",le="0.1"} 1',
+        'stage_seconds_bucket{stage="clip",le="1"} 2',
+        'stage_seconds_bucket{stage="clip",le="+Inf"} 3',
+        'stage_seconds_sum{stage="clip"} 5.55',
+        'stage_seconds_count{stage="clip"} 3',
+    ]
+
+
+def test_unlabelled_metrics_and_label_escaping():
+    registry = MetricsRegistry()
+    registry.counter('plain_total', 'No labels').inc()
+    registry.counter('odd_total', 'Odd labels', ('value',)).inc(value='a "quoted"\\path\nline')
+
+    text = registry.render_prometheus()
+    assert 'plain_total 1\n' in text
+    assert 'odd_total{value="a \\"quoted\\"\\\\path\\nline"} 1\n' in text
+
+
+def test_metrics_are_rendered_in_name_order():
+    registry = MetricsRegistry()
+    registry.counter('b_total', 'B').inc()
+    registry.counter('a_total', 'A').inc()
+    names = [line.split()[2] for line in registry.render_prometheus().splitlines() if line.startswith('# TYPE')]
+    assert names == ['a_total', 'b_total']
+
+
+def test_worker_snapshots_are_summed_into_the_export():
+    parent, worker = MetricsRegistry(), MetricsRegistry()
+    for registry, outcome in ((parent, 'success'), (worker, 'success'), (worker, 'error')):
+        registry.counter('analyses_total', 'Studies', ('outcome',)).inc(outcome=outcome)
+        registry.histogram('analysis_seconds', 'Time', (), buckets=(1.0,)).observe(0.5)
+
+    text = parent.render_prometheus([worker.snapshot()])
+    assert 'analyses_total{outcome="success"} 2\n' in text
+    assert 'analyses_total{outcome="error"} 1\n' in text
+    assert 'analysis_seconds_bucket{le="1"} 3\n' in text
+    assert 'analysis_seconds_count 3\n' in text
+
+    # Merging copies, so the inputs are left as they were
+    merge_snapshots([parent.snapshot(), worker.snapshot()])
+    assert worker.snapshot()['analysis_seconds']['samples'][()]['count'] == 2
+
+
+def test_render_of_an_empty_snapshot():
+    assert render_prometheus({}) == '\n'
+
+
+def test_wrong_labels_are_rejected():
+    registry = MetricsRegistry()
+    counter = registry.counter('labelled_total', 'Labelled', ('kind',))
+    with pytest.raises(ValueError):
+        counter.inc(stage='x')
+    with pytest.raises(ValueError):
+        registry.histogram('labelled_total', 'Same name, other type', ('kind',))
+    assert registry.counter('labelled_total', 'Registered again', ('kind',)) is counter
+
+
+def test_reset_zeroes_every_metric():
+    registry = MetricsRegistry()
+    registry.counter('reset_total', 'Reset').inc()
+    registry.reset()
+    assert registry.render_prometheus() == '# HELP reset_total Reset\n# TYPE reset_total counter\n'
+
+
+def test_study_timings_report_milliseconds():
+    timings = StudyTimings(started=0.0)
+    timings.add('clip', 0.25)
+    timings.add('clip', 0.25)
+    timings.batch_size = 4
+    result = timings.as_dict()
+    assert result['clip_ms'] == 500.0
+    assert result['batch_size'] == 4
+    assert 'total_ms' in result
@@ -0,0 +1,104 @@
+"""ClipModelRegistry with a stubbed open_clip: preference order, fallback and load-once"""
+
+import pytest
+
+from services.model_registry import DEFAULT_CLIP_SPECS, ClipModelRegistry, ClipModelSpec
+
+BIOMEDCLIP, VIT_B_32 = (spec.model_id for spec in DEFAULT_CLIP_SPECS)
+
+
+class FakeModel:
+    def __init__(self, model_id):
+        self.model_id = model_id
+        self.device = None
+
+    def eval(self):
+        return self
+
+    def to(self, device):
+        self.device = device
+        return self
+
+    def parameters(self):
+        return []
+
+    def buffers(self):
+        return []
+
+
+class FakeOpenClip:
+    """Stands in for the open_clip module; variants in ``broken`` fail to load"""
+
+    def __init__(self, broken=()):
+        self.broken = set(broken)
+        self.loads = []
+
+    def create_model_and_transforms(self, model_id, pretrained=None):
+        self.loads.append((model_id, pretrained))
+        if model_id in self.broken:
+            raise RuntimeError(f"cannot download {model_id}")
+        return FakeModel(model_id), None, lambda image: image
+
+    def get_tokenizer(self, model_id):
+        return lambda texts: texts
+
+
+def test_preferred_variant_wins_and_loads_once():
+    open_clip = FakeOpenClip()
+    registry = ClipModelRegistry(open_clip, 'cpu')
+
+    entry = registry.resolve()
+    assert entry.spec.model_id == BIOMEDCLIP
+    assert entry.model.device == 'cpu'
+    assert registry.resolve() is entry
+    assert registry.get(BIOMEDCLIP) is entry
+    assert open_clip.loads == [(BIOMEDCLIP, None)]
+    assert registry.winner == BIOMEDCLIP
+    assert registry.version == f"{BIOMEDCLIP}|"
+
+
+def test_falls_back_to_the_next_variant_and_remembers_the_failure():
+    open_clip = FakeOpenClip(broken={BIOMEDCLIP})
+    registry = ClipModelRegistry(open_clip, 'cpu')
+
+    entry = registry.resolve()
+    assert entry.spec.model_id == VIT_B_32
+    assert registry.version == f"{VIT_B_32}|laion2b_s34b_b79k"
+    assert open_clip.loads == [(BIOMEDCLIP, None), (VIT_B_32, 'laion2b_s34b_b79k')]
+
+    # A failed variant is not retried on later requests
+    assert registry.get(BIOMEDCLIP) is None
+    assert len(open_clip.loads) == 2
+    stats = registry.stats()
+    assert stats['winner'] == VIT_B_32
+    assert 'cannot download' in stats['failed'][BIOMEDCLIP]
+    assert list(stats['loaded']) == [VIT_B_32]
+
+
+def test_no_loadable_variant_resolves_to_none():
+    # The pipeline then keeps MedCLIP, if it loaded, or falls back to CV analysis
+    open_clip = FakeOpenClip(broken={BIOMEDCLIP, VIT_B_32})
+    registry = ClipModelRegistry(open_clip, 'cpu')
+
+    assert registry.resolve() is None
+    assert registry.resolve() is None
+    assert len(open_clip.loads) == 2
+    assert registry.winner is None and registry.version is None
+    assert registry.loaded_entries() == []
+
+
+def test_custom_specs_and_unknown_variants():
+    spec = ClipModelSpec(model_id='RN50', display_name='RN50', pretrained='openai', tokenizer_id='RN50-tok')
+    registry = ClipModelRegistry(FakeOpenClip(), 'cpu', specs=[spec])
+    assert registry.resolve().spec is spec
+    with pytest.raises(KeyError):
+        registry.get(BIOMEDCLIP)
+
+
+def test_quantization_is_cpu_only():
+    class Device:
+        type = 'cuda'
+
+    assert not ClipModelRegistry(FakeOpenClip(), Device(), quantize=True).quantize
+    with pytest.raises(RuntimeError):
+        ClipModelRegistry(FakeOpenClip(), Device()).quantize_loaded()
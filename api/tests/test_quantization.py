@@ -0,0 +1,85 @@
+"""Int8 quantization: XRAY_AI_QUANTIZE parsing, dynamic and static accuracy, and the fp32 fallback"""
+
+import pytest
+
+torch = pytest.importorskip('torch')
+from services.quantization import (  # noqa: E402
+    parse_quantize_setting, quantize_densenet, quantize_dynamic_int8, quantize_static_int8,
+    serialized_size_bytes, synthetic_calibration_images
+)
+
+
+def relative_error(actual, expected):
+    return float((actual - expected).norm() / expected.norm())
+
+
+def test_parse_quantize_setting():
+    assert parse_quantize_setting('') == set()
+    assert parse_quantize_setting('none') == set()
+    assert parse_quantize_setting(' CLIP , densenet ') == {'clip', 'densenet'}
+    assert parse_quantize_setting('all') == {'clip', 'densenet'}
+    with pytest.raises(ValueError, match='resnet'):
+        parse_quantize_setting('clip,resnet')
+
+
+def test_dynamic_int8_keeps_outputs_within_tolerance():
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Linear(64, 256), torch.nn.GELU(), torch.nn.Linear(256, 32)).eval()
+    inputs = torch.randn(16, 64)
+    with torch.no_grad():
+        expected = model(inputs)
+        actual = quantize_dynamic_int8(model)(inputs)
+
+    assert relative_error(actual, expected) < 0.05
+    # The fp32 model is left as it was, and the int8 copy is smaller
+    assert type(model[0]) is torch.nn.Linear
+    assert serialized_size_bytes(quantize_dynamic_int8(model)) < serialized_size_bytes(model)
+
+
+def conv_backbone():
+    torch.manual_seed(0)
+    return torch.nn.Sequential(
+        torch.nn.Conv2d(1, 8, 3, padding=1), torch.nn.BatchNorm2d(8), torch.nn.ReLU(),
+        torch.nn.Conv2d(8, 16, 3, padding=1), torch.nn.ReLU()
+    ).eval()
+
+
+def test_static_int8_keeps_outputs_within_tolerance():
+    backbone = conv_backbone()
+    calibration = [image.unsqueeze(0) for image in synthetic_calibration_images(count=4, size=32)]
+    quantized = quantize_static_int8(backbone, calibration)
+
+    with torch.no_grad():
+        inputs = torch.cat(calibration)
+        assert relative_error(quantized(inputs), backbone(inputs)) < 0.1
+
+
+class FakeDenseNet(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.features = conv_backbone()
+
+
+def test_static_path_without_calibration_data_leaves_the_model_untouched():
+    with pytest.raises(ValueError, match='calibration'):
+        quantize_static_int8(conv_backbone(), [])
+
+    model = FakeDenseNet()
+    features = model.features
+    with pytest.raises(ValueError):
+        quantize_densenet(model, iter(()))
+    assert model.features is features
+
+
+def test_pipeline_keeps_fp32_densenet_when_calibration_is_missing():
+    from medical_ai_pipeline import MedicalAIPipeline
+
+    pipeline = MedicalAIPipeline.__new__(MedicalAIPipeline)
+    pipeline.densenet_model = model = FakeDenseNet()
+    features = model.features
+    pipeline.quantize = {'clip', 'densenet'}
+    pipeline.quantization_calibration_inputs = lambda: []
+
+    pipeline.quantize_densenet_model()
+    assert pipeline.densenet_model is model and model.features is features
+    assert pipeline.quantize == {'clip'}
@@ -0,0 +1,113 @@
+"""ReportCache: key normalization, LRU eviction and TTL expiry in both tiers"""
+
+import os
+import stat
+
+import pytest
+
+from services import report_cache
+from services.report_cache import ReportCache, report_cache_key
+
+DIAGNOSIS = {
+    'primary_diagnosis': 'Pneumonia',
+    'overall_confidence': 0.912,
+    'confidence_scores': {'Pneumonia': 0.912, 'Normal': 0.088}
+}
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(report_cache.time, 'time', clock)
+    return clock
+
+
+def test_key_ignores_score_jitter_and_patient_info_formatting():
+    jittered = dict(DIAGNOSIS, overall_confidence=0.914, confidence_scores={'Normal': 0.086, 'Pneumonia': 0.914})
+    assert report_cache_key(DIAGNOSIS, {'Age': 45.0, 'sex': ' Male '}, 'Chest', 0.05) == \
+        report_cache_key(jittered, {'age': 45, 'Sex': 'male', 'history': ''}, 'chest', 0.05)
+
+
+def test_key_changes_with_diagnosis_patient_or_type():
+    key = report_cache_key(DIAGNOSIS, {'age': 45}, 'chest', 0.05)
+    assert key != report_cache_key(dict(DIAGNOSIS, primary_diagnosis='Normal'), {'age': 45}, 'chest', 0.05)
+    assert key != report_cache_key(DIAGNOSIS, {'age': 46}, 'chest', 0.05)
+    assert key != report_cache_key(DIAGNOSIS, {'age': 45}, 'bone', 0.05)
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = ReportCache(max_entries=2)
+    cache.put('a', {'report': 'A'})
+    cache.put('b', {'report': 'B'})
+    assert cache.get('a') == {'report': 'A'}  # 'b' is now the least recently used
+    cache.put('c', {'report': 'C'})
+
+    assert cache.get('b') is None
+    assert cache.get('a') == {'report': 'A'}
+    assert cache.get('c') == {'report': 'C'}
+    assert cache.stats()['entries'] == 2
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = ReportCache(ttl_seconds=60)
+    cache.put('a', {'report': 'A'})
+    clock.now += 59
+    assert cache.get('a') == {'report': 'A'}
+    clock.now += 2
+    assert cache.get('a') is None
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['expired'], stats['misses'], stats['entries']) == (1, 1, 1, 0)
+
+
+def test_cached_reports_are_copies(clock):
+    cache = ReportCache()
+    cache.put('a', {'report': 'A'})
+    cache.get('a')['report'] = 'changed'
+    assert cache.get('a') == {'report': 'A'}
+
+
+def test_disk_tier_survives_a_restart_until_the_ttl(clock, tmp_path):
+    ReportCache(ttl_seconds=60, cache_dir=str(tmp_path)).put('a', {'report': 'A'})
+
+    restarted = ReportCache(ttl_seconds=60, cache_dir=str(tmp_path))
+    assert restarted.get('a') == {'report': 'A'}
+    assert restarted.stats()['disk_hits'] == 1
+
+    clock.now += 61
+    expired = ReportCache(ttl_seconds=60, cache_dir=str(tmp_path))
+    assert expired.get('a') is None
+    assert expired.stats()['expired'] == 1
+    assert not (tmp_path / 'a.json').exists()
+
+
+def test_unreadable_disk_entries_are_misses(clock, tmp_path):
+    (tmp_path / 'a.json').write_text('{not json')
+    cache = ReportCache(cache_dir=str(tmp_path))
+    assert cache.get('a') is None
+    assert cache.stats()['misses'] == 1
+
+
+def test_disk_tier_is_opt_in(tmp_path, monkeypatch):
+    monkeypatch.delenv('XRAY_AI_REPORT_CACHE_PERSIST', raising=False)
+    assert ReportCache.from_env(str(tmp_path)).cache_dir is None
+
+    monkeypatch.setenv('XRAY_AI_REPORT_CACHE_PERSIST', 'true')
+    assert ReportCache.from_env(str(tmp_path)).cache_dir == str(tmp_path / 'reports')
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='POSIX permission bits')
+def test_disk_tier_is_private_to_the_owner(clock, tmp_path):
+    cache_dir = tmp_path / 'reports'
+    ReportCache(cache_dir=str(cache_dir)).put('a', {'report': 'A'})
+
+    assert stat.S_IMODE(cache_dir.stat().st_mode) == 0o700
+    assert stat.S_IMODE((cache_dir / 'a.json').stat().st_mode) == 0o600
@@ -0,0 +1,94 @@
+"""ResultCache: key composition, model-version isolation and LRU eviction by size"""
+
+import json
+
+from services import result_cache
+from services.result_cache import ResultCache
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        self.now += 1  # Every access is strictly later than the one before
+        return self.now
+
+
+def test_key_includes_every_setting_that_changes_the_output(tmp_path):
+    cache = ResultCache(str(tmp_path / 'results.sqlite3'), version='v1')
+    key = cache.key('abc', 'chest')
+    assert key == cache.key('abc', 'chest', 1, 'full')
+    assert len({key, cache.key('abd', 'chest'), cache.key('abc', 'bone'), cache.key('abc', 'chest', 2),
+                cache.key('abc', 'chest', heatmap_mode='none')}) == 5
+    assert key != ResultCache(str(tmp_path / 'other.sqlite3'), version='v2').key('abc', 'chest')
+
+
+def test_get_returns_what_was_put(tmp_path):
+    cache = ResultCache(str(tmp_path / 'results.sqlite3'), version='v1')
+    key = cache.key('abc', 'chest')
+    assert cache.get(key) is None
+    cache.put(key, {'diagnosis': {'primary_diagnosis': 'Normal'}})
+    assert cache.get(key) == {'diagnosis': {'primary_diagnosis': 'Normal'}}
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 1)
+
+
+def test_versions_sharing_a_file_keep_each_others_rows(tmp_path):
+    path = str(tmp_path / 'results.sqlite3')
+    fp32 = ResultCache(path, version='fp32')
+    fp32.put(fp32.key('abc', 'chest'), {'precision': 'fp32'})
+
+    int8 = ResultCache(path, version='int8')
+    assert int8.get(int8.key('abc', 'chest')) is None
+    int8.put(int8.key('abc', 'chest'), {'precision': 'int8'})
+
+    assert fp32.get(fp32.key('abc', 'chest')) == {'precision': 'fp32'}
+    assert int8.get(int8.key('abc', 'chest')) == {'precision': 'int8'}
+    assert int8.stats()['entries'] == 2
+
+
+def test_least_recently_used_rows_are_evicted_over_max_bytes(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_cache.time, 'time', Clock())
+    value = {'padding': 'x' * 100}
+    size = len(json.dumps(value))
+    cache = ResultCache(str(tmp_path / 'results.sqlite3'), version='v1', max_bytes=2 * size)
+
+    cache.put('a', value)
+    cache.put('b', value)
+    cache.get('a')  # 'b' is now the least recently used
+    cache.put('c', value)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == value
+    assert cache.get('c') == value
+    stats = cache.stats()
+    assert (stats['entries'], stats['bytes'], stats['evictions']) == (2, 2 * size, 1)
+
+
+def test_values_larger_than_the_cache_are_not_stored(tmp_path):
+    cache = ResultCache(str(tmp_path / 'results.sqlite3'), version='v1', max_bytes=10)
+    cache.put('a', {'padding': 'x' * 100})
+    assert cache.get('a') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_from_env_can_disable_the_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('XRAY_AI_RESULT_CACHE', 'false')
+    assert ResultCache.from_env(str(tmp_path), 'v1') is None
+
+    monkeypatch.setenv('XRAY_AI_RESULT_CACHE', 'true')
+    monkeypatch.setenv('XRAY_AI_RESULT_CACHE_MAX_MB', '1')
+    cache = ResultCache.from_env(str(tmp_path), 'v1')
+    assert cache.db_path == str(tmp_path / 'results.sqlite3')
+    assert cache.max_bytes == 1024 * 1024
+
+
+def test_non_persistent_cache_stays_in_memory(tmp_path, monkeypatch):
+    monkeypatch.setenv('XRAY_AI_RESULT_CACHE', 'true')
+    cache = ResultCache.from_env(str(tmp_path), 'v1', persistent=False)
+    key = cache.key('abc', 'chest')
+    cache.put(key, {'diagnosis': 'Normal'})
+
+    assert cache.get(key) == {'diagnosis': 'Normal'}
+    assert cache.db_path == ':memory:'
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,75 @@
+"""RuntimeConfig and PoolSettings: environment variables, CLI flags and pass-through of other arguments"""
+
+import pytest
+
+from services import runtime_config
+from services.pipeline_worker import run_worker
+from services.runtime_config import RuntimeConfig, format_cpu_list, parse_cpu_list
+from services.worker_pool import PoolSettings
+
+
+@pytest.fixture(autouse=True)
+def clean_env(monkeypatch):
+    for env_var, _, _ in RuntimeConfig._OPTIONS.values():
+        monkeypatch.delenv(env_var, raising=False)
+    for env_var in ('XRAY_AI_WORKER_PROCESSES', 'XRAY_AI_POOL_JOB_TIMEOUT_S'):
+        monkeypatch.delenv(env_var, raising=False)
+
+
+def test_cpu_lists_round_trip():
+    assert parse_cpu_list('0-3, 8,10-11') == [0, 1, 2, 3, 8, 10, 11]
+    assert format_cpu_list([11, 0, 1, 2, 3, 8, 10]) == '0-3,8,10-11'
+    for invalid in ('', '3-1', 'a'):
+        with pytest.raises(ValueError):
+            parse_cpu_list(invalid)
+
+
+def test_environment_sets_the_defaults(monkeypatch):
+    monkeypatch.setenv('XRAY_AI_INTRA_OP_THREADS', '4')
+    monkeypatch.setenv('XRAY_AI_CPU_AFFINITY', '0-3')
+    monkeypatch.setenv('XRAY_AI_OPENCV_THREADS', '')
+
+    config, remaining = RuntimeConfig.from_args([])
+    assert config == RuntimeConfig(intra_op_threads=4, cpu_affinity='0-3')
+    assert remaining == []
+
+
+def test_flags_beat_the_environment_and_other_arguments_pass_through(monkeypatch):
+    monkeypatch.setenv('XRAY_AI_INTRA_OP_THREADS', '4')
+    monkeypatch.setenv('XRAY_AI_INTER_OP_THREADS', '2')
+
+    config, remaining = RuntimeConfig.from_args([
+        '--serve', '--intra-op-threads', '8', '--processes', '2', '--cpu-affinity=0,2', 'study.png', '--unknown'
+    ])
+    assert config.intra_op_threads == 8  # Flag
+    assert config.inter_op_threads == 2  # Environment
+    assert config.cpu_affinity == '0,2'
+    assert remaining == ['--serve', '--processes', '2', 'study.png', '--unknown']
+
+
+def test_pool_flags_beat_the_environment(monkeypatch):
+    monkeypatch.setenv('XRAY_AI_WORKER_PROCESSES', '3')
+    monkeypatch.setenv('XRAY_AI_POOL_JOB_TIMEOUT_S', '120')
+    assert (PoolSettings.from_args([]).processes, PoolSettings.from_args([]).job_timeout_seconds) == (3, 120.0)
+
+    settings = PoolSettings.from_args(['--concurrency', '2', '--processes', '0', '--job-timeout-s', '0.1'])
+    assert settings.processes == 1 and settings.job_timeout_seconds == 1.0  # Clamped
+
+
+def test_serve_rejects_mistyped_flags(capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        run_worker(pipeline=None, argv=['--proceses', '2'])
+    assert exit_info.value.code == 2
+    assert '--proceses' in capsys.readouterr().err
+
+
+def test_affinity_by_worker_index(monkeypatch):
+    monkeypatch.setattr(runtime_config, 'available_cpus', lambda: [0, 1, 2, 3, 4, 5])
+    assert RuntimeConfig(worker_index=1, cores_per_worker=2).resolve_affinity() == [2, 3]
+    assert RuntimeConfig(worker_index=3, cores_per_worker=2).resolve_affinity() == [0, 1]  # Wraps around
+    assert RuntimeConfig(cpu_affinity='4-5', worker_index=0, cores_per_worker=2).resolve_affinity() == [4, 5]
+    assert RuntimeConfig().resolve_affinity() is None
+    with pytest.raises(ValueError):
+        RuntimeConfig(cpu_affinity='6').resolve_affinity()
+    with pytest.raises(ValueError):
+        RuntimeConfig(worker_index=0, cores_per_worker=8).resolve_affinity()
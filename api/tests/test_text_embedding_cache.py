@@ -0,0 +1,70 @@
+"""TextEmbeddingCache: memory and disk hits skip the encoder, keys, and corrupt files"""
+
+import pytest
+
+torch = pytest.importorskip('torch')
+from services.text_embedding_cache import TextEmbeddingCache, prompt_set_key  # noqa: E402
+
+PROMPTS = ['chest radiograph showing pneumonia', 'normal chest radiograph']
+
+
+class Encoder:
+    """Counts calls; each prompt encodes to a fixed unnormalized vector"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, prompts):
+        self.calls += 1
+        return torch.tensor([[3.0, 4.0]] * len(prompts))
+
+
+def test_hits_skip_the_encoder(tmp_path):
+    encode = Encoder()
+    cache = TextEmbeddingCache(str(tmp_path))
+    features = cache.get_or_compute('ViT-B-32|laion', PROMPTS, encode, 'cpu')
+    assert torch.allclose(features, torch.tensor([[0.6, 0.8]] * 2))
+    assert cache.get_or_compute('ViT-B-32|laion', PROMPTS, encode, 'cpu') is features
+
+    # A restarted process reads the persisted matrix instead of encoding
+    restarted = TextEmbeddingCache(str(tmp_path))
+    assert torch.equal(restarted.get_or_compute('ViT-B-32|laion', PROMPTS, encode, 'cpu'), features)
+    assert encode.calls == 1
+    assert (cache.stats()['hits'], cache.stats()['misses'], restarted.stats()['disk_hits']) == (1, 1, 1)
+
+
+def test_key_changes_with_model_and_prompt_set():
+    key = prompt_set_key('ViT-B-32|laion', PROMPTS)
+    assert key == prompt_set_key('ViT-B-32|laion', list(PROMPTS))
+    assert key != prompt_set_key('ViT-B-32|openai', PROMPTS)
+    assert key != prompt_set_key('ViT-B-32|laion', PROMPTS[::-1])
+    assert key != prompt_set_key('ViT-B-32|laion', PROMPTS[:1])
+    # Prompts are delimited, so moving text between them changes the key
+    assert prompt_set_key('m', ['ab', 'c']) != prompt_set_key('m', ['a', 'bc'])
+
+    encode = Encoder()
+    cache = TextEmbeddingCache(persist=False)
+    cache.get_or_compute('ViT-B-32|laion', PROMPTS, encode, 'cpu')
+    cache.get_or_compute('ViT-B-32|openai', PROMPTS, encode, 'cpu')
+    cache.get_or_compute('ViT-B-32|laion', PROMPTS[:1], encode, 'cpu')
+    assert encode.calls == 3
+
+
+@pytest.mark.parametrize('contents', [b'not a torch file', None])
+def test_corrupt_cache_files_are_rebuilt(tmp_path, contents):
+    path = tmp_path / 'text_features' / f"{prompt_set_key('m', PROMPTS)}.pt"
+    path.parent.mkdir()
+    if contents is None:
+        torch.save(torch.zeros(2, 2), path)  # Loadable, but not a cache payload
+    else:
+        path.write_bytes(contents)
+
+    encode = Encoder()
+    cache = TextEmbeddingCache(str(tmp_path))
+    features = cache.get_or_compute('m', PROMPTS, encode, 'cpu')
+    assert encode.calls == 1
+    assert cache.stats()['misses'] == 1
+
+    # The rebuilt file is valid again
+    assert torch.equal(TextEmbeddingCache(str(tmp_path)).get_or_compute('m', PROMPTS, encode, 'cpu'), features)
+    assert encode.calls == 1
@@ -0,0 +1,138 @@
+"""InferencePool with a trivial fake pipeline: crash and hang recovery, and clean shutdown"""
+
+import gc
+import os
+import time
+
+import pytest
+
+from services.runtime_config import RuntimeConfig
+from services.worker_pool import InferencePool, PoolSettings, WorkerCrashedError
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'fork'), reason='the pool forks its workers')
+
+
+class FakePipeline:
+    """Answers with the worker's pid; the paths 'crash' and 'hang' misbehave"""
+
+    def __init__(self):
+        self.runtime_config = RuntimeConfig()
+        self.runtime_settings = {}
+        self.onnx_models = {}
+
+    def prepare_for_fork(self, share_memory=False):
+        pass
+
+    def after_fork(self, runtime_config):
+        self.runtime_settings = {'worker': runtime_config.worker_index}
+
+    def get_cache_stats(self):
+        return {'results': {'hits': 0, 'misses': 0}}
+
+    def complete_analysis_batch(self, image_paths, on_event=None, on_result=None, **kwargs):
+        results = []
+        for index, path in enumerate(image_paths):
+            if path == 'crash':
+                os._exit(3)
+            if path == 'hang':
+                time.sleep(3600)
+            result = {'path': path, 'pid': os.getpid()}
+            if on_result is not None:
+                on_result(index, result)
+            results.append(result)
+        return results
+
+
+def running(pid):
+    """True while ``pid`` exists and is not a zombie"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+    except OSError:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        return True
+
+
+def wait_until(condition, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return condition()
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(processes=1, job_timeout_seconds=600.0):
+        settings = PoolSettings(processes=processes, heartbeat_seconds=0.1,
+                                job_timeout_seconds=job_timeout_seconds, start_timeout_seconds=30.0)
+        pool = InferencePool(FakePipeline(), settings)
+        pool.start()
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.stop()
+
+
+def test_jobs_run_in_the_workers(make_pool):
+    pool = make_pool(processes=2)
+    results = pool.complete_analysis_batch(['a.png', 'b.png'])
+    assert [result['path'] for result in results] == ['a.png', 'b.png']
+    assert results[0]['pid'] in {worker['pid'] for worker in pool.stats()['workers']}
+    assert results[0]['pid'] != os.getpid()
+
+
+def test_crashed_worker_is_respawned(make_pool):
+    pool = make_pool()
+    first_pid = pool.stats()['workers'][0]['pid']
+
+    with pytest.raises(WorkerCrashedError, match='exited with code 3'):
+        pool.complete_analysis_batch(['crash'])
+
+    result, = pool.complete_analysis_batch(['a.png'])
+    assert result['pid'] != first_pid
+    worker = pool.stats()['workers'][0]
+    assert (worker['crashes'], worker['restarts'], worker['failures']) == (1, 1, 1)
+    assert not running(first_pid)
+
+
+def test_hung_job_times_out_and_the_worker_is_replaced(make_pool):
+    pool = make_pool(job_timeout_seconds=1.0)
+    hung_pid = pool.stats()['workers'][0]['pid']
+
+    started = time.time()
+    with pytest.raises(WorkerCrashedError, match='job timeout'):
+        pool.submit({'image_paths': ['hang']}).result(timeout=15)
+    assert 1.0 <= time.time() - started < 15
+
+    assert wait_until(lambda: not running(hung_pid))
+    result, = pool.complete_analysis_batch(['a.png'])
+    assert result['pid'] != hung_pid
+
+
+def test_stop_leaves_no_children_and_the_parent_collecting(make_pool):
+    pool = make_pool(processes=2)
+    assert gc.get_freeze_count() == 0  # Only the zygote and the workers keep the frozen objects
+
+    zygote_pid = pool._zygote.process.pid
+    worker_pids = [worker['pid'] for worker in pool.stats()['workers']]
+    pending = pool.submit({'image_paths': ['hang']})
+    time.sleep(0.3)  # Let a worker pick the job up
+    pool.stop(timeout=2.0)
+
+    with pytest.raises(RuntimeError, match='stopped'):
+        pending.result(timeout=5)
+    assert wait_until(lambda: not any(running(pid) for pid in worker_pids + [zygote_pid]))
+    assert pool.health()['ready'] == 0
+    with pytest.raises(RuntimeError, match='not running'):
+        pool.submit({'image_paths': ['a.png']})
@@ -40,38 +40,13 @@ const upload = multer({
   }
 })
 
-// Helper function to save temporary image
-const saveTempImage = async (imageBuffer) => {
-  const tempPath = path.join(__dirname, `temp_xray_${Date.now()}.jpg`)
-  fs.writeFileSync(tempPath, imageBuffer)
-  return tempPath
-}
-
-// Helper function to clean up temporary file
-const cleanupTempFile = async (tempPath) => {
-  try {
-    if (fs.existsSync(tempPath)) {
-      fs.unlinkSync(tempPath)
-      console.log('🗑️ Arquivo temporário removido')
-    }
-  } catch (error) {
-    console.warn('⚠️ Erro ao remover arquivo temporário:', error.message)
-  }
-}
-
 // Complete Medical AI Analysis with MONAI + MedCLIP + DeepSeek 3.1
 const analyzeXRay = async (imageBuffer, patientInfo, xrayType = 'chest') => {
   try {
     console.log('🔬 Iniciando análise médica completa...')
     
-    // Save image temporarily
-    const tempPath = await saveTempImage(imageBuffer)
-    
-    // Run complete medical AI pipeline
-    const analysisResult = await runMedicalAIPipeline(tempPath, xrayType, patientInfo)
-    
-    // Clean up temp file
-    await cleanupTempFile(tempPath)
+    // Run complete medical AI pipeline (image bytes go through stdin, no temp file)
+    const analysisResult = await runMedicalAIPipeline(imageBuffer, xrayType, patientInfo)
     
     return analysisResult
     
@@ -82,18 +57,24 @@ const analyzeXRay = async (imageBuffer, patientInfo, xrayType = 'chest') => {
 }
 
 // Run complete medical AI pipeline
-const runMedicalAIPipeline = async (imagePath, xrayType, patientInfo) => {
+const runMedicalAIPipeline = async (imageBuffer, xrayType, patientInfo) => {
   return new Promise((resolve, reject) => {
     const pythonScript = path.join(__dirname, 'api', 'medical_ai_pipeline.py')
     
     const pythonExecutable = process.env.PYTHON_PATH || 'python'
+    // "-" makes the pipeline read the encoded image from stdin
     const pythonProcess = spawn(pythonExecutable, [
       pythonScript,
-      imagePath,
+      '-',
       xrayType,
       JSON.stringify(patientInfo)
     ], { env: { ...process.env, PYTHONIOENCODING: 'utf-8', PYTHONUTF8: '1' } })
 
+    pythonProcess.stdin.on('error', (error) => {
+      console.warn('⚠️ Falha ao enviar imagem para o pipeline:', error.message)
+    })
+    pythonProcess.stdin.end(imageBuffer)
+
     let output = ''
     let errorOutput = ''
 
@@ -826,12 +807,6 @@ app.post('/api/analyze-xray', upload.single('image'), async (req, res) => {
     console.log('🔍 DEBUG: X-ray type:', xrayType)
     console.log('🔍 DEBUG: Patient info:', patientInfo)
     
-    // Save image temporarily
-    const tempImagePath = path.join(__dirname, 'temp_image.jpg')
-    console.log('🔍 DEBUG: Salvando imagem temporária em:', tempImagePath)
-    fs.writeFileSync(tempImagePath, req.file.buffer)
-    console.log('🔍 DEBUG: Imagem salva com sucesso')
-    
     // Verify Python script exists
     const pythonScript = path.join(__dirname, 'api', 'medical_ai_pipeline.py')
     console.log('🔍 DEBUG: Python script path:', pythonScript)
@@ -839,14 +814,19 @@ app.post('/api/analyze-xray', upload.single('image'), async (req, res) => {
     
     // Call Python script via subprocess
     console.log('🔍 DEBUG: Iniciando processo Python...')
+    // "-" makes the pipeline read the uploaded image from stdin, no temp file needed
     const pythonProcess = spawn('python', [
       pythonScript,
-      tempImagePath,
+      '-',
       xrayType,
       patientInfo
     ])
     
     console.log('🔍 DEBUG: Processo Python iniciado com PID:', pythonProcess.pid)
+    pythonProcess.stdin.on('error', (e) => {
+      console.log('⚠️ DEBUG: Could not write image to Python stdin:', e.message)
+    })
+    pythonProcess.stdin.end(req.file.buffer)
     
     let result = ''
     let error = ''
@@ -877,14 +857,6 @@ app.post('/api/analyze-xray', upload.single('image'), async (req, res) => {
       // Clear timeout
       clearTimeout(timeout)
       
-      // Clean up temp file
-      try {
-        fs.unlinkSync(tempImagePath)
-        console.log('🔍 DEBUG: Temp file deleted successfully')
-      } catch (e) {
-        console.log('⚠️ DEBUG: Could not delete temp file:', e.message)
-      }
-      
       if (code === 0) {
         console.log('✅ DEBUG: Python process completed successfully')
         try {